@@ -1,4 +1,11 @@
+from datetime import date, timedelta
+
 from django.contrib import admin
+from django.contrib.admin.views.main import ChangeList
+from django.db import connections
+from django.db.models import Max, Min
+from django.utils.translation import ugettext_lazy as _
+from committees import search
 from committees.models import *
 
 class AttachmentInline(admin.TabularInline):
@@ -7,31 +14,143 @@ class AttachmentInline(admin.TabularInline):
     max_num = 15
 
 
+class YearListFilter(admin.SimpleListFilter):
+    """Filters by year, offering only the years present in the data.
+
+    The years run from the earliest ``first_field`` to the latest of
+    ``last_fields`` in ``bounds_model``, by default ``field`` of the admin's
+    model. With ``open_ended`` they run at least to this year."""
+    parameter_name = 'year'
+    field = None
+    bounds_model = None
+    first_field = None
+    last_fields = ()
+    open_ended = False
+
+    def lookups(self, request, model_admin):
+        model = self.bounds_model or model_admin.model
+        first_field = self.first_field or self.field
+        aggregates = dict(('last_%s' % i, Max(f)) for i, f in enumerate(self.last_fields or (first_field,)))
+        bounds = model._default_manager.aggregate(first=Min(first_field), **aggregates)
+        first = bounds.pop('first')
+        if not first:
+            return ()
+        last = max([value.year for value in bounds.values() if value] + [first.year])
+        if self.open_ended:
+            last = max(last, date.today().year)
+        return [(str(y), str(y)) for y in range(last, first.year - 1, -1)]
+
+    def year_range(self):
+        year = int(self.value())
+        return date(year, 1, 1), date(year, 12, 31)
+
+    def queryset(self, request, queryset):
+        if self.value():
+            first, last = self.year_range()
+            return queryset.filter(**{'%s__gte' % self.field: first, '%s__lt' % self.field: last + timedelta(days=1)})
+        return queryset
+
+class TermRunningFilter(YearListFilter):
+    """Terms running at any point of a year."""
+    title = _('running in')
+    parameter_name = 'running'
+    field = 'start'
+    last_fields = ('start', 'end')
+    # Terms without an end are still running.
+    open_ended = True
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.overlapping(*self.year_range())
+        return queryset
+
+class TermStatusFilter(admin.SimpleListFilter):
+    title = _('status')
+    parameter_name = 'status'
+
+    def lookups(self, request, model_admin):
+        return (('active', _('Active')), ('past', _('Ended')), ('future', _('Not started')))
+
+    def queryset(self, request, queryset):
+        today = date.today()
+        if self.value() == 'active':
+            return queryset.active_on(today)
+        if self.value() == 'past':
+            return queryset.filter(end__lt=today)
+        if self.value() == 'future':
+            return queryset.filter(start__gt=today)
+        return queryset
+
 class TermAdmin(admin.ModelAdmin):
     list_display = ('person', 'office', 'group', 'start', 'end', 'alternate','is_active',)
-    search_fields = ('person','group',)
-    list_filter = ( 'person','group',  )
+    search_fields = ('person__first_name', 'person__last_name', 'person__slug', 'group__title', 'office__title',)
+    list_filter = (TermStatusFilter, TermRunningFilter, 'group', 'alternate',)
+    raw_id_fields = ('person',)
+    date_hierarchy = 'start'
+
+    def queryset(self, request):
+        # Person and office are nullable, which plain select_related() skips.
+        qs = super(TermAdmin, self).queryset(request).select_related('person', 'office__group__type', 'group__type')
+        today = date.today()
+        qn = connections[qs.db].ops.quote_name
+        active = 'CASE WHEN %(t)s.%(start)s <= %%s AND (%(t)s.%(end)s IS NULL OR %(t)s.%(end)s >= %%s) THEN 1 ELSE 0 END' % {
+            't': qn(Term._meta.db_table), 'start': qn('start'), 'end': qn('end')}
+        return qs.extra(select={'is_active_now': active}, select_params=(today, today))
 
     def is_active(self, object_):
-        return object_.active
+        return bool(object_.is_active_now)
     is_active.short_description=u'Active?'
     is_active.boolean = True
+    is_active.admin_order_field = 'is_active_now'
 
 admin.site.register(Term, TermAdmin)
 
+class FullTextChangeList(ChangeList):
+    """Answers the changelist search box from the full-text index."""
+
+    def get_query_set(self, request):
+        query, self.query = self.query, ''
+        qs = super(FullTextChangeList, self).get_query_set(request)
+        self.query = query
+        if query:
+            qs = qs.filter(pk__in=search.search_ids(query, self.model_admin.search_kind))
+        return qs
+
+class MeetingYearFilter(YearListFilter):
+    title = _('meeting year')
+    field = 'meeting__start'
+    bounds_model = Meeting
+    first_field = 'start'
+
 class MinutesAdmin(admin.ModelAdmin):
     list_display = ('meeting', 'draft', 'call_to_order', 'adjournment', 'signed', 'signed_date',)
-    search_fields = ('content','members_present','meeting',)
-    filter_horizontal = ('members_present', 'guests_present','members_present_new','guests_present',)
+    list_filter = ('draft', MeetingYearFilter, 'meeting__group',)
+    search_fields = ('content',)
+    search_kind = SearchDocument.KIND_MINUTES
+    raw_id_fields = ('meeting', 'signed', 'members_present', 'others_present', 'members_present_new', 'guests_present',)
     inlines = [
         AttachmentInline,
     ]
 
+    def queryset(self, request):
+        return super(MinutesAdmin, self).queryset(request).select_related('meeting__group__type', 'signed')
+
+    def get_changelist(self, request, **kwargs):
+        return FullTextChangeList
+
 admin.site.register(Minutes, MinutesAdmin)
     
 admin.site.register(GroupType)
 admin.site.register(GroupPhoto)
 admin.site.register(Group)
 admin.site.register(Office)
-admin.site.register(Person)
+
+class PersonAdmin(admin.ModelAdmin):
+    list_display = ('last_name', 'first_name', 'slug', 'member', 'email',)
+    list_filter = ('member',)
+    search_fields = ('first_name', 'last_name', 'slug', 'email',)
+    raw_id_fields = ('user', 'photo',)
+    prepopulated_fields = {'slug': ('first_name', 'last_name',)}
+
+admin.site.register(Person, PersonAdmin)
 admin.site.register(Meeting)
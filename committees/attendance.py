@@ -0,0 +1,195 @@
+'''Attendance rollups per person, group and year.
+
+``AttendanceRollup`` rows are computed with GROUP BY queries over the two
+attendance relations of minutes: ``members_present`` (terms) and
+``members_present_new`` (people), counting a person once per minutes when
+both name them. Signal receivers recompute only the group and year an
+attendance change, term, or moved minutes or meeting touches, each in one
+transaction; ``rebuild()`` with no arguments recomputes everything, as the
+rebuild_attendance command does.
+'''
+from datetime import date, datetime
+
+from django.db import connections, router, transaction
+
+from committees.cache import bump_generation
+from committees.models import AttendanceRollup, Meeting, Minutes, Term
+
+def _filters(group_id, year):
+    where, params = [], []
+    if group_id is not None:
+        where.append('mt.%s = %%s' % _qn()(Meeting._meta.get_field('group').column))
+        params.append(group_id)
+    if year is not None:
+        where.append('e.%s >= %%s AND e.%s < %%s' % (_qn()('start'), _qn()('start')))
+        params.extend([datetime(year, 1, 1), datetime(year + 1, 1, 1)])
+    return where, params
+
+def _connection():
+    return connections[router.db_for_write(AttendanceRollup)]
+
+def _qn():
+    return _connection().ops.quote_name
+
+def _meeting_joins():
+    '''JOINs from minutes ``mi`` to their meetings ``mt`` and EventTime ``e``.
+
+    Written in order after ``mi``, as SQLite rejects nested joins.'''
+    qn = _qn()
+    start = Meeting._meta.get_field('start')
+    return ('INNER JOIN %(meeting)s mt ON mt.%(meeting_pk)s = mi.%(meeting_id)s '
+            'INNER JOIN %(event)s e ON e.%(event_pk)s = mt.%(meeting_pk)s' % {
+                'meeting': qn(Meeting._meta.db_table),
+                'meeting_pk': qn(Meeting._meta.pk.column), 'meeting_id': qn(Minutes._meta.get_field('meeting').column),
+                'event': qn(start.model._meta.db_table), 'event_pk': qn(start.model._meta.pk.column)})
+
+def _year_sql():
+    return 'CAST(%s AS INTEGER)' % _connection().ops.date_extract_sql('year', 'e.%s' % _qn()('start'))
+
+def meeting_counts(group_id=None, year=None):
+    '''``(group_id, year, minutes)`` rows from one GROUP BY.'''
+    qn = _qn()
+    where, params = _filters(group_id, year)
+    group = 'mt.%s' % qn(Meeting._meta.get_field('group').column)
+    sql = 'SELECT %s, %s, COUNT(*) FROM %s mi %s%s GROUP BY %s, %s' % (
+        group, _year_sql(), qn(Minutes._meta.db_table), _meeting_joins(),
+        where and ' WHERE ' + ' AND '.join(where) or '', group, _year_sql())
+    cursor = _connection().cursor()
+    cursor.execute(sql, params)
+    return cursor.fetchall()
+
+def attendance_counts(group_id=None, year=None):
+    '''``(person_id, group_id, year, attended)`` rows from one GROUP BY over
+    the union of both attendance relations.'''
+    qn = _qn()
+    where, params = _filters(group_id, year)
+    group = 'mt.%s' % qn(Meeting._meta.get_field('group').column)
+    new = Minutes.members_present_new.through._meta
+    old = Minutes.members_present.through._meta
+    term_person = qn(Term._meta.get_field('person').column)
+    selects = [
+        'SELECT t.%(person)s AS person_id, %(group)s AS group_id, %(year)s AS year, mi.%(pk)s AS minutes_id '
+        'FROM %(through)s t INNER JOIN %(minutes_table)s mi ON mi.%(pk)s = t.%(minutes)s %(joins)s%(where)s' % {
+            'person': qn(new.get_field('person').column), 'group': group, 'year': _year_sql(),
+            'pk': qn(Minutes._meta.pk.column), 'through': qn(new.db_table), 'joins': _meeting_joins(),
+            'minutes_table': qn(Minutes._meta.db_table),
+            'minutes': qn(new.get_field('minutes').column),
+            'where': where and ' WHERE ' + ' AND '.join(where) or ''},
+        'SELECT tm.%(person)s, %(group)s, %(year)s, mi.%(pk)s '
+        'FROM %(through)s t INNER JOIN %(term)s tm ON tm.%(term_pk)s = t.%(term_id)s '
+        'INNER JOIN %(minutes_table)s mi ON mi.%(pk)s = t.%(minutes)s %(joins)s WHERE %(where)s' % {
+            'person': term_person, 'group': group, 'year': _year_sql(), 'pk': qn(Minutes._meta.pk.column),
+            'minutes_table': qn(Minutes._meta.db_table),
+            'through': qn(old.db_table), 'term': qn(Term._meta.db_table), 'term_pk': qn(Term._meta.pk.column),
+            'term_id': qn(old.get_field('term').column), 'joins': _meeting_joins(),
+            'minutes': qn(old.get_field('minutes').column),
+            'where': ' AND '.join(['tm.%s IS NOT NULL' % term_person] + where)},
+    ]
+    # UNION drops the rows of people recorded through both relations.
+    sql = ('SELECT a.person_id, a.group_id, a.year, COUNT(*) FROM (%s UNION %s) a '
+           'GROUP BY a.person_id, a.group_id, a.year' % tuple(selects))
+    cursor = _connection().cursor()
+    cursor.execute(sql, params + params)
+    return cursor.fetchall()
+
+def rebuild(group_id=None, year=None):
+    '''Recomputes the rollups of one group and year, or of any matching rows.
+
+    Runs in a transaction, the caller's if there is one, so readers never
+    see the rollups deleted and not yet recreated.'''
+    using = _connection().alias
+    if transaction.is_managed(using=using):
+        return _rebuild(group_id, year)
+    with transaction.commit_on_success(using=using):
+        return _rebuild(group_id, year)
+
+def _rebuild(group_id, year):
+    rollups = AttendanceRollup.objects.all()
+    terms = Term.objects.filter(person__isnull=False)
+    if group_id is not None:
+        rollups = rollups.filter(group=group_id)
+        terms = terms.filter(group=group_id)
+    if year is not None:
+        rollups = rollups.filter(year=year)
+        terms = terms.overlapping(date(year, 1, 1), date(year, 12, 31))
+    rollups.delete()
+
+    meetings = dict(((g, y), n) for g, y, n in meeting_counts(group_id, year))
+    attended = dict(((p, g, y), n) for p, g, y, n in attendance_counts(group_id, year))
+    # Term holders who missed every meeting of a year get a row too.
+    this_year = date.today().year
+    for person_id, term_group_id, start, end in terms.values_list('person', 'group', 'start', 'end'):
+        for y in range(start.year, min(end and end.year or this_year, this_year) + 1):
+            if (term_group_id, y) in meetings and (year is None or y == year):
+                attended.setdefault((person_id, term_group_id, y), 0)
+    AttendanceRollup.objects.bulk_create([
+        AttendanceRollup(person_id=p, group_id=g, year=y, attended=n, meetings=meetings.get((g, y), 0))
+        for (p, g, y), n in attended.items()], batch_size=500)
+    return len(attended)
+
+def _group_years(minutes_ids):
+    return set((group_id, start.year) for group_id, start in
+               Meeting.objects.filter(minutes__in=minutes_ids).values_list('group', 'start'))
+
+def _meeting_group_years(meeting_ids):
+    return set((group_id, start.year) for group_id, start in
+               Meeting.objects.filter(pk__in=meeting_ids).values_list('group', 'start'))
+
+def _rebuild_all(group_years):
+    for group_id, year in group_years:
+        rebuild(group_id, year)
+
+def attendance_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        # Attendance is rendered in generation-versioned pages.
+        bump_generation()
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            _rebuild_all(_group_years([instance.pk]))
+        return
+    # From the person or term side pk_set holds minutes, and is empty on clear.
+    if action == 'pre_clear':
+        field = [f for f in sender._meta.fields if f.rel and f.rel.to is type(instance)][0]
+        instance._attendance_cleared = _group_years(
+            sender.objects.filter(**{field.name: instance}).values_list('minutes', flat=True))
+    elif action == 'post_clear':
+        _rebuild_all(getattr(instance, '_attendance_cleared', ()))
+    elif action in ('post_add', 'post_remove'):
+        _rebuild_all(_group_years(pk_set))
+
+def minutes_saved(sender, instance, created=False, raw=False, **kwargs):
+    # Attendance itself changes through the m2m signals. New minutes add a
+    # meeting to their year even if nobody is recorded, and moved minutes
+    # change two years.
+    if raw:
+        pass
+    elif created:
+        _rebuild_all(_meeting_group_years([instance.meeting_id]))
+    elif instance.meeting_id != instance._original_meeting_id:
+        _rebuild_all(_meeting_group_years([instance.meeting_id, instance._original_meeting_id]))
+    instance._original_meeting_id = instance.meeting_id
+
+def meeting_saved(sender, instance, created=False, raw=False, **kwargs):
+    original_start = instance._original_start
+    if not (raw or created) and original_start is not None and instance._original_group_id is not None:
+        group_years = set([(instance._original_group_id, original_start.year), (instance.group_id, instance.start.year)])
+        if len(group_years) > 1 and Minutes.objects.filter(meeting=instance).exists():
+            _rebuild_all(group_years)
+    instance._original_group_id = instance.group_id
+    instance._original_start = instance.start
+
+def minutes_deleting(sender, instance, **kwargs):
+    # The meeting may be deleted in the same cascade, so look it up first.
+    instance._attendance_group_years = _group_years([instance.pk])
+
+def minutes_deleted(sender, instance, **kwargs):
+    _rebuild_all(getattr(instance, '_attendance_group_years', ()))
+
+def term_changed(sender, instance, raw=False, **kwargs):
+    if raw or not instance.person_id:
+        return
+    this_year = date.today().year
+    years = range(instance.start.year, min(instance.end and instance.end.year or this_year, this_year) + 1)
+    groups = set([instance.group_id, instance._original_group_id])
+    groups.discard(None)
+    _rebuild_all((group_id, year) for group_id in groups for year in years)
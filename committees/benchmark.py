@@ -0,0 +1,233 @@
+'''Synthetic organizations and a benchmark of the committees views.
+
+``generate()`` fills the database with a seeded, reproducible organization:
+a board and committees with consecutive office terms, member terms, monthly
+meetings with minutes and attendance. ``run()`` times each view and the
+template tags against it and counts their queries, cold (right after the
+cache generation is bumped) and warm, for comparison with stored baselines.
+
+Everything runs on the test database, so SQLite is enough; see the
+benchmark_committees command.
+'''
+import json
+import os
+import random
+import time
+from datetime import date, datetime, timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.db import connections, router, transaction
+from django.template import Context, Template
+from django.test.client import RequestFactory
+from django.utils import timezone
+from eventy.models import Calendar, Event, EventTime
+
+from committees import views
+from committees.cache import bump_generation
+from committees.models import Group, GroupType, Meeting, Minutes, Office, OfficeHolding, Person, RosterEntry, Term
+
+SCALES = {
+    'small': {'groups': 10, 'people': 300, 'terms': 1000, 'meetings': 1000},
+    'medium': {'groups': 100, 'people': 3000, 'terms': 20000, 'meetings': 20000},
+    'large': {'groups': 500, 'people': 20000, 'terms': 200000, 'meetings': 200000},
+}
+
+BASELINES = os.path.join(os.path.dirname(__file__), 'benchmark_baselines.json')
+
+# Timings within this many seconds of their baseline are noise, however
+# many times the baseline they are.
+TIME_NOISE = 0.01
+
+OFFICES = ('President', 'Secretary', 'Treasurer')
+TERM_YEARS = 2
+ATTENDEES = 5
+
+def _insert_meetings(meetings, using):
+    '''Inserts meetings without saving them one by one.
+
+    ``bulk_create`` refuses multi-table children, so the EventTime parents
+    are bulk created first, found again by their slugs, and the Meeting rows
+    inserted with the same insert query ``save()`` uses for the child table.'''
+    EventTime.objects.using(using).bulk_create([EventTime(
+        event_id=m.event_id, start=m.start, end=m.end, place_string=m.place_string, slug=m.slug) for m in meetings])
+    pks = dict(EventTime.objects.using(using).filter(slug__in=[m.slug for m in meetings]).values_list('slug', 'pk'))
+    fields = Meeting._meta.local_fields
+    for m in meetings:
+        m.eventtime_ptr_id = pks[m.slug]
+        m.render_markup()
+    size = max(connections[using].ops.bulk_batch_size(fields, meetings), 1)
+    for i in range(0, len(meetings), size):
+        Meeting._base_manager._insert(meetings[i:i + size], fields=fields, using=using)
+
+@transaction.commit_on_success
+def generate(groups, people, terms, meetings, seed=0):
+    '''Creates an organization of roughly the given size. Returns the board.'''
+    using = router.db_for_write(Meeting)
+    rnd = random.Random(seed)
+    today = date.today()
+    board_type = GroupType.objects.create(title='Board', slug='board', order=10)
+    committee_type = GroupType.objects.create(title='Committee', slug='committee', order=20)
+
+    group_objects = [Group(
+        title=i and 'Committee %s' % i or 'Governing Board', slug=i and 'committee-%s' % i or 'governing-board',
+        type=i and committee_type or board_type, order=i and 20 or 10, ex_officio=bool(i),
+        description='The *%s* group.' % i) for i in range(groups)]
+    for group in group_objects:
+        group.render_markup()
+    Group.objects.bulk_create(group_objects)
+    group_ids = list(Group.objects.order_by('order', 'pk').values_list('pk', flat=True))
+
+    Office.objects.bulk_create([Office(title=title, group_id=group_id,
+                                       order=order, ex_officio=(group_id == group_ids[0] and order == 0))
+                                for group_id in group_ids for order, title in enumerate(OFFICES)])
+    # bulk_create runs AutoSlugField's pre_save too, which slugs every office
+    # of a title alike, as none of them is in the table yet.
+    for pk, group_id, title in Office.objects.values_list('pk', 'group', 'title'):
+        Office.objects.filter(pk=pk).update(slug='%s-%s' % (title.lower(), group_id))
+    offices = list(Office.objects.values_list('pk', 'group'))
+
+    Person.objects.bulk_create([Person(first_name='First%s' % i, last_name='Last%s' % i, slug='person-%s' % i)
+                                for i in range(people)])
+    person_ids = list(Person.objects.values_list('pk', flat=True))
+
+    # Offices are held in consecutive terms going back from today, so an
+    # office and a start year name one term; the rest are member seats.
+    office_terms = min(terms // 3, len(offices) * 20)
+    term_objects = []
+    for i in range(office_terms):
+        office_id, group_id = offices[i % len(offices)]
+        start = date(today.year - TERM_YEARS * (i // len(offices)), 1, 1)
+        end = None if i < len(offices) else date(start.year + TERM_YEARS - 1, 12, 31)
+        term_objects.append(Term(group_id=group_id, office_id=office_id, person_id=rnd.choice(person_ids),
+                                 start=start, end=end))
+    for i in range(terms - office_terms):
+        start = today - timedelta(days=rnd.randint(0, 365 * 30))
+        end = start + timedelta(days=365 * TERM_YEARS)
+        term_objects.append(Term(group_id=rnd.choice(group_ids), person_id=rnd.choice(person_ids), start=start,
+                                 end=end if end < today or rnd.random() < 0.5 else None, alternate=rnd.random() < 0.1))
+    Term.objects.bulk_create(term_objects)
+
+    calendar = Calendar.objects.create(title='Governance', slug='governance')
+    event = Event.objects.create(title='Meeting', slug='meeting', calendar=calendar)
+    # Monthly meetings per group going back from this month, so a group,
+    # year and month name one meeting.
+    meeting_objects = []
+    per_group = max(meetings // len(group_ids), 1)
+    for n, group_id in enumerate(group_ids):
+        for i in range(per_group):
+            year, month = divmod(today.year * 12 + today.month - 1 - i, 12)
+            start = datetime(year, month + 1, 1, 19)
+            if settings.USE_TZ:
+                start = timezone.make_aware(start, timezone.get_default_timezone())
+            meeting_objects.append(Meeting(
+                event_id=event.pk, group_id=group_id, start=start, end=start + timedelta(hours=2),
+                slug='bench-%s-%s' % (n, i), agenda=i % 5 == 0 and 'Budget.\n\nRoof repairs.' or None))
+    for i in range(0, len(meeting_objects), 5000):
+        _insert_meetings(meeting_objects[i:i + 5000], using)
+
+    # Every minutes has the same text, so it is rendered once.
+    prototype = Minutes(content='The meeting was *called to order*.')
+    prototype.render_markup()
+    meeting_ids = list(Meeting.objects.values_list('pk', flat=True))
+    for i in range(0, len(meeting_ids), 5000):
+        batch = meeting_ids[i:i + 5000]
+        Minutes.objects.bulk_create([Minutes(
+            meeting_id=pk, content=prototype.content, rendered_content=prototype.rendered_content,
+            content_hash=prototype.content_hash, signed_id=rnd.choice(person_ids), draft=False) for pk in batch])
+        minutes_ids = Minutes.objects.filter(meeting__in=batch).values_list('pk', flat=True)
+        through = Minutes.members_present_new.through
+        through.objects.bulk_create([through(minutes_id=pk, person_id=person_id) for pk in minutes_ids
+                                     for person_id in set(rnd.sample(person_ids, min(ATTENDEES, len(person_ids))))])
+
+    # Bulk writes send no signals, so derived tables are built here.
+    for office_id, group_id in offices:
+        OfficeHolding.objects.rebuild(office_id)
+    for group in Group.objects.all():
+        RosterEntry.objects.rebuild(group)
+    bump_generation()
+    return Group.objects.get(slug='governing-board')
+
+TAGS_TEMPLATE = ('{% load committee_tags %}'
+                 '{% get_committee_groups active order 10 as board %}{% get_committee_groups active order 20 as committees %}'
+                 '{% for c in committees %}{% for t in c.current_terms %}{{t.person_id}}{% endfor %}{% endfor %}'
+                 "{% get_office 'OFFICE' as office %}{{office.current}}"
+                 '{% get_committee_minutes_list for meetings as pairs %}{% for m, minutes in pairs %}{{minutes.pk}}{% endfor %}')
+
+def cases(board):
+    '''``(name, callable)`` pairs for each view and the template tags.'''
+    factory = RequestFactory()
+    def request(path='/'):
+        r = factory.get(path)
+        r.user = AnonymousUser()
+        return r
+    meeting = Meeting.objects.filter(group=board, start__lte=timezone.now()).order_by('-start')[0]
+    start = timezone.is_aware(meeting.start) and timezone.localtime(meeting.start) or meeting.start
+    term = Term.objects.filter(group=board, office__isnull=False).select_related('office').order_by('-start')[0]
+    meetings = list(Meeting.objects.filter(group=board).order_by('-start')[:20])
+    template = Template(TAGS_TEMPLATE.replace('OFFICE', term.office.slug))
+    return [
+        ('index', lambda: views.index(request())),
+        ('group_detail', lambda: views.group_detail(request(), board.slug)),
+        ('group_meeting_list', lambda: views.group_meeting_list(request(), board.slug)),
+        ('group_meeting_detail', lambda: views.group_meeting_detail(request(), board.slug, start.year, start.month)),
+        ('term_detail', lambda: views.term_detail(request(), board.slug, term.office.slug, term.start.year)),
+        ('template_tags', lambda: template.render(Context({'meetings': meetings}))),
+    ]
+
+def measure(func, using):
+    connection = connections[using]
+    debug, connection.use_debug_cursor = connection.use_debug_cursor, True
+    first = len(connection.queries)
+    try:
+        started = time.time()
+        func()
+        elapsed = time.time() - started
+    finally:
+        connection.use_debug_cursor = debug
+    return elapsed, len(connection.queries) - first
+
+def run(board, repeat=3):
+    '''Returns ``{case: {'queries', 'time', 'warm_queries', 'warm_time'}}``,
+    keeping the fastest of ``repeat`` runs.'''
+    using = router.db_for_read(Meeting)
+    results = {}
+    for name, func in cases(board):
+        result = {}
+        for i in range(repeat):
+            bump_generation()
+            cold_time, cold_queries = measure(func, using)
+            warm_time, warm_queries = measure(func, using)
+            result['queries'], result['warm_queries'] = cold_queries, warm_queries
+            result['time'] = min(result.get('time', cold_time), cold_time)
+            result['warm_time'] = min(result.get('warm_time', warm_time), warm_time)
+        results[name] = result
+    return results
+
+def load_baselines(path=BASELINES):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+def save_baselines(baselines, path=BASELINES):
+    with open(path, 'w') as f:
+        json.dump(baselines, f, indent=2, separators=(',', ': '), sort_keys=True)
+
+def compare(results, baseline, tolerance=1.5):
+    '''Regressions of ``results`` against one scale's baseline, as messages.
+
+    Any extra query is a regression; times may exceed the baseline by
+    ``tolerance``, or by ``TIME_NOISE`` seconds.'''
+    problems = []
+    for name, result in sorted(results.items()):
+        expected = baseline.get(name)
+        if not expected:
+            continue
+        for key in ('queries', 'warm_queries'):
+            if result[key] > expected[key]:
+                problems.append('%s: %s %s, baseline %s' % (name, result[key], key.replace('_', ' '), expected[key]))
+        for key in ('time', 'warm_time'):
+            if result[key] > max(expected[key] * tolerance, expected[key] + TIME_NOISE):
+                problems.append('%s: %s %.4fs, baseline %.4fs' % (name, key.replace('_', ' '), result[key], expected[key]))
+    return problems
@@ -0,0 +1,144 @@
+'''Generation based caching for committees lookups.
+
+Every cached value is keyed by a generation counter stored in the cache
+backend. Model signals bump the counter whenever governance data changes, so
+stale entries are never read again and simply expire.
+
+During a request the generation is read from the cache backend once, and
+values are memoized in a thread local, so repeated lookups cost nothing
+after the first. The thread local is reset when each request starts and
+ends. Outside requests, e.g. in management commands, the generation is
+read on every lookup so bumps by other processes are seen.
+'''
+import hashlib
+import threading
+import time
+from datetime import date
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.signals import request_finished, request_started
+from django.http import HttpResponse
+
+GENERATION_KEY = 'committees:generation'
+CACHE_TIMEOUT = getattr(settings, 'COMMITTEES_CACHE_TIMEOUT', 60 * 60)
+GENERATION_TIMEOUT = 60 * 60 * 24 * 30
+
+_local = threading.local()
+
+def _seed():
+    # Seeded from the clock so a counter evicted from the cache never
+    # restarts at a generation whose values are still cached.
+    return int(time.time())
+
+def _read_generation():
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        cache.add(GENERATION_KEY, _seed(), GENERATION_TIMEOUT)
+        generation = cache.get(GENERATION_KEY) or _seed()
+    return generation
+
+def get_generation():
+    generation = getattr(_local, 'generation', None)
+    if generation is None:
+        generation = _read_generation()
+        if getattr(_local, 'in_request', False):
+            _local.generation = generation
+    return generation
+
+def _reset(in_request):
+    _local.__dict__.clear()
+    _local.in_request = in_request
+
+def request_started_handler(sender=None, **kwargs):
+    _reset(True)
+
+def request_finished_handler(sender=None, **kwargs):
+    _reset(False)
+
+request_started.connect(request_started_handler, dispatch_uid='committees-cache-request-started')
+request_finished.connect(request_finished_handler, dispatch_uid='committees-cache-request-finished')
+
+def bump_generation(sender=None, **kwargs):
+    '''Invalidates every cached committees value. Usable as a signal receiver.'''
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        cache.set(GENERATION_KEY, _seed(), GENERATION_TIMEOUT)
+    _reset(getattr(_local, 'in_request', False))
+
+def get_user_version(user_id):
+    '''A counter for values cached per user, bumped when that user's person or terms change.'''
+    key = 'committees:user-version:%s' % user_id
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, _seed(), GENERATION_TIMEOUT)
+        version = cache.get(key) or _seed()
+    return version
+
+def bump_user_version(user_id):
+    key = 'committees:user-version:%s' % user_id
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, _seed(), GENERATION_TIMEOUT)
+
+def cache_version(generation=None):
+    '''The current generation and day, for versioning template fragments.
+
+    The day is part of every key because terms start and end by date alone,
+    without any save that would bump the generation.'''
+    return '%s-%s' % (generation or get_generation(), date.today().isoformat())
+
+def make_key(*bits, **kwargs):
+    '''Builds a cache key for the current generation, or ``generation``, and day.'''
+    bits = [str(b) for b in bits]
+    return 'committees:%s:%s' % (cache_version(kwargs.get('generation')), ':'.join(bits))
+
+def memo(generation=None):
+    '''Returns the thread local memo for the current generation.'''
+    generation = generation or get_generation()
+    if getattr(_local, 'values_generation', None) != generation:
+        _local.values_generation = generation
+        _local.values = {}
+    return _local.values
+
+def cached(name, func, timeout=CACHE_TIMEOUT, shared=True):
+    '''Returns ``func()`` memoized per generation.
+
+    Always memoized in the thread local; ``shared`` also stores the value in
+    the cache backend for other processes. None is a cacheable value.'''
+    generation = get_generation()
+    key = make_key(name, generation=generation)
+    values = memo(generation)
+    if key in values:
+        return values[key]
+    boxed = shared and cache.get(key) or None
+    if boxed is None:
+        boxed = (func(),)
+        if shared:
+            cache.set(key, boxed, timeout)
+    values[key] = boxed[0]
+    return boxed[0]
+
+def cache_page_by_generation(view):
+    '''Caches anonymous GET responses of a view until the next generation.
+
+    Authenticated requests are never served from the page cache, since
+    templates may vary on the user; they still benefit from fragments
+    cached against ``committees_cache_version``.'''
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method != 'GET' or request.user.is_authenticated():
+            return view(request, *args, **kwargs)
+        key = make_key('page', hashlib.md5(request.get_full_path().encode('utf-8')).hexdigest())
+        cached_page = cache.get(key)
+        if cached_page is not None:
+            content, content_type = cached_page
+            return HttpResponse(content, content_type=content_type)
+        response = view(request, *args, **kwargs)
+        if response.status_code == 200 and not response.cookies:
+            cache.set(key, (response.content, response['Content-Type']), CACHE_TIMEOUT)
+        return response
+    return wrapper
@@ -0,0 +1,100 @@
+'''Attachment delivery with conditional GET, byte ranges and server offload.
+
+Set ``COMMITTEES_ATTACHMENT_SENDFILE`` to ``'x-sendfile'`` (Apache, lighttpd)
+or ``'x-accel-redirect'`` (nginx, with ``COMMITTEES_ATTACHMENT_ACCEL_PREFIX``
+naming the internal location mapped to ``MEDIA_ROOT``) to have the web server
+send the bytes. Otherwise files are streamed from storage in chunks.
+'''
+import calendar
+import re
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils.http import http_date, parse_etags, parse_http_date_safe, quote_etag
+
+SENDFILE = getattr(settings, 'COMMITTEES_ATTACHMENT_SENDFILE', None)
+ACCEL_PREFIX = getattr(settings, 'COMMITTEES_ATTACHMENT_ACCEL_PREFIX', '/protected/')
+CHUNK_SIZE = getattr(settings, 'COMMITTEES_ATTACHMENT_CHUNK_SIZE', 64 * 1024)
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+def not_modified(request, etag, last_modified):
+    '''Whether the client's cached copy is current. ``etag`` is unquoted.'''
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match:
+        etags = parse_etags(if_none_match)
+        return '*' in etags or etag in etags
+    if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+    return bool(if_modified_since and last_modified and last_modified <= if_modified_since)
+
+def parse_range(header, size):
+    '''Returns ``(first, last)`` byte positions for a single range, None to
+    send the whole file, or False when the range cannot be satisfied.'''
+    match = RANGE_RE.match(header.replace(' ', ''))
+    if not match or match.groups() == ('', ''):
+        # Multiple or malformed ranges: the whole file is a valid answer.
+        return None
+    first, last = match.groups()
+    if first == '':
+        first, last = max(size - int(last), 0), size - 1
+    else:
+        first = int(first)
+        last = min(int(last), size - 1) if last else size - 1
+    if first >= size or first > last:
+        return False
+    return first, last
+
+def stream(fieldfile, first, length):
+    fieldfile.open('rb')
+    try:
+        fieldfile.seek(first)
+        while length > 0:
+            chunk = fieldfile.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        fieldfile.close()
+
+def serve_attachment(request, attachment):
+    '''Serves the file of ``attachment`` using only its stored metadata.'''
+    raw_etag = attachment.checksum or str(attachment.pk)
+    etag = quote_etag(raw_etag)
+    last_modified = attachment.modified and calendar.timegm(attachment.modified.utctimetuple())
+    if not_modified(request, raw_etag, last_modified):
+        response = HttpResponseNotModified()
+        response['ETag'] = etag
+        return response
+
+    size = attachment.size
+    if size is None:
+        size = attachment.attachment.size
+    if SENDFILE:
+        response = HttpResponse(content_type=attachment.mime_type or 'application/octet-stream')
+        if SENDFILE == 'x-accel-redirect':
+            response['X-Accel-Redirect'] = ACCEL_PREFIX + attachment.attachment.name
+        else:
+            response['X-Sendfile'] = attachment.attachment.path
+    else:
+        byte_range = None
+        if request.META.get('HTTP_RANGE') and request.META.get('HTTP_IF_RANGE', etag) == etag:
+            byte_range = parse_range(request.META['HTTP_RANGE'], size)
+        if byte_range is False:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = 'bytes */%s' % size
+            return response
+        first, last = byte_range or (0, size - 1)
+        response = StreamingHttpResponse(stream(attachment.attachment, first, last - first + 1),
+                                         content_type=attachment.mime_type or 'application/octet-stream')
+        response['Content-Length'] = str(last - first + 1)
+        if byte_range:
+            response.status_code = 206
+            response['Content-Range'] = 'bytes %s-%s/%s' % (first, last, size)
+        response['Accept-Ranges'] = 'bytes'
+
+    response['ETag'] = etag
+    if last_modified:
+        response['Last-Modified'] = http_date(last_modified)
+    response['Content-Disposition'] = 'inline; filename="%s"' % attachment.filename.replace('"', '')
+    return response
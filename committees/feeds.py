@@ -0,0 +1,140 @@
+'''iCalendar and JSON feeds of meetings for polling calendar clients.
+
+A feed's ETag and Last-Modified come from one aggregate query over the
+meetings it covers, so an unchanged feed is answered with a 304 before any
+meeting row is read. Otherwise rows are read with ``values().iterator()``
+and written out as they arrive.
+'''
+import calendar
+import hashlib
+import json
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.urlresolvers import reverse
+from django.db.models import Count, Max
+from django.http import HttpResponseNotModified, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.http import http_date, quote_etag
+
+from committees.downloads import not_modified
+from committees.models import Meeting
+
+# Meetings older than this many days are left out of feeds.
+PAST_DAYS = getattr(settings, 'COMMITTEES_FEED_PAST_DAYS', 365)
+
+FIELDS = ('pk', 'start', 'end', 'place_string', 'agenda', 'modified', 'group__title', 'group__slug')
+
+CONTENT_TYPES = {
+    'ics': 'text/calendar; charset=utf-8',
+    'json': 'application/json',
+}
+
+def feed_meetings(slug=None):
+    since = datetime.now() - timedelta(days=PAST_DAYS)
+    if settings.USE_TZ:
+        since = timezone.make_aware(since, timezone.get_default_timezone())
+    meetings = Meeting.objects.filter(start__gte=since)
+    if slug is not None:
+        meetings = meetings.filter(group__slug=slug)
+    return meetings
+
+def feed_state(meetings, format):
+    '''``(etag, last_modified)`` of a feed. The count changes when meetings are
+    deleted or age out, which the latest ``modified`` alone would miss.'''
+    state = meetings.aggregate(count=Count('pk'), modified=Max('modified'))
+    modified = state['modified']
+    last_modified = modified and calendar.timegm(modified.utctimetuple()) or None
+    etag = hashlib.md5(('%s:%s:%s' % (format, state['count'], modified and modified.isoformat())).encode('utf-8'))
+    return etag.hexdigest(), last_modified
+
+def meeting_url(row):
+    start = row['start']
+    if timezone.is_aware(start):
+        start = timezone.localtime(start)
+    return reverse('cm-meeting-detail', kwargs={'slug': row['group__slug'], 'year': start.year, 'month': start.month})
+
+def ics_escape(text):
+    return (text or u'').replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\r\n', '\\n').replace('\n', '\\n')
+
+def ics_datetime(value):
+    if timezone.is_aware(value):
+        return value.astimezone(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+    # Floating time, shown in each client's own zone.
+    return value.strftime('%Y%m%dT%H%M%S')
+
+def ics_line(line):
+    '''Folds a content line at 75 octets as RFC 5545 requires.'''
+    data = line.encode('utf-8')
+    chunks = []
+    while len(data) > 75:
+        cut = 75 if not chunks else 74
+        # Never split a multi-byte character.
+        while cut and (ord(data[cut:cut + 1]) & 0xC0) == 0x80:
+            cut -= 1
+        chunks.append(data[:cut])
+        data = data[cut:]
+    chunks.append(data)
+    return b'\r\n '.join(chunks) + b'\r\n'
+
+def ics_feed(rows, host, title):
+    yield ics_line(u'BEGIN:VCALENDAR')
+    yield ics_line(u'VERSION:2.0')
+    yield ics_line(u'PRODID:-//django-committees//Meetings//EN')
+    yield ics_line(u'X-WR-CALNAME:%s' % ics_escape(title))
+    for row in rows:
+        lines = [
+            u'BEGIN:VEVENT',
+            u'UID:meeting-%s@%s' % (row['pk'], host),
+            u'DTSTAMP:%s' % ics_datetime(row['modified']),
+            u'DTSTART:%s' % ics_datetime(row['start']),
+        ]
+        if row['end']:
+            lines.append(u'DTEND:%s' % ics_datetime(row['end']))
+        lines.append(u'SUMMARY:%s' % ics_escape(u'%s meeting' % row['group__title']))
+        if row['place_string']:
+            lines.append(u'LOCATION:%s' % ics_escape(row['place_string']))
+        if row['agenda']:
+            lines.append(u'DESCRIPTION:%s' % ics_escape(row['agenda']))
+        lines.append(u'URL:http://%s%s' % (host, meeting_url(row)))
+        lines.append(u'END:VEVENT')
+        yield b''.join(ics_line(line) for line in lines)
+    yield ics_line(u'END:VCALENDAR')
+
+def json_feed(rows, host, title):
+    yield b'{"title": ' + json.dumps(title).encode('utf-8') + b', "meetings": ['
+    for i, row in enumerate(rows):
+        item = {
+            'id': row['pk'],
+            'group': row['group__slug'],
+            'title': u'%s meeting' % row['group__title'],
+            'start': row['start'],
+            'end': row['end'],
+            'place': row['place_string'],
+            'agenda': row['agenda'],
+            'url': 'http://%s%s' % (host, meeting_url(row)),
+            'modified': row['modified'],
+        }
+        yield (i and b', ' or b'') + json.dumps(item, cls=DjangoJSONEncoder).encode('utf-8')
+    yield b']}'
+
+WRITERS = {
+    'ics': ics_feed,
+    'json': json_feed,
+}
+
+def serve_feed(request, meetings, format, title):
+    etag, last_modified = feed_state(meetings, format)
+    if not_modified(request, etag, last_modified):
+        response = HttpResponseNotModified()
+    else:
+        # Rows are read while the response streams, after the view returns,
+        # so the database chosen now is named.
+        rows = meetings.using(meetings.db).order_by('start').values(*FIELDS).iterator()
+        response = StreamingHttpResponse(WRITERS[format](rows, request.get_host(), title),
+                                         content_type=CONTENT_TYPES[format])
+    response['ETag'] = quote_etag(etag)
+    if last_modified:
+        response['Last-Modified'] = http_date(last_modified)
+    return response
@@ -0,0 +1,153 @@
+'''Compact revision history for minutes.
+
+With ``COMMITTEES_MINUTES_HISTORY = 'delta'`` every save of a minutes stores
+a ``MinutesRevision`` holding only what changed since the previous revision:
+changed field values, and line diffs for text fields. Every
+``COMMITTEES_HISTORY_SNAPSHOT_INTERVAL`` revisions a full snapshot is stored
+instead, so rebuilding any revision reads at most that many rows. Payloads
+are zlib-compressed JSON. Rendered markup is not stored, it is re-rendered
+from the source when a revision is rebuilt.
+'''
+import base64
+import difflib
+import json
+import zlib
+
+from django.conf import settings
+from django.db import models
+
+from committees.models import Minutes, MinutesRevision
+
+SNAPSHOT_INTERVAL = getattr(settings, 'COMMITTEES_HISTORY_SNAPSHOT_INTERVAL', 10)
+
+def tracked_fields():
+    rendered = set()
+    for source, rendered_field, hashed in Minutes.rendered_markup_fields:
+        rendered.update([rendered_field, hashed])
+    return [f for f in Minutes._meta.fields if f.name not in rendered]
+
+def dump_state(minutes):
+    '''The tracked field values of ``minutes`` as JSON-ready strings.'''
+    state = {}
+    for field in tracked_fields():
+        value = getattr(minutes, field.attname)
+        if value is None:
+            state[field.attname] = None
+            continue
+        # signed_date defaults to a datetime, which its DateField would not
+        # read back.
+        value = field.to_python(value)
+        state[field.attname] = hasattr(value, 'isoformat') and value.isoformat() or field.value_to_string(minutes)
+    return state
+
+def load_state(state):
+    '''An unsaved Minutes built from a state returned by ``dump_state``.'''
+    values = {}
+    for field in tracked_fields():
+        if field.attname not in state:
+            continue
+        value = state[field.attname]
+        if value is not None:
+            target = field.rel and field.rel.get_related_field() or field
+            value = target.to_python(value)
+        values[field.attname] = value
+    minutes = Minutes(**values)
+    minutes.render_markup()
+    return minutes
+
+def encode(payload):
+    return base64.b64encode(zlib.compress(json.dumps(payload).encode('utf-8'), 9)).decode('ascii')
+
+def decode(data):
+    return json.loads(zlib.decompress(base64.b64decode(data)).decode('utf-8'))
+
+def diff_text(old, new):
+    '''Line diff turning ``old`` into ``new``: a list of ``[first, last]``
+    ranges of old lines to keep and strings of new text.'''
+    old_lines, new_lines = old.splitlines(True), new.splitlines(True)
+    ops = []
+    matcher = difflib.SequenceMatcher(None, old_lines, new_lines, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            ops.append([i1, i2])
+        elif j1 != j2:
+            ops.append(u''.join(new_lines[j1:j2]))
+    return ops
+
+def patch_text(old, ops):
+    old_lines = old.splitlines(True)
+    return u''.join(isinstance(op, list) and u''.join(old_lines[op[0]:op[1]]) or op for op in ops)
+
+def diff_state(old, new):
+    '''The changes turning state ``old`` into ``new``. Text fields hold a
+    line diff under ``diffs``, everything else its new value under ``values``.'''
+    text_fields = set(f.attname for f in tracked_fields() if isinstance(f, models.TextField))
+    values, diffs = {}, {}
+    for name, value in new.items():
+        if old.get(name) == value:
+            continue
+        if name in text_fields and old.get(name) and value:
+            diffs[name] = diff_text(old[name], value)
+        else:
+            values[name] = value
+    return values, diffs
+
+def patch_state(state, payload):
+    state = dict(state)
+    state.update(payload.get('values', {}))
+    for name, ops in payload.get('diffs', {}).items():
+        state[name] = patch_text(state[name], ops)
+    return state
+
+def rebuild_state(minutes_id, revision=None):
+    '''The tracked field values of a minutes at ``revision``, or at its latest.
+
+    Reads the nearest snapshot at or before the revision and the deltas after it.'''
+    revisions = MinutesRevision.objects.filter(minutes_id=minutes_id)
+    if revision is not None:
+        revisions = revisions.filter(revision__lte=revision)
+    try:
+        snapshot = revisions.filter(snapshot=True).order_by('-revision')[0]
+    except IndexError:
+        raise MinutesRevision.DoesNotExist('No revision %s of minutes %s.' % (revision, minutes_id))
+    state = decode(snapshot.data)
+    for delta in revisions.filter(revision__gt=snapshot.revision).order_by('revision'):
+        state = patch_state(state, decode(delta.data))
+    return state
+
+def rebuild_instance(minutes_id, revision=None):
+    return load_state(rebuild_state(minutes_id, revision))
+
+def record(minutes, type=MinutesRevision.TYPE_CHANGED, date=None):
+    '''Stores the current state of ``minutes`` as its next revision.
+
+    Saves that change nothing are skipped. Returns the new MinutesRevision or None.'''
+    state = dump_state(minutes)
+    try:
+        latest = MinutesRevision.objects.filter(minutes_id=minutes.pk).order_by('-revision')[0]
+    except IndexError:
+        latest = None
+    revision = latest and latest.revision + 1 or 1
+    fields = {'minutes_id': minutes.pk, 'revision': revision, 'type': type}
+    if date is not None:
+        fields['date'] = date
+    if latest is None:
+        return MinutesRevision.objects.create(snapshot=True, data=encode(state), **fields)
+    values, diffs = diff_state(rebuild_state(minutes.pk), state)
+    if not values and not diffs and type == MinutesRevision.TYPE_CHANGED:
+        return None
+    if (revision - 1) % SNAPSHOT_INTERVAL == 0:
+        return MinutesRevision.objects.create(snapshot=True, data=encode(state), **fields)
+    payload = {}
+    if values:
+        payload['values'] = values
+    if diffs:
+        payload['diffs'] = diffs
+    return MinutesRevision.objects.create(data=encode(payload), **fields)
+
+def minutes_saved(sender, instance, created=False, raw=False, **kwargs):
+    if not raw:
+        record(instance, created and MinutesRevision.TYPE_CREATED or MinutesRevision.TYPE_CHANGED)
+
+def minutes_deleted(sender, instance, **kwargs):
+    record(instance, MinutesRevision.TYPE_DELETED)
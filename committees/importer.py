@@ -0,0 +1,461 @@
+'''Bulk import of people, terms, meetings and minutes from CSV or JSON lines.
+
+Rows are read lazily and written in batches. Groups, offices, people and
+meetings are resolved by slug (or group and start) through lookup maps
+built once per import or once per batch, never per row. Existing rows are
+matched on a natural key and updated, new ones are inserted with
+``bulk_create``. A bad row is reported with its line number and skipped; it
+does not abort its batch.
+
+``bulk_create`` and ``update`` send no signals, so ``finish()`` rebuilds the
+office timelines, rosters, attendance rollups and search documents the
+import touched, bumps the touched people's user versions and bumps the
+cache generation.
+'''
+import csv
+import json
+from datetime import date, datetime
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import DatabaseError, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime, parse_time
+from django.utils.encoding import force_text
+from eventy.models import Event
+
+from committees import attendance, search
+from committees.cache import bump_generation, bump_user_version
+from committees.models import Group, Meeting, Minutes, Office, OfficeHolding, Person, RosterEntry, Term
+
+BATCH_SIZE = getattr(settings, 'COMMITTEES_IMPORT_BATCH_SIZE', 1000)
+
+TRUE_VALUES = ('1', 'true', 't', 'yes', 'y')
+
+class RowError(Exception):
+    pass
+
+class ImportResult(object):
+    def __init__(self):
+        self.created = 0
+        self.updated = 0
+        self.errors = []
+
+    def __repr__(self):
+        return '<ImportResult: %s created, %s updated, %s errors>' % (self.created, self.updated, len(self.errors))
+
+def read_rows(f, format='csv'):
+    '''Yields ``(line, row)`` pairs from an open file of CSV or JSON lines.'''
+    if format == 'csv':
+        reader = csv.DictReader(f)
+        for row in reader:
+            yield reader.line_num, dict((force_text(k).strip(), force_text(v).strip() if v is not None else None)
+                                        for k, v in row.items() if k)
+    elif format == 'json':
+        for line, text in enumerate(f, 1):
+            text = text.strip()
+            if not text:
+                continue
+            try:
+                row = json.loads(force_text(text))
+            except ValueError as e:
+                row = e
+            if not isinstance(row, (dict, Exception)):
+                row = RowError('Expected an object, got %r.' % row)
+            yield line, row
+    else:
+        raise ValueError('Unknown import format %r.' % format)
+
+def _value(row, name, required=False):
+    value = row.get(name)
+    if value is not None and not isinstance(value, (list, bool, int)):
+        value = force_text(value).strip()
+    if value in (None, ''):
+        if required:
+            raise RowError('"%s" is required.' % name)
+        return None
+    return value
+
+def _date(row, name, required=False):
+    value = _value(row, name, required)
+    if value is None:
+        return None
+    parsed = parse_date(value)
+    if parsed is None:
+        raise RowError('"%s" is not a YYYY-MM-DD date: %r.' % (name, value))
+    return parsed
+
+def _datetime(row, name, required=False):
+    value = _value(row, name, required)
+    if value is None:
+        return None
+    parsed = parse_datetime(value)
+    if parsed is None:
+        date = parse_date(value)
+        if date is None:
+            raise RowError('"%s" is not a date and time: %r.' % (name, value))
+        parsed = datetime(date.year, date.month, date.day)
+    if settings.USE_TZ and timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed, timezone.get_default_timezone())
+    return parsed
+
+def _time(row, name):
+    value = _value(row, name)
+    if value is None:
+        return None
+    parsed = parse_time(value)
+    if parsed is None:
+        raise RowError('"%s" is not a time: %r.' % (name, value))
+    return parsed
+
+def _bool(row, name, default=False):
+    value = _value(row, name)
+    if value is None:
+        return default
+    if isinstance(value, bool):
+        return value
+    return force_text(value).lower() in TRUE_VALUES
+
+def _lookup(mapping, key, name, required=False):
+    if key is None:
+        if required:
+            raise RowError('"%s" is required.' % name)
+        return None
+    try:
+        return mapping[key]
+    except KeyError:
+        raise RowError('Unknown %s %r.' % (name, key))
+
+class Importer(object):
+    '''Imports rows of one model. Subclasses define ``model``, ``convert()``
+    and ``key()``, and may add lookup maps and a ``finish()`` step.'''
+    model = None
+
+    def __init__(self, batch_size=BATCH_SIZE):
+        self.batch_size = batch_size
+        self.result = ImportResult()
+        self.touched = set()
+        self._groups = None
+
+    @property
+    def groups(self):
+        if self._groups is None:
+            self._groups = dict(Group.objects.values_list('slug', 'pk'))
+        return self._groups
+
+    def convert(self, row):
+        '''Field values (by attname) for a row; raises RowError.'''
+        raise NotImplementedError
+
+    def key(self, values):
+        raise NotImplementedError
+
+    def existing(self, keys):
+        '''Maps the keys of a batch that are already stored to their pks.'''
+        raise NotImplementedError
+
+    def prepare(self, rows):
+        '''Loads per-batch lookups before rows are converted.'''
+        pass
+
+    def build(self, values):
+        instance = self.model(**values)
+        instance.clean_fields(exclude=[f.name for f in self.model._meta.fields if f.rel])
+        for name in values:
+            values[name] = getattr(instance, name)
+        if hasattr(instance, 'render_markup'):
+            for name in instance.render_markup():
+                values[name] = getattr(instance, name)
+        return instance
+
+    def run(self, rows):
+        '''Imports ``(line, row)`` pairs as returned by read_rows.'''
+        batch = []
+        for line, row in rows:
+            batch.append((line, row))
+            if len(batch) >= self.batch_size:
+                self.run_batch(batch)
+                batch = []
+        if batch:
+            self.run_batch(batch)
+        return self.result
+
+    def run_batch(self, batch):
+        self.prepare([row for line, row in batch if isinstance(row, dict)])
+        pending = {}
+        for line, row in batch:
+            try:
+                if not isinstance(row, dict):
+                    raise RowError(force_text(row))
+                values = self.convert(row)
+                instance = self.build(values)
+            except (RowError, ValueError) as e:
+                self.result.errors.append((line, force_text(e)))
+                continue
+            except ValidationError as e:
+                self.result.errors.append((line, u'; '.join(
+                    u'%s: %s' % (name, u' '.join(messages)) for name, messages in e.message_dict.items())))
+                continue
+            # A later row for the same key replaces an earlier one.
+            pending[self.key(values)] = (line, values, instance)
+        if not pending:
+            return
+        try:
+            self.write(pending)
+        except DatabaseError as e:
+            lines = sorted(line for line, values, instance in pending.values())
+            self.result.errors.append((lines[0], u'Batch of lines %s-%s not imported: %s' % (lines[0], lines[-1], e)))
+
+    @transaction.commit_on_success
+    def write(self, pending):
+        found = self.existing(list(pending))
+        # Values are keyed by attname, and update() wants field names.
+        names = dict((f.attname, f.name) for f in self.model._meta.fields)
+        new = []
+        for key, (line, values, instance) in pending.items():
+            if key in found:
+                self.model.objects.filter(pk=found[key]).update(
+                    **dict((names.get(k, k), v) for k, v in values.items()))
+                self.touched.add(found[key])
+                self.result.updated += 1
+            else:
+                new.append((key, instance))
+        self.create([instance for key, instance in new])
+        self.result.created += len(new)
+        if new:
+            self.touched.update(self.existing([key for key, instance in new]).values())
+        self.written(pending)
+
+    def create(self, instances):
+        self.model.objects.bulk_create(instances)
+
+    def written(self, pending):
+        '''Called inside the batch transaction once its rows are stored.'''
+        pass
+
+    def finish(self):
+        '''Rebuilds what signals would have, then bumps the cache generation.'''
+        bump_generation()
+
+class PersonImporter(Importer):
+    '''Columns: slug, first_name, middle_name, last_name, title, email, phone, gender, member, bio.'''
+    model = Person
+
+    def convert(self, row):
+        values = {'slug': _value(row, 'slug', required=True), 'member': _bool(row, 'member', True)}
+        for name in ('first_name', 'middle_name', 'last_name', 'title'):
+            values[name] = _value(row, name) or u''
+        for name in ('email', 'phone', 'bio', 'gender'):
+            values[name] = _value(row, name)
+        return values
+
+    def key(self, values):
+        return values['slug']
+
+    def existing(self, keys):
+        return dict(Person.objects.filter(slug__in=keys).values_list('slug', 'pk'))
+
+class TermImporter(Importer):
+    '''Columns: group, person, office (slugs), start, end, alternate.
+
+    Terms are matched on group, office, person and start.'''
+    model = Term
+
+    def __init__(self, *args, **kwargs):
+        super(TermImporter, self).__init__(*args, **kwargs)
+        self.people = dict(Person.objects.values_list('slug', 'pk'))
+        self.offices = dict(((group_id, slug), pk) for pk, group_id, slug in
+                            Office.objects.values_list('pk', 'group', 'slug'))
+        self.touched_offices = set()
+        self.touched_groups = set()
+        self.touched_people = set()
+        self.touched_years = set()
+
+    def convert(self, row):
+        group_id = _lookup(self.groups, _value(row, 'group'), 'group', required=True)
+        office = _value(row, 'office')
+        if office is not None and (group_id, office) not in self.offices:
+            raise RowError('Unknown office %r in group %r.' % (office, _value(row, 'group')))
+        values = {
+            'group_id': group_id,
+            'person_id': _lookup(self.people, _value(row, 'person'), 'person'),
+            'office_id': self.offices.get((group_id, office)),
+            'start': _date(row, 'start', required=True),
+            'end': _date(row, 'end'),
+            'alternate': _bool(row, 'alternate'),
+        }
+        if values['end'] and values['end'] < values['start']:
+            raise RowError('The term ends before it starts.')
+        return values
+
+    def key(self, values):
+        return (values['group_id'], values['office_id'], values['person_id'], values['start'])
+
+    def existing(self, keys):
+        found = {}
+        terms = Term.objects.filter(group__in=set(k[0] for k in keys), start__in=set(k[3] for k in keys))
+        for pk, group_id, office_id, person_id, start in terms.values_list('pk', 'group', 'office', 'person', 'start'):
+            found[(group_id, office_id, person_id, start)] = pk
+        return found
+
+    def written(self, pending):
+        this_year = date.today().year
+        for line, values, instance in pending.values():
+            self.touched_groups.add(values['group_id'])
+            if values['office_id']:
+                self.touched_offices.add(values['office_id'])
+            if values['person_id']:
+                self.touched_people.add(values['person_id'])
+                # An updated term may have ended later than it does now.
+                for year in range(values['start'].year, this_year + 1):
+                    self.touched_years.add((values['group_id'], year))
+
+    def finish(self):
+        for office_id in self.touched_offices:
+            OfficeHolding.objects.rebuild(office_id)
+        groups = Group.objects.filter(pk__in=self.touched_groups)
+        if Office.objects.filter(pk__in=self.touched_offices, ex_officio=True).exists():
+            groups = Group.objects.filter(pk__in=self.touched_groups) | Group.objects.filter(ex_officio=True)
+        for group in groups:
+            RosterEntry.objects.rebuild(group)
+        for group_id, year in sorted(self.touched_years):
+            attendance.rebuild(group_id, year)
+        people = list(self.touched_people)
+        for i in range(0, len(people), self.batch_size):
+            users = Person.objects.filter(pk__in=people[i:i + self.batch_size], user__isnull=False)
+            for user_id in users.values_list('user', flat=True):
+                bump_user_version(user_id)
+        super(TermImporter, self).finish()
+
+class SearchableImporter(Importer):
+    def finish(self):
+        touched = list(self.touched)
+        for i in range(0, len(touched), self.batch_size):
+            for obj in self.model.objects.filter(pk__in=touched[i:i + self.batch_size]):
+                search.index_object(obj)
+        super(SearchableImporter, self).finish()
+
+class MeetingImporter(SearchableImporter):
+    '''Columns: group, event (slugs), start, end, place_string, agenda, business_arising.
+
+    Meetings are matched on group and start. They are multi-table children
+    of eventy's EventTime, which ``bulk_create`` cannot insert, so new
+    meetings are saved one by one inside the batch transaction.'''
+    model = Meeting
+
+    def __init__(self, *args, **kwargs):
+        super(MeetingImporter, self).__init__(*args, **kwargs)
+        self.events = dict(Event.objects.values_list('slug', 'pk'))
+
+    def convert(self, row):
+        return {
+            'group_id': _lookup(self.groups, _value(row, 'group'), 'group', required=True),
+            'event_id': _lookup(self.events, _value(row, 'event'), 'event', required=True),
+            'start': _datetime(row, 'start', required=True),
+            'end': _datetime(row, 'end'),
+            'place_string': _value(row, 'place_string') or u'',
+            'agenda': _value(row, 'agenda'),
+            'business_arising': _value(row, 'business_arising'),
+        }
+
+    def key(self, values):
+        return (values['group_id'], values['start'])
+
+    def existing(self, keys):
+        meetings = Meeting.objects.filter(group__in=set(k[0] for k in keys), start__in=set(k[1] for k in keys))
+        return dict(((group_id, start), pk) for pk, group_id, start in meetings.values_list('pk', 'group', 'start'))
+
+    def create(self, instances):
+        for instance in instances:
+            instance.save()
+
+class MinutesImporter(SearchableImporter):
+    '''Columns: group, meeting (the meeting's start), signed, content, signed_date,
+    call_to_order, adjournment, draft, and members_present as person slugs
+    separated by ";" (or a JSON list).
+
+    Minutes are matched on their meeting; attendance is replaced on update.'''
+    model = Minutes
+
+    def __init__(self, *args, **kwargs):
+        super(MinutesImporter, self).__init__(*args, **kwargs)
+        self.people = dict(Person.objects.values_list('slug', 'pk'))
+        self.meetings = {}
+        self.touched_meetings = set()
+
+    def prepare(self, rows):
+        starts, groups = set(), set()
+        for row in rows:
+            try:
+                starts.add(_datetime(row, 'meeting'))
+            except RowError:
+                continue
+            groups.add(self.groups.get(_value(row, 'group')))
+        meetings = Meeting.objects.filter(group__in=groups, start__in=starts).values_list('pk', 'group', 'start')
+        self.meetings = dict(((group_id, start), pk) for pk, group_id, start in meetings)
+
+    def attendees(self, row):
+        value = _value(row, 'members_present') or []
+        if not isinstance(value, list):
+            value = value.split(';')
+        return [_lookup(self.people, slug.strip(), 'person') for slug in value if slug.strip()]
+
+    def convert(self, row):
+        group_id = _lookup(self.groups, _value(row, 'group'), 'group', required=True)
+        values = {
+            'meeting_id': _lookup(self.meetings, (group_id, _datetime(row, 'meeting', required=True)), 'meeting'),
+            'signed_id': _lookup(self.people, _value(row, 'signed'), 'person', required=True),
+            'content': _value(row, 'content', required=True),
+            'signed_date': _date(row, 'signed_date') or _datetime(row, 'meeting').date(),
+            'call_to_order': _time(row, 'call_to_order'),
+            'adjournment': _time(row, 'adjournment'),
+            'draft': _bool(row, 'draft'),
+        }
+        self.row_attendees = self.attendees(row)
+        return values
+
+    def build(self, values):
+        instance = super(MinutesImporter, self).build(values)
+        instance._import_attendees = self.row_attendees
+        return instance
+
+    def key(self, values):
+        return values['meeting_id']
+
+    def existing(self, keys):
+        return dict(Minutes.objects.filter(meeting__in=keys).values_list('meeting', 'pk'))
+
+    def written(self, pending):
+        pks = self.existing(list(pending))
+        through = Minutes.members_present_new.through
+        through.objects.filter(minutes__in=pks.values()).delete()
+        through.objects.bulk_create([through(minutes_id=pks[key], person_id=person_id)
+                                     for key, (line, values, instance) in pending.items()
+                                     for person_id in set(instance._import_attendees)])
+        self.touched_meetings.update(pending)
+
+    def finish(self):
+        meetings, group_years = list(self.touched_meetings), set()
+        for i in range(0, len(meetings), self.batch_size):
+            found = Meeting.objects.filter(pk__in=meetings[i:i + self.batch_size]).values_list('group', 'start')
+            group_years.update((group_id, start.year) for group_id, start in found)
+        for group_id, year in sorted(group_years):
+            attendance.rebuild(group_id, year)
+        super(MinutesImporter, self).finish()
+
+IMPORTERS = {
+    'people': PersonImporter,
+    'terms': TermImporter,
+    'meetings': MeetingImporter,
+    'minutes': MinutesImporter,
+}
+
+def import_rows(kind, rows, batch_size=BATCH_SIZE):
+    '''Imports ``(line, row)`` pairs of one kind and returns an ImportResult.'''
+    importer = IMPORTERS[kind](batch_size=batch_size)
+    result = importer.run(rows)
+    importer.finish()
+    return result
+
+def import_file(kind, f, format='csv', batch_size=BATCH_SIZE):
+    return import_rows(kind, read_rows(f, format), batch_size)
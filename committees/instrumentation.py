@@ -0,0 +1,217 @@
+'''Opt-in query and timing instrumentation for committees views and tags.
+
+Set ``COMMITTEES_INSTRUMENTATION = True`` to profile every committees view:
+its queries, repeated queries, database time, template render time, and
+the model properties and template tags that ran and the queries each
+issued. Each profile is logged to the ``committees.instrumentation``
+logger, at WARNING when the view exceeds its entry in
+``COMMITTEES_QUERY_BUDGETS``, and summed up in ``X-Committees-*`` response
+headers unless ``COMMITTEES_INSTRUMENTATION_HEADERS`` is False.
+
+Queries are read from ``connection.queries``, so debug cursors are turned on
+while a profile runs. Queries run while a streaming response is consumed
+happen after the view returns and are not counted.
+
+Tests can enforce budgets whatever the setting with ``QueryBudgetMixin``.
+'''
+import logging
+import threading
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.db import connections
+from django.template.base import Template
+
+logger = logging.getLogger('committees.instrumentation')
+
+ENABLED = getattr(settings, 'COMMITTEES_INSTRUMENTATION', False)
+HEADERS = getattr(settings, 'COMMITTEES_INSTRUMENTATION_HEADERS', True)
+# Maximum queries per view name, e.g. {'group_detail': 12}.
+BUDGETS = getattr(settings, 'COMMITTEES_QUERY_BUDGETS', {})
+
+_local = threading.local()
+
+def current():
+    '''The profile running in this thread, if any.'''
+    return getattr(_local, 'profile', None)
+
+def _query_count():
+    return sum(len(c.queries) for c in connections.all())
+
+class Profile(object):
+    def __init__(self, name):
+        self.name = name
+        self.queries = []
+        self.time = self.template_time = 0.0
+        # name -> [calls, queries, seconds], including nested calls.
+        self.hotspots = {}
+        self._rendering = False
+
+    def start(self):
+        self._connections = [(c, c.use_debug_cursor, len(c.queries)) for c in connections.all()]
+        for c, debug, first in self._connections:
+            c.use_debug_cursor = True
+        self._started = time.time()
+
+    def stop(self):
+        self.time = time.time() - self._started
+        for c, debug, first in self._connections:
+            self.queries.extend(c.queries[first:])
+            c.use_debug_cursor = debug
+
+    def track(self, name, func, args, kwargs):
+        queries, started = _query_count(), time.time()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            stats = self.hotspots.setdefault(name, [0, 0, 0.0])
+            stats[0] += 1
+            stats[1] += _query_count() - queries
+            stats[2] += time.time() - started
+
+    @property
+    def duplicates(self):
+        '''How many queries repeated an earlier one word for word.'''
+        seen = set()
+        count = 0
+        for query in self.queries:
+            if query['sql'] in seen:
+                count += 1
+            seen.add(query['sql'])
+        return count
+
+    @property
+    def db_time(self):
+        return sum(float(q['time']) for q in self.queries)
+
+    @property
+    def budget(self):
+        return BUDGETS.get(self.name)
+
+    @property
+    def over_budget(self):
+        return self.budget is not None and len(self.queries) > self.budget
+
+    def top_hotspots(self, limit=5):
+        return sorted(self.hotspots.items(), key=lambda item: (-item[1][1], -item[1][2]))[:limit]
+
+    def headers(self):
+        return {
+            'X-Committees-Queries': str(len(self.queries)),
+            'X-Committees-Duplicate-Queries': str(self.duplicates),
+            'X-Committees-DB-Time': '%.1fms' % (self.db_time * 1000),
+            'X-Committees-Template-Time': '%.1fms' % (self.template_time * 1000),
+            'X-Committees-Time': '%.1fms' % (self.time * 1000),
+            'X-Committees-Hotspots': ', '.join('%s=%sx/%sq' % (name, calls, queries)
+                                               for name, (calls, queries, seconds) in self.top_hotspots()),
+        }
+
+    def summary(self):
+        lines = ['%s: %s queries (%s duplicated, budget %s), %.1fms in the database, %.1fms rendering, %.1fms total' % (
+            self.name, len(self.queries), self.duplicates, self.budget, self.db_time * 1000,
+            self.template_time * 1000, self.time * 1000)]
+        for name, (calls, queries, seconds) in self.top_hotspots(limit=None):
+            lines.append('  %s: %s calls, %s queries, %.1fms' % (name, calls, queries, seconds * 1000))
+        return '\n'.join(lines)
+
+class profile(object):
+    '''Profiles the enclosed code under ``name``, enabled or not::
+
+        with profile('group_detail') as p:
+            ...
+        p.queries, p.hotspots
+    '''
+    def __init__(self, name):
+        self.profile = Profile(name)
+
+    def __enter__(self):
+        self.installed = install()
+        self.previous = current()
+        _local.profile = self.profile
+        self.profile.start()
+        return self.profile
+
+    def __exit__(self, *exc_info):
+        self.profile.stop()
+        _local.profile = self.previous
+        if self.installed:
+            uninstall()
+
+def tracked(name):
+    '''Records calls of the decorated function in the running profile.'''
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            profile = current()
+            if profile is None:
+                return func(*args, **kwargs)
+            return profile.track(name, func, args, kwargs)
+        return wrapper
+    return decorator
+
+def instrumented_view(view):
+    '''Profiles the view when instrumentation is enabled.'''
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not ENABLED or current() is not None:
+            return view(request, *args, **kwargs)
+        with profile(view.__name__) as p:
+            response = view(request, *args, **kwargs)
+        report(p, response)
+        return response
+    return wrapper
+
+def report(profile, response=None):
+    logger.log(profile.over_budget and logging.WARNING or logging.INFO, profile.summary())
+    if response is not None and HEADERS:
+        for header, value in profile.headers().items():
+            response[header] = value
+
+def install():
+    '''Times top-level template renders for the running profile. Returns
+    whether ``Template.render`` was patched by this call.'''
+    if getattr(Template.render, 'committees_instrumented', False):
+        return False
+    # The function itself, so it can be put back as it was.
+    original = Template.__dict__['render']
+    def render(self, context):
+        profile = current()
+        if profile is None or profile._rendering:
+            return original(self, context)
+        profile._rendering = True
+        started = time.time()
+        try:
+            return original(self, context)
+        finally:
+            profile.template_time += time.time() - started
+            profile._rendering = False
+    render.committees_instrumented = True
+    render.original = original
+    Template.render = render
+    return True
+
+def uninstall():
+    '''Restores ``Template.render`` unless instrumentation is enabled.'''
+    if not ENABLED and getattr(Template.render, 'committees_instrumented', False):
+        Template.render = Template.render.original
+
+if ENABLED:
+    install()
+
+class QueryBudgetMixin(object):
+    '''TestCase mixin asserting that code stays within a query budget.'''
+
+    def assertQueryBudget(self, name, func, *args, **kwargs):
+        '''Calls ``func`` and fails if it runs more queries than ``budget``
+        (default: the ``COMMITTEES_QUERY_BUDGETS`` entry for ``name``) or
+        more repeated queries than ``duplicates``. Returns the result.'''
+        budget = kwargs.pop('budget', BUDGETS.get(name))
+        duplicates = kwargs.pop('duplicates', None)
+        with profile(name) as p:
+            result = func(*args, **kwargs)
+        if budget is not None and len(p.queries) > budget:
+            self.fail('%s ran %s queries, over its budget of %s.\n%s' % (name, len(p.queries), budget, p.summary()))
+        if duplicates is not None and p.duplicates > duplicates:
+            self.fail('%s repeated %s queries, more than %s.\n%s' % (name, p.duplicates, duplicates, p.summary()))
+        return result
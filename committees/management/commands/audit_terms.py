@@ -0,0 +1,28 @@
+import json
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from committees.validation import audit, report
+
+
+class Command(BaseCommand):
+    help = ('Checks every term for overlapping offices, people holding two terms in a group at once '
+            'and consecutive terms over COMMITTEES_TERM_LIMIT, and prints a JSON report.')
+    option_list = BaseCommand.option_list + (
+        make_option('--output', dest='output', default=None,
+            help='Write the report to this file instead of standard output.'),
+        make_option('--fail-on-error', action='store_true', dest='fail', default=False,
+            help='Exit with an error status when any error is found.'),
+    )
+
+    def handle(self, *args, **options):
+        result = report(audit())
+        data = json.dumps(result, indent=2, sort_keys=True, default=str)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(data)
+        else:
+            self.stdout.write(data + '\n')
+        if options['fail'] and result['errors']:
+            raise CommandError('%s errors and %s warnings found.' % (result['errors'], result['warnings']))
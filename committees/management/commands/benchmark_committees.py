@@ -0,0 +1,54 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from committees import benchmark
+
+
+class Command(BaseCommand):
+    args = '[%s ...]' % ' '.join(sorted(benchmark.SCALES))
+    help = ('Builds synthetic organizations in a throwaway test database and times the committees '
+            'views and template tags against each, comparing wall time and query counts with the '
+            'stored baselines. Defaults to the small scale.')
+    option_list = BaseCommand.option_list + (
+        make_option('--record', action='store_true', dest='record', default=False,
+            help='Store the results as the new baselines instead of comparing.'),
+        make_option('--baselines', dest='baselines', default=benchmark.BASELINES,
+            help='Baselines file.'),
+        make_option('--tolerance', dest='tolerance', type='float', default=1.5,
+            help='How many times slower than its baseline a case may run.'),
+        make_option('--repeat', dest='repeat', type='int', default=3,
+            help='Runs per case; the fastest is kept.'),
+    )
+
+    def handle(self, *scales, **options):
+        scales = scales or ('small',)
+        for scale in scales:
+            if scale not in benchmark.SCALES:
+                raise CommandError('Unknown scale "%s"; choose from %s.' % (scale, ', '.join(sorted(benchmark.SCALES))))
+        baselines = benchmark.load_baselines(options['baselines'])
+        problems = []
+        for scale in scales:
+            old_name = connection.settings_dict['NAME']
+            connection.creation.create_test_db(verbosity=0, autoclobber=True)
+            try:
+                board = benchmark.generate(**benchmark.SCALES[scale])
+                results = benchmark.run(board, options['repeat'])
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+            for name, result in sorted(results.items()):
+                self.stdout.write('%-6s %-22s %3d queries %8.4fs   warm %3d queries %8.4fs\n' % (
+                    scale, name, result['queries'], result['time'], result['warm_queries'], result['warm_time']))
+            if options['record']:
+                baselines[scale] = results
+            elif scale in baselines:
+                problems.extend('%s %s' % (scale, p) for p in
+                                benchmark.compare(results, baselines[scale], options['tolerance']))
+            else:
+                self.stdout.write('No baseline for the %s scale; run with --record to store one.\n' % scale)
+        if options['record']:
+            benchmark.save_baselines(baselines, options['baselines'])
+            self.stdout.write('Baselines written to %s.\n' % options['baselines'])
+        elif problems:
+            raise CommandError('Regressions:\n  %s' % '\n  '.join(problems))
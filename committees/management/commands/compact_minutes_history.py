@@ -0,0 +1,46 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from committees.history import record
+from committees.models import Minutes, MinutesRevision
+
+HISTORY_TABLE = 'committees_historicalminutes'
+
+
+class Command(BaseCommand):
+    help = ('Converts the simple_history rows of minutes into compact MinutesRevision rows. '
+            'Run after setting COMMITTEES_MINUTES_HISTORY to "delta"; minutes that already '
+            'have revisions are skipped.')
+    option_list = BaseCommand.option_list + (
+        make_option('--delete', action='store_true', dest='delete', default=False,
+            help='Empty the simple_history table once its rows are converted.'),
+    )
+
+    @transaction.commit_on_success
+    def handle(self, *args, **options):
+        fields = [f for f in Minutes._meta.fields]
+        done = set(MinutesRevision.objects.values_list('minutes_id', flat=True).distinct())
+        # The historical model is not registered in delta mode, so its table is read directly.
+        qn = connection.ops.quote_name
+        cursor = connection.cursor()
+        cursor.execute('SELECT %s, %s, %s FROM %s ORDER BY %s, %s, %s' % (
+            ', '.join(qn(f.column) for f in fields), qn('history_date'), qn('history_type'), qn(HISTORY_TABLE),
+            qn('id'), qn('history_date'), qn('history_id')))
+        rows = revisions = 0
+        while True:
+            batch = cursor.fetchmany(500)
+            if not batch:
+                break
+            for row in batch:
+                rows += 1
+                values = dict((f.attname, value) for f, value in zip(fields, row))
+                if values['id'] in done:
+                    continue
+                if record(Minutes(**values), row[-1], date=row[-2]):
+                    revisions += 1
+        if options['delete']:
+            connection.cursor().execute('DELETE FROM %s' % qn(HISTORY_TABLE))
+        if int(options.get('verbosity', 1)) > 0:
+            self.stdout.write('Converted %s history rows into %s revisions.\n' % (rows, revisions))
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from committees.models import Group, Meeting
+from committees.packets import group_year_files, meeting_files, stream_zip
+
+
+class Command(BaseCommand):
+    args = '<group slug> <year> [<month>] <output.zip>'
+    help = ('Writes the meeting packet of one meeting, or of every meeting of a group in a year, '
+            'to a ZIP file. Draft minutes are included.')
+
+    def handle(self, *args, **options):
+        if len(args) not in (3, 4):
+            raise CommandError('Usage: export_packets %s' % self.args)
+        slug, year, output = args[0], int(args[1]), args[-1]
+        try:
+            group = Group.objects.get(slug=slug)
+        except Group.DoesNotExist:
+            raise CommandError('No group with slug "%s".' % slug)
+        if len(args) == 4:
+            try:
+                meeting = Meeting.objects.select_related('group').get(group=group, start__year=year, start__month=args[2])
+            except Meeting.DoesNotExist:
+                raise CommandError('No %s meeting in %s/%s.' % (group, year, args[2]))
+            files = meeting_files(meeting, include_drafts=True)
+        else:
+            files = group_year_files(group, year, include_drafts=True)
+        size = 0
+        with open(output, 'wb') as f:
+            for chunk in stream_zip(files):
+                f.write(chunk)
+                size += len(chunk)
+        if int(options.get('verbosity', 1)) > 0:
+            self.stdout.write('Wrote %s bytes to %s.\n' % (size, output))
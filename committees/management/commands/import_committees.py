@@ -0,0 +1,30 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from committees.importer import BATCH_SIZE, IMPORTERS, import_file
+
+
+class Command(BaseCommand):
+    args = '<%s> <file>' % '|'.join(sorted(IMPORTERS))
+    help = ('Imports people, terms, meetings or minutes from a CSV file with a header row, or from '
+            'JSON lines. Rows are matched on their slug or natural key and updated, or created.')
+    option_list = BaseCommand.option_list + (
+        make_option('--format', dest='format', default=None,
+            help='"csv" or "json"; guessed from the file extension by default.'),
+        make_option('--batch-size', dest='batch_size', type='int', default=BATCH_SIZE,
+            help='Rows written per transaction.'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 2 or args[0] not in IMPORTERS:
+            raise CommandError('Usage: import_committees %s' % self.args)
+        kind, path = args
+        format = options['format'] or (path.endswith('.csv') and 'csv' or 'json')
+        with open(path, 'rb' if format == 'csv' else 'r') as f:
+            result = import_file(kind, f, format, options['batch_size'])
+        for line, message in result.errors:
+            self.stderr.write('Line %s: %s\n' % (line, message))
+        if int(options.get('verbosity', 1)) > 0:
+            self.stdout.write('%s: %s created, %s updated, %s rows with errors.\n' % (
+                kind, result.created, result.updated, len(result.errors)))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from committees.attendance import rebuild
+
+
+class Command(BaseCommand):
+    help = 'Recomputes every attendance rollup from the minutes attendance tables.'
+
+    @transaction.commit_on_success
+    def handle(self, *args, **options):
+        count = rebuild()
+        if int(options.get('verbosity', 1)) > 0:
+            self.stdout.write('Stored %s attendance rollups.\n' % count)
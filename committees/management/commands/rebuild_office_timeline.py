@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from committees.models import Office, OfficeHolding
+
+
+class Command(BaseCommand):
+    args = '[office_slug ...]'
+    help = 'Rebuilds the office holder timeline from terms, for all offices or the given ones.'
+
+    def handle(self, *slugs, **options):
+        offices = Office.objects.all()
+        if slugs:
+            offices = offices.filter(slug__in=slugs)
+        for office in offices:
+            holdings = OfficeHolding.objects.rebuild(office.pk)
+            if int(options.get('verbosity', 1)) > 1:
+                self.stdout.write('%s: %s holdings\n' % (office, len(holdings)))
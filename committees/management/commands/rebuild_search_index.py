@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from committees import search
+
+
+class Command(BaseCommand):
+    help = 'Re-indexes all minutes, meeting agendas and attachments for full-text search.'
+
+    def handle(self, *args, **options):
+        count = search.rebuild_index()
+        if int(options.get('verbosity', 1)) > 0:
+            self.stdout.write('Indexed %s objects.\n' % count)
@@ -0,0 +1,38 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from committees.cache import bump_generation
+from committees.models import Group, GroupPhoto, Meeting, Minutes
+
+
+class Command(BaseCommand):
+    help = ('Re-renders stored markup whose source or renderer version changed, '
+            'e.g. after upgrading markdown or typogrify and bumping COMMITTEES_MARKUP_VERSION.')
+    option_list = BaseCommand.option_list + (
+        make_option('--force', action='store_true', dest='force', default=False,
+            help='Re-render every row, stale or not.'),
+    )
+
+    def handle(self, *args, **options):
+        verbosity = int(options.get('verbosity', 1))
+        total = 0
+        for model in (Group, GroupPhoto, Meeting, Minutes):
+            names = ['pk']
+            for source, rendered, hashed in model.rendered_markup_fields:
+                names.extend([source, hashed])
+            if 'markup' in [f.name for f in model._meta.fields]:
+                names.append('markup')
+            count = 0
+            # Only the sources and hashes are loaded, and rows are written
+            # back with update() so no save signals or timestamps fire.
+            for obj in model.objects.only(*names[1:]).iterator():
+                changed = obj.render_markup(force=options['force'])
+                if changed:
+                    model.objects.filter(pk=obj.pk).update(**dict((f, getattr(obj, f)) for f in changed))
+                    count += 1
+            total += count
+            if verbosity > 0:
+                self.stdout.write('%s: re-rendered %s rows.\n' % (model._meta.verbose_name_plural, count))
+        if total:
+            bump_generation()
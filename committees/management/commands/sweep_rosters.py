@@ -0,0 +1,47 @@
+from datetime import date, datetime, timedelta
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+
+from committees.models import Group, RosterEntry, Term
+
+
+class Command(BaseCommand):
+    help = ('Rebuilds the rosters of groups whose terms started or ended by date alone since '
+            'the last sweep. Meant to run nightly; --all rebuilds every roster.')
+    option_list = BaseCommand.option_list + (
+        make_option('--since', dest='since', default=None,
+            help='Date of the previous sweep, YYYY-MM-DD. Defaults to yesterday.'),
+        make_option('--all', action='store_true', dest='all', default=False,
+            help='Rebuild every roster.'),
+    )
+
+    def handle(self, *args, **options):
+        today = date.today()
+        if options['since']:
+            try:
+                since = datetime.strptime(options['since'], '%Y-%m-%d').date()
+            except ValueError:
+                raise CommandError('--since must be a date as YYYY-MM-DD.')
+        else:
+            since = today - timedelta(days=1)
+
+        if options['all']:
+            groups = Group.objects.all()
+        else:
+            # Terms starting after the last sweep are now running, and terms
+            # whose last day fell before today are over.
+            changed = Term.objects.filter(Q(start__gt=since, start__lte=today) |
+                                          Q(end__gte=since - timedelta(days=1), end__lt=today))
+            group_ids = set(changed.values_list('group', flat=True))
+            if changed.filter(office__ex_officio=True).exists():
+                group_ids.update(Group.objects.filter(ex_officio=True).values_list('pk', flat=True))
+            groups = Group.objects.filter(pk__in=group_ids)
+
+        count = 0
+        for group in groups:
+            RosterEntry.objects.rebuild(group)
+            count += 1
+        if int(options.get('verbosity', 1)) > 0:
+            self.stdout.write('Rebuilt %s rosters.\n' % count)
@@ -0,0 +1,26 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from committees.models import Attachment
+
+
+class Command(BaseCommand):
+    help = 'Stores size, MIME type and checksum for attachments uploaded before they were recorded.'
+    option_list = BaseCommand.option_list + (
+        make_option('--all', action='store_true', dest='all', default=False,
+            help='Recompute every attachment, not only those missing a checksum.'),
+    )
+
+    def handle(self, *args, **options):
+        attachments = Attachment.objects.all()
+        if not options['all']:
+            attachments = attachments.filter(checksum='')
+        count = 0
+        for attachment in attachments.iterator():
+            attachment.update_file_metadata()
+            Attachment.objects.filter(pk=attachment.pk).update(
+                size=attachment.size, mime_type=attachment.mime_type, checksum=attachment.checksum)
+            count += 1
+        if int(options.get('verbosity', 1)) > 0:
+            self.stdout.write('Updated %s attachments.\n' % count)
@@ -1,18 +1,100 @@
-from datetime import datetime
-from django.db.models import Manager
+import sqlite3
+from datetime import datetime, date, timedelta
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, router, transaction
+from django.db.models import Count, Manager, Sum, get_model
 from django.db.models import Q
+from django.db.models.query import QuerySet
+from django.utils import six, timezone
+from django.utils.dateparse import parse_datetime
 
-class BoardManager(Manager):
-    """Returns all meetings of the type: Governing board"""
+from committees.cache import bump_generation
+
+def tenure_sql(person_column, using=DEFAULT_DB_ALIAS):
+    """SQL subquery summing the years served over every term of a person,
+    for the database ``using``.
+
+    Open-ended terms count up to the current year, which is passed as the
+    only parameter."""
+    ops = connections[using].ops
+    qn = ops.quote_name
+    table = get_model('committees', 'Term')._meta.db_table
+    start = ops.date_extract_sql('year', 'tt.%s' % qn('start'))
+    end = ops.date_extract_sql('year', 'tt.%s' % qn('end'))
+    return ('SELECT COALESCE(SUM(CASE WHEN tt.%(end)s IS NULL THEN %%s ELSE %(end_year)s END - %(start_year)s), 0) '
+            'FROM %(table)s tt WHERE tt.%(person)s = %(outer)s' % {
+                'end': qn('end'), 'end_year': end, 'start_year': start,
+                'table': qn(table), 'person': qn('person_id'), 'outer': person_column})
+
+class TenureQuerySet(QuerySet):
+    tenure_person_column = None
+
+    def with_tenure(self):
+        """Annotates every row with ``tenure_years`` in the same query."""
+        qn = connections[self.db].ops.quote_name
+        column = '%s.%s' % (qn(self.model._meta.db_table), qn(self.tenure_person_column))
+        return self.extra(select={'tenure_years': tenure_sql(column, self.db)},
+                          select_params=(datetime.now().year,))
+
+class TermQuerySet(TenureQuerySet):
+    tenure_person_column = 'person_id'
+
+    def active_on(self, day=None):
+        """Terms running on ``day``, today by default."""
+        day = day or date.today()
+        return self.filter(start__lte=day).filter(Q(end__gte=day)|Q(end__isnull=True))
+
+    def overlapping(self, start, end=None):
+        """Terms running at any point between ``start`` and ``end``, inclusive.
+
+        An ``end`` of None means the range is open ended."""
+        qs = self.filter(Q(end__gte=start)|Q(end__isnull=True))
+        if end is not None:
+            qs = qs.filter(start__lte=end)
+        return qs
+
+    def started_in(self, year):
+        """Terms starting in ``year``, as a range so the start index is used."""
+        year = int(year)
+        return self.filter(start__gte=date(year, 1, 1), start__lt=date(year + 1, 1, 1))
+
+class PersonQuerySet(TenureQuerySet):
+    tenure_person_column = 'id'
+
+class TermManager(Manager):
+    def get_query_set(self):
+        return TermQuerySet(self.model, using=self._db)
+
+    def with_tenure(self):
+        return self.get_query_set().with_tenure()
+
+    def active_on(self, day=None):
+        return self.get_query_set().active_on(day)
+
+    def overlapping(self, start, end=None):
+        return self.get_query_set().overlapping(start, end)
+
+    def started_in(self, year):
+        return self.get_query_set().started_in(year)
+
+class PersonManager(Manager):
+    def get_query_set(self):
+        return PersonQuerySet(self.model, using=self._db)
+
+    def with_tenure(self):
+        return self.get_query_set().with_tenure()
+
+class BoardManager(TermManager):
+    """Returns all terms of the type: Governing board"""
 
     def get_query_set(self):
         return super(BoardManager, self).get_query_set().filter(group__type__slug='board')
 	
-class ActiveTermManager(Manager):
+class ActiveTermManager(TermManager):
     """Returns all currently active terms."""
 
     def get_query_set(self):
-        return super(ActiveTermManager, self).get_query_set().filter(start__lte=datetime.now().date()).filter(Q(end__gte=datetime.now().date())|Q(end__isnull=True))
+        return super(ActiveTermManager, self).get_query_set().active_on(date.today())
 
 class ActiveGroupManager(Manager):
     """Returns all currently active groups."""
@@ -25,3 +107,246 @@ class ApprovedManager(Manager):
 
     def get_query_set(self):
         return super(ApprovedManager, self).get_query_set().filter(draft=False)
+
+def _in_transaction(model, func, *args):
+    """Calls ``func`` in the caller's transaction, or in one of its own, so
+    readers never see rows deleted and not yet recreated."""
+    using = router.db_for_write(model)
+    if transaction.is_managed(using=using):
+        return func(*args)
+    with transaction.commit_on_success(using=using):
+        return func(*args)
+
+class OfficeHoldingManager(Manager):
+    """Reads and rebuilds the office-holder timeline."""
+
+    def current(self, day=None):
+        day = day or date.today()
+        return self.filter(start__lte=day).filter(Q(end__gte=day)|Q(end__isnull=True))
+
+    def previous(self, day=None):
+        """Holdings that ended before ``day`` by someone not currently holding them."""
+        day = day or date.today()
+        current = self.current(day).exclude(person__isnull=True).values('person')
+        return self.filter(end__lt=day).exclude(person__in=current).order_by('-end')
+
+    def rebuild(self, office_id):
+        """Recomputes the timeline of one office from its terms.
+
+        Terms held back to back by the same person are collapsed into a
+        single holding, which is what "previous holder" is asked about.
+        Runs in a transaction, like ``attendance.rebuild``, and bumps the
+        cache generation after."""
+        holdings = _in_transaction(self.model, self._rebuild, office_id)
+        bump_generation()
+        return holdings
+
+    def _rebuild(self, office_id):
+        Term = get_model('committees', 'Term')
+        self.filter(office=office_id).delete()
+        stints = {}
+        for t in Term.objects.filter(office=office_id).order_by('start'):
+            runs = stints.setdefault(t.person_id, [])
+            last = runs and runs[-1] or None
+            if last and last.end is not None and t.start <= last.end + timedelta(days=1):
+                if t.end is None or t.end > last.end:
+                    last.end = t.end
+                last.term_id = t.pk
+                last.terms += 1
+            else:
+                runs.append(self.model(office_id=office_id, person_id=t.person_id, term_id=t.pk,
+                                       start=t.start, end=t.end, terms=1))
+        holdings = [h for runs in stints.values() for h in runs]
+        self.bulk_create(holdings)
+        return holdings
+
+class RosterEntryManager(Manager):
+    """Rebuilds the denormalized roster of a group."""
+
+    def rebuild(self, group):
+        """Replaces the roster of ``group`` with its current membership.
+
+        Costs a fixed number of queries: current terms, plain members and
+        the shared ex-officio holders. Runs in a transaction and bumps the
+        cache generation after, as ``OfficeHoldingManager.rebuild`` does."""
+        entries = _in_transaction(self.model, self._rebuild, group)
+        bump_generation()
+        return entries
+
+    def _rebuild(self, group):
+        from committees.models import exofficio_holders
+        Term = get_model('committees', 'Term')
+        entries = []
+        terms = Term.objects.active_on().filter(group=group).values_list('pk', 'person', 'office', 'alternate')
+        for term_id, person_id, office_id, alternate in terms:
+            entries.append(self.model(group_id=group.pk, term_id=term_id, person_id=person_id, office_id=office_id,
+                                      alternate=alternate, source=self.model.SOURCE_TERM))
+        for person_id in group.members.values_list('pk', flat=True):
+            entries.append(self.model(group_id=group.pk, person_id=person_id, source=self.model.SOURCE_MEMBER))
+        if group.ex_officio:
+            for t in exofficio_holders():
+                if t.group_id != group.pk:
+                    entries.append(self.model(group_id=group.pk, term_id=t.pk, person_id=t.person_id,
+                                              office_id=t.office_id, alternate=t.alternate,
+                                              source=self.model.SOURCE_EX_OFFICIO))
+        for position, entry in enumerate(entries):
+            entry.position = position
+        self.filter(group=group).delete()
+        self.bulk_create(entries)
+        return entries
+
+def supports_window_functions(using):
+    conn = connections[using]
+    if conn.vendor in ('postgresql', 'oracle'):
+        return True
+    if conn.vendor == 'sqlite':
+        return sqlite3.sqlite_version_info >= (3, 25)
+    return False
+
+def _to_datetime(value):
+    # Values read through window functions bypass the sqlite column
+    # converters and come back as strings.
+    if isinstance(value, six.string_types):
+        value = parse_datetime(value)
+        if value is not None and settings.USE_TZ and timezone.is_naive(value):
+            value = timezone.make_aware(value, timezone.utc)
+    return value
+
+def annotate_neighbors(meetings, using='default'):
+    """Sets the previous and next meeting of the same group on each meeting.
+
+    Neighbors are taken from the whole history of each group, not just the
+    meetings passed in, and resolved in one query: LAG/LEAD window
+    functions where the backend has them, otherwise a single ordered scan
+    of the groups' meetings walked in Python."""
+    meetings = [m for m in meetings if m.pk is not None]
+    if not meetings:
+        return meetings
+    model = meetings[0].__class__
+    pk, start = model._meta.pk.column, model._meta.get_field('start').column
+    history = model._default_manager.using(using).filter(group__in=set(m.group_id for m in meetings))
+    neighbors = {}
+    if supports_window_functions(using):
+        qn = connections[using].ops.quote_name
+        inner, params = history.order_by().values_list('pk', 'group', 'start').query.sql_with_params()
+        wanted = [m.pk for m in meetings]
+        sql = ('SELECT s.pk, s.prev_pk, s.prev_start, s.next_pk, s.next_start FROM ('
+               'SELECT n.%(pk)s AS pk, LAG(n.%(pk)s) OVER w AS prev_pk, LAG(n.%(start)s) OVER w AS prev_start, '
+               'LEAD(n.%(pk)s) OVER w AS next_pk, LEAD(n.%(start)s) OVER w AS next_start '
+               'FROM (%(inner)s) n WINDOW w AS (PARTITION BY n.%(group)s ORDER BY n.%(start)s, n.%(pk)s)'
+               ') s WHERE s.pk IN (%(wanted)s)' % {
+                   'pk': qn(pk), 'start': qn(start), 'group': qn('group_id'), 'inner': inner,
+                   'wanted': ', '.join(['%s'] * len(wanted))})
+        cursor = connections[using].cursor()
+        cursor.execute(sql, tuple(params) + tuple(wanted))
+        for row_pk, prev_pk, prev_start, next_pk, next_start in cursor.fetchall():
+            neighbors[row_pk] = ((prev_pk, _to_datetime(prev_start)), (next_pk, _to_datetime(next_start)))
+    else:
+        last = {}
+        rows = list(history.order_by('group', 'start', 'pk').values_list('pk', 'group', 'start'))
+        for i, (row_pk, group_id, row_start) in enumerate(rows):
+            previous = last.get(group_id, (None, None))
+            following = (None, None)
+            if i + 1 < len(rows) and rows[i + 1][1] == group_id:
+                following = (rows[i + 1][0], rows[i + 1][2])
+            neighbors[row_pk] = (previous, following)
+            last[group_id] = (row_pk, row_start)
+    for m in meetings:
+        m._neighbors = neighbors.get(m.pk, ((None, None), (None, None)))
+    return meetings
+
+class MeetingQuerySet(QuerySet):
+    _with_neighbors = False
+
+    def with_neighbors(self):
+        """Resolves previous/next meeting navigation for every row in one extra query."""
+        return self._clone(_with_neighbors=True)
+
+    def _clone(self, *args, **kwargs):
+        kwargs.setdefault('_with_neighbors', self._with_neighbors)
+        return super(MeetingQuerySet, self)._clone(*args, **kwargs)
+
+    def iterator(self):
+        if not self._with_neighbors:
+            for obj in super(MeetingQuerySet, self).iterator():
+                yield obj
+            return
+        objects = list(super(MeetingQuerySet, self).iterator())
+        annotate_neighbors(objects, using=self.db)
+        for obj in objects:
+            yield obj
+
+    def archive_counts(self):
+        """Meeting counts per year and month, newest first, from one GROUP BY query.
+
+        Returns dicts with ``year``, ``month`` and ``count``."""
+        ops, qn = connections[self.db].ops, connections[self.db].ops.quote_name
+        field = self.model._meta.get_field('start')
+        column = '%s.%s' % (qn(field.model._meta.db_table), qn(field.column))
+        # extra() never joins the parent table ``start`` lives in, so a
+        # filter on it does. The join reuses an existing one, and its alias
+        # is the table name.
+        return (self.order_by().filter(start__isnull=False).extra(select={'year': 'CAST(%s AS INTEGER)' % ops.date_extract_sql('year', column),
+                                              'month': 'CAST(%s AS INTEGER)' % ops.date_extract_sql('month', column)})
+                .values('year', 'month').annotate(count=Count('pk')).order_by('-year', '-month'))
+
+class MeetingManager(Manager):
+    def get_query_set(self):
+        return MeetingQuerySet(self.model, using=self._db)
+
+    def with_neighbors(self):
+        return self.get_query_set().with_neighbors()
+
+    def archive_counts(self):
+        return self.get_query_set().archive_counts()
+
+class AttendanceQuerySet(QuerySet):
+    def with_rate(self):
+        """Annotates every row with ``rate``, the percentage of the year's meetings attended."""
+        table = connections[self.db].ops.quote_name(self.model._meta.db_table)
+        return self.extra(select={'rate': 'CASE WHEN %(t)s.meetings > 0 THEN %(t)s.attended * 100.0 / %(t)s.meetings END'
+                                          % {'t': table}})
+
+    def below(self, rate):
+        """Rows where less than ``rate`` percent of the year's meetings were attended."""
+        table = connections[self.db].ops.quote_name(self.model._meta.db_table)
+        return self.extra(where=['%(t)s.attended * 100.0 < %%s * %(t)s.meetings' % {'t': table}], params=[rate])
+
+    def totals(self):
+        """Attended and held meetings summed over the selected years, per person and group."""
+        return self.order_by().values('person', 'group').annotate(attended=Sum('attended'), meetings=Sum('meetings'))
+
+    def streaks(self, rate=100):
+        """Runs of consecutive years in which a person attended at least ``rate``
+        percent of a group's meetings.
+
+        Returns ``{(person_id, group_id): (current, longest)}`` where the
+        current run is the one reaching the person's latest year."""
+        streaks = {}
+        last = None
+        for person_id, group_id, year, attended, meetings in (self.order_by('person', 'group', 'year')
+                .values_list('person', 'group', 'year', 'attended', 'meetings')):
+            key = (person_id, group_id)
+            current, longest = streaks.get(key, (0, 0))
+            if last != (key, year - 1):
+                current = 0
+            current = current + 1 if meetings and attended * 100.0 >= rate * meetings else 0
+            streaks[key] = (current, max(longest, current))
+            last = (key, year)
+        return streaks
+
+class AttendanceManager(Manager):
+    def get_query_set(self):
+        return AttendanceQuerySet(self.model, using=self._db)
+
+    def with_rate(self):
+        return self.get_query_set().with_rate()
+
+    def below(self, rate):
+        return self.get_query_set().below(rate)
+
+    def totals(self):
+        return self.get_query_set().totals()
+
+    def streaks(self, rate=100):
+        return self.get_query_set().streaks(rate)
@@ -0,0 +1,105 @@
+'''Save-time rendering of markup fields.
+
+Markup and typogrify are rendered once into stored columns alongside a hash
+of the source and the renderer version, so templates only emit stored HTML
+and stale rows can be found and re-rendered in bulk after an upgrade.
+'''
+import hashlib
+
+from django.conf import settings
+from django.contrib.markup.templatetags import markup
+from django.db import models
+from django.utils.html import conditional_escape
+from django.utils.translation import ugettext_lazy as _
+
+try:
+    from typogrify.templatetags.typogrify import typogrify
+except ImportError:
+    try:
+        from typogrify.filters import typogrify
+    except ImportError:
+        typogrify = None
+
+# Bump to have the render_markup command re-render every stored field.
+RENDERER_VERSION = getattr(settings, 'COMMITTEES_MARKUP_VERSION', 1)
+
+MARKUP_HTML = 'h'
+MARKUP_MARKDOWN = 'm'
+MARKUP_REST = 'r'
+MARKUP_TEXTILE = 't'
+
+def render_markup(text, markup_type=MARKUP_MARKDOWN):
+    '''Renders ``text`` to HTML the way the templates used to, typogrify included.'''
+    if not text:
+        return u''
+    if markup_type == MARKUP_MARKDOWN:
+        html = markup.markdown(text)
+    elif markup_type == MARKUP_REST:
+        html = markup.restructuredtext(text)
+    elif markup_type == MARKUP_TEXTILE:
+        html = markup.textile(text)
+    elif markup_type == MARKUP_HTML:
+        # "HTML/Plain Text" in MarkupMixin: entered by staff as HTML.
+        html = text
+    else:
+        # Unknown markup is shown as text, since templates output rendered
+        # fields unescaped.
+        html = conditional_escape(text)
+    if typogrify is not None:
+        html = typogrify(html)
+    return html
+
+def markup_hash(text, markup_type=MARKUP_MARKDOWN):
+    source = u'%s:%s:%s' % (RENDERER_VERSION, markup_type, text or u'')
+    return hashlib.sha1(source.encode('utf-8')).hexdigest()
+
+class RenderedMarkupMixin(models.Model):
+    '''Renders markup fields into stored columns when their source changes.
+
+    ``rendered_markup_fields`` lists ``(source, rendered, hash)`` field names.
+    Models also using ``MarkupMixin`` keep its per-row markup type, but the
+    rendering itself is done here, only when the source hash is stale.'''
+    rendered_markup_fields = ()
+
+    class Meta:
+        abstract = True
+
+    def __init__(self, *args, **kwargs):
+        super(RenderedMarkupMixin, self).__init__(*args, **kwargs)
+        # Rows saved before their rendered column existed are rendered when
+        # loaded, in memory only; the render_markup command stores them.
+        # Deferred fields are not in __dict__ and are left alone.
+        markup_type = self.__dict__.get('markup', MARKUP_MARKDOWN)
+        for source, rendered, hashed in self.rendered_markup_fields:
+            if self.__dict__.get(source) and not self.__dict__.get(rendered, True):
+                setattr(self, rendered, render_markup(self.__dict__[source], markup_type))
+
+    def save(self, *args, **kwargs):
+        self.render_markup()
+        super(RenderedMarkupMixin, self).save(*args, **kwargs)
+
+    def do_render_markup(self):
+        # Replaces MarkupMixin's unconditional render on every save.
+        return False
+
+    @property
+    def markup_type(self):
+        return getattr(self, 'markup', MARKUP_MARKDOWN)
+
+    def stale_markup_fields(self):
+        return [(source, rendered, hashed) for source, rendered, hashed in self.rendered_markup_fields
+                if getattr(self, hashed) != markup_hash(getattr(self, source), self.markup_type)]
+
+    def render_markup(self, force=False):
+        '''Re-renders stale fields, or all with ``force``. Returns the rendered field names.'''
+        fields = force and self.rendered_markup_fields or self.stale_markup_fields()
+        changed = []
+        for source, rendered, hashed in fields:
+            text = getattr(self, source)
+            setattr(self, rendered, render_markup(text, self.markup_type))
+            setattr(self, hashed, markup_hash(text, self.markup_type))
+            changed.extend([rendered, hashed])
+        return changed
+
+def hash_field():
+    return models.CharField(_('Rendered hash'), max_length=40, blank=True, editable=False)
@@ -1,16 +1,32 @@
+import hashlib
+import mimetypes
+
+from django.conf import settings
 from django.db import models
+from django.db.models import Q
 from django.utils.translation import ugettext_lazy as _
 from datetime import datetime, date
 from django.contrib.localflavor.us.models import PhoneNumberField
 from django.contrib.auth.models import User
-from markup_mixin.models import MarkupMixin
-from committees.managers import BoardManager, ActiveTermManager, ActiveGroupManager, ApprovedManager
+from django.core.urlresolvers import reverse
+from django.utils import timezone
+from markup_mixin.models import MarkupBase, MarkupMixin
+from django.core.cache import cache
+from committees.cache import CACHE_TIMEOUT, cached, get_user_version
+from committees.instrumentation import tracked
+from committees.markup import RenderedMarkupMixin, hash_field
+from committees.managers import BoardManager, ActiveTermManager, ActiveGroupManager, ApprovedManager, AttendanceManager, \
+    MeetingManager, OfficeHoldingManager, PersonManager, RosterEntryManager, TermManager, annotate_neighbors
 
 from django_extensions.db.models import TimeStampedModel, TitleSlugDescriptionModel
 from eventy.models import EventTime
 from photologue.models import ImageModel, Photo
 from simple_history.models import HistoricalRecords
 
+# 'full' keeps a simple_history copy of every save of a Minutes, 'delta'
+# keeps compact MinutesRevision rows instead (see committees.history).
+MINUTES_HISTORY = getattr(settings, 'COMMITTEES_MINUTES_HISTORY', 'full')
+
 class GroupType(TitleSlugDescriptionModel):
     '''Group type model.
 
@@ -31,7 +47,7 @@ class GroupType(TitleSlugDescriptionModel):
     def get_absolute_url(self):
         return ('cm-group-type-detail', None, {'slug': self.slug})
 
-class Group(TimeStampedModel, TitleSlugDescriptionModel):
+class Group(RenderedMarkupMixin, TimeStampedModel, TitleSlugDescriptionModel):
     '''Group model.
 
     Manages the various types of governing groups in an organization. (e.g. Governing Board, Music Committee, etc...)
@@ -48,13 +64,19 @@ class Group(TimeStampedModel, TitleSlugDescriptionModel):
     #deceased_members = models.ManyToManyField('Person', related_name='deceased_members', blank=True, null=True, help_text='Non-term limited members who have passed away')
     special_title=models.CharField(_('Special title'), max_length=255, blank=True, null=True, help_text='If the auto-generated name for the group makes no sense.')
     ex_officio = models.BooleanField(_('Ex-Officio'), default=False, help_text='Does this group fall under the ex-officio officer rules?')
+    rendered_description = models.TextField(_('Rendered description'), blank=True, null=True, editable=False)
+    description_hash = hash_field()
 
     objects=models.Manager()
     active_objects=ActiveGroupManager()
 
+    rendered_markup_fields = (('description', 'rendered_description', 'description_hash'),)
+
     def __init__(self, *args, **kwargs):
         super(Group, self).__init__(*args, **kwargs)
         self._eo_members = []
+        self._current_terms = None
+        self._original_ex_officio = self.ex_officio
 
     class Meta:
         verbose_name = _('Group')
@@ -76,33 +98,77 @@ class Group(TimeStampedModel, TitleSlugDescriptionModel):
         super(Group, self).save(*args, **kwargs)
 
     @property
+    @tracked('Group.current_terms')
     def current_terms(self):
-        return Term.active_objects.filter(group=self)
+        if self._current_terms is not None:
+            return self._current_terms
+        return Term.objects.active_on().filter(group=self)
 
     @property
+    @tracked('Group.past_terms')
     def past_terms(self):
-        objects=[]
-        for t in Term.objects.all().filter(group=self):
-            if not t in Term.active_objects.all().filter(group=self):
-                objects.append(t)
-        return objects
+        today = date.today()
+        return Term.objects.filter(group=self).filter(Q(start__gt=today)|Q(end__lt=today))
 
     @property
+    @tracked('Group.roster')
+    def roster(self):
+        '''Current membership from the denormalized roster, in one query.'''
+        return self.roster_entries.select_related('person', 'office__group')
+
+    @property
+    @tracked('Group.exofficio_members')
     def exofficio_members(self):
         if not self._eo_members:
             if self.ex_officio:
-                for o in Office.objects.filter(ex_officio=True):
-                    if o.current and (o.current not in self.current_terms):
-                        self._eo_members.append(o.current)
+                self._eo_members = [t for t in exofficio_holders() if t.group_id != self.pk]
         return self._eo_members
 
-class GroupPhoto(ImageModel):
+def partition_terms(groups):
+    '''Primes the ``current_terms`` of many groups.
+
+    Loads the active terms of ``groups`` in a single query, so templates
+    looping over a list of groups no longer query per group. ``past_terms``
+    is left lazy: a group's history only grows, and lists of groups show
+    current terms. Returns the groups.'''
+    groups = list(groups)
+    by_id = {}
+    for g in groups:
+        g._current_terms = []
+        by_id[g.pk] = g
+    if not by_id:
+        return groups
+
+    terms = Term.objects.active_on().filter(group__in=by_id.keys()).select_related('office', 'person')
+    for t in terms:
+        group = by_id[t.group_id]
+        t.group = group
+        group._current_terms.append(t)
+    return groups
+
+def _load_exofficio_holders():
+    return list(Term.active_objects.filter(office__ex_officio=True)
+                .select_related('office', 'person', 'group')
+                .order_by('office__order', 'start'))
+
+def exofficio_holders():
+    '''Returns the current terms of every ex-officio office.
+
+    Resolved with one query per cache generation and shared by every
+    ex-officio group, however many groups and offices there are.'''
+    return cached('exofficio-holders', _load_exofficio_holders)
+
+class GroupPhoto(RenderedMarkupMixin, ImageModel):
     '''Group photo model.
 
     Represents a photo of a governing group at a specific time.'''
     group=models.ForeignKey(Group)
     year=models.IntegerField(_('Year'), max_length=4)
     caption=models.TextField(_('Caption'), blank=True, null=True)
+    rendered_caption=models.TextField(_('Rendered caption'), blank=True, null=True, editable=False)
+    caption_hash=hash_field()
+
+    rendered_markup_fields = (('caption', 'rendered_caption', 'caption_hash'),)
 
     class Meta:
         verbose_name = _('Group photo')
@@ -134,32 +200,77 @@ class Office(TimeStampedModel, TitleSlugDescriptionModel):
         return u'%s of %s' % (self.title, self.group)
 
     @property
+    @tracked('Office.previous')
     def previous(self):
-        current = past = None
-        terms = self.term_set.all().order_by('-end')
-        i=1
-        for t in terms:
-            try:
-                past = terms[i]
-            except:
-                return None
-            if (t.person != past.person) and not t.active:
-                return past
-            i+=1
-        return self.term_set.all().order_by('-end')[1]
+        holding = self.holdings.previous().select_related('term__person', 'term__office')[:1]
+        return holding and holding[0].term or None
+
+    @property
+    @tracked('Office.holders')
+    def holders(self):
+        """Current terms of the office, more than one when it is shared."""
+        if not hasattr(self, '_holders'):
+            self._holders = [h.term for h in self.holdings.current().select_related('term__person', 'term__office')]
+        return self._holders
 
     @property
     def current(self):
-        terms =[]
-        for t in self.term_set.all().order_by('-end'):
-            if t.active:
-                terms.append(t)
+        terms = self.holders
         if len(terms) == 1:
             return terms[0]
-        else:
-            for t in terms:
-                t.office.title = "Co-"+t.office.title
-            return terms
+        return terms
+
+    @property
+    def display_title(self):
+        if len(self.holders) > 1:
+            return u'Co-%s' % self.title
+        return self.title
+
+class OfficeHolding(models.Model):
+    '''Office holding model.
+
+    A materialized timeline of who held each office, one row per unbroken
+    run of terms by the same person. Rebuilt from ``Term`` by signals, so
+    current and previous holders are single indexed reads.'''
+    office=models.ForeignKey(Office, related_name='holdings')
+    person=models.ForeignKey('Person', blank=True, null=True)
+    term=models.ForeignKey('Term', help_text='The latest term of this holding.')
+    start=models.DateField(_('Start'))
+    end=models.DateField(_('End'), blank=True, null=True)
+    terms=models.PositiveIntegerField(_('Terms'), default=1)
+
+    objects=OfficeHoldingManager()
+
+    class Meta:
+        verbose_name = _('Office holding')
+        verbose_name_plural = _('Office holdings')
+        ordering = ('office', '-start',)
+        index_together = (('office', 'start', 'end'), ('office', 'end'),)
+
+    def __unicode__(self):
+        return u'%s - %s (%s)' % (self.person, self.office, self.start.year)
+
+def office_holders(offices, day=None):
+    '''Resolves current and previous holders for many offices in one query.
+
+    Returns a dict keyed by office id with ``current`` (a list of terms) and
+    ``previous`` (a term or None), e.g. for every office of a group.'''
+    day = day or date.today()
+    ids = [getattr(o, 'pk', o) for o in offices]
+    resolved = dict((i, {'current': [], 'previous': None}) for i in ids)
+    holdings = (OfficeHolding.objects.filter(office__in=ids, start__lte=day)
+                .select_related('term__person', 'term__office').order_by('office', '-end'))
+    ended = []
+    for h in holdings:
+        if h.start <= day and (h.end is None or h.end >= day):
+            resolved[h.office_id]['current'].append(h.term)
+        elif h.end is not None and h.end < day:
+            ended.append(h)
+    for h in ended:
+        entry = resolved[h.office_id]
+        if entry['previous'] is None and h.person_id not in [t.person_id for t in entry['current']]:
+            entry['previous'] = h.term
+    return resolved
 
 class Term(TimeStampedModel):
     group = models.ForeignKey(Group)
@@ -169,26 +280,36 @@ class Term(TimeStampedModel):
     alternate = models.BooleanField(_('Alternate'), default=False)
     person=models.ForeignKey('Person', blank=True, null=True)
     
-    objects = models.Manager()
+    objects = TermManager()
     board_members = BoardManager()
     active_objects = ActiveTermManager()
 
+    def __init__(self, *args, **kwargs):
+        super(Term, self).__init__(*args, **kwargs)
+        self._original_office_id = self.office_id
+        self._original_group_id = self.group_id
+        self._original_person_id = self.person_id
+
     class Meta:
         verbose_name = _('Term')
         verbose_name_plural = _('Terms')
         ordering = ('-office','start',)
         get_latest_by = 'start'
+        index_together = (('group', 'start', 'end'), ('person', 'start'),)
+
+    def clean(self):
+        from committees.validation import validate_term
+        validate_term(self)
    
     @property
     def active(self):
-        status=False
-        if self.start <= date.today():
-            if self.end:
-                if self.end >= date.today():
-                    status = True
-            else:
-                status=True
-        return status
+        return self.active_on(date.today())
+
+    def active_on(self, day):
+        '''Whether the term is running on ``day``.'''
+        if self.start > day:
+            return False
+        return self.end is None or self.end >= day
     
     @property
     def length(self):
@@ -196,16 +317,17 @@ class Term(TimeStampedModel):
         else: return None
     
     @property
+    @tracked('Term.tenure')
     def tenure(self):
-        tenure = 0
-        terms = Term.objects.filter(person=self.person)
-        for t in terms:
-            if t.length:
-                tenure += self.length
-            elif not t.end:
-                tenure += datetime.now().year - self.start.year
+        '''Years served by the person over all their terms.
 
-        return tenure
+        Read from ``tenure_years`` when the queryset was built with
+        ``with_tenure()``, otherwise aggregated in one query.'''
+        if hasattr(self, 'tenure_years'):
+            return self.tenure_years
+        if not self.person_id:
+            return 0
+        return Person.objects.with_tenure().filter(pk=self.person_id).values_list('tenure_years', flat=True)[0]
 
     @property
     def officer(self):
@@ -225,6 +347,43 @@ class Term(TimeStampedModel):
         if self.office: return ('cm-term-detail', None, {'slug': self.group.slug, 'office_slug': self.office.slug, })
         else: return None
 
+class RosterEntry(models.Model):
+    '''Roster entry model.
+
+    A denormalized copy of a group's current membership: its running terms,
+    plain members and ex-officio office holders. Kept current by signals and
+    the nightly sweep_rosters command.'''
+    SOURCE_TERM = 1
+    SOURCE_MEMBER = 2
+    SOURCE_EX_OFFICIO = 3
+    SOURCE_CHOICES = (
+        (SOURCE_TERM, 'Term'),
+        (SOURCE_MEMBER, 'Member'),
+        (SOURCE_EX_OFFICIO, 'Ex-officio'),
+    )
+    group=models.ForeignKey(Group, related_name='roster_entries')
+    person=models.ForeignKey('Person', blank=True, null=True)
+    office=models.ForeignKey(Office, blank=True, null=True)
+    term=models.ForeignKey(Term, blank=True, null=True)
+    alternate=models.BooleanField(_('Alternate'), default=False)
+    source=models.PositiveSmallIntegerField(_('Source'), choices=SOURCE_CHOICES)
+    position=models.PositiveIntegerField(_('Position'), default=0)
+
+    objects=RosterEntryManager()
+
+    class Meta:
+        verbose_name = _('Roster entry')
+        verbose_name_plural = _('Roster entries')
+        ordering = ('group', 'position',)
+        index_together = (('group', 'position'),)
+
+    def __unicode__(self):
+        return u'%s - %s' % (self.person, self.office or self.group)
+
+    def get_absolute_url(self):
+        if self.office: return reverse('cm-term-detail', kwargs={'slug': self.office.group.slug, 'office_slug': self.office.slug, })
+        else: return None
+
 class Person(models.Model):
     """Person model."""
     GENDER_CHOICES = (
@@ -244,6 +403,12 @@ class Person(models.Model):
     photo = models.ForeignKey(Photo, blank=True, null=True)
     bio = models.TextField(_('Biography'), blank=True, null=True)
 
+    objects = PersonManager()
+
+    def __init__(self, *args, **kwargs):
+        super(Person, self).__init__(*args, **kwargs)
+        self._original_user_id = self.user_id
+
     class Meta:
         verbose_name = _('person')
         verbose_name_plural = _('people')
@@ -257,31 +422,51 @@ class Person(models.Model):
         return u'%s %s' % (self.first_name, self.last_name)
 
     @property
+    @tracked('Person.tenure')
+    def tenure(self):
+        if hasattr(self, 'tenure_years'):
+            return self.tenure_years
+        return Person.objects.with_tenure().filter(pk=self.pk).values_list('tenure_years', flat=True)[0]
+
+    @property
+    @tracked('Person.on_board')
     def on_board(self):
-        for t in self.term_set.all():
-            if t.group.order == 10:
-                return True
+        return self.term_set.filter(group__order=10).exists() or None
 
     @models.permalink
     def get_absolute_url(self):
         return ('cm-person-detail', None, {'slug': self.slug})
 
 
-class Meeting(MarkupMixin, TimeStampedModel, EventTime):
+class Meeting(RenderedMarkupMixin, MarkupMixin, TimeStampedModel, EventTime):
     '''
     Meeting model.
 
     A general meeting model. 
     '''
+    # RenderedMarkupMixin comes first so its do_render_markup() wins, which
+    # would otherwise give the class ModelBase instead of MarkupMixin's
+    # metaclass.
+    __metaclass__ = MarkupBase
+
     group = models.ForeignKey(Group)
     agenda = models.TextField(_('Agenda'), blank=True, null=True)
     rendered_agenda = models.TextField(_('Rendered agenda'), blank=True, null=True)
+    agenda_hash = hash_field()
     business_arising=models.TextField(_('Business arising'), blank=True, null=True)
 
+    objects = MeetingManager()
+
+    rendered_markup_fields = (('agenda', 'rendered_agenda', 'agenda_hash'),)
+
     def __init__(self, *args, **kwargs):
         super (Meeting, self).__init__(*args, **kwargs)
         self._next = None
         self._previous = None
+        self._neighbors = None
+        # Read from __dict__, as deferred fields would cost a query each.
+        self._original_group_id = self.__dict__.get('group_id')
+        self._original_start = self.__dict__.get('start')
 
     class Meta:
         verbose_name = _('Meeting')
@@ -299,33 +484,39 @@ class Meeting(MarkupMixin, TimeStampedModel, EventTime):
     def get_absolute_url(self):
         return ('cm-meeting-detail', (), {'slug': self.group.slug, 'year': self.start.year, 'month': self.start.month, })
 
+    def _neighbor(self, index):
+        if self._neighbors is None:
+            annotate_neighbors([self], using=self._state.db or 'default')
+        pk, start = self._neighbors[index]
+        if pk is None:
+            return None
+        # Enough of the neighbor to link to it; the group is shared when
+        # already loaded, and never fetched here.
+        meeting = Meeting(pk=pk, group_id=self.group_id, start=start)
+        if hasattr(self, '_group_cache'):
+            meeting.group = self._group_cache
+        return meeting
+
+    @tracked('Meeting.get_next_meeting')
     def get_next_meeting(self):
-        """Determines the next meeting"""
+        """Determines the next meeting of the group"""
 
         if not self._next:
-            try:
-                qs = Meeting.objects.filter(event__calendar=self.event.calendar).exclude(id__exact=self.id)
-                meeting= qs.filter(start__gte=self.start).order_by('start')[0]
-            except (Meeting.DoesNotExist, IndexError):
-                meeting = None
-            self._next = meeting 
-
+            self._next = self._neighbor(1)
         return self._next
 
+    @tracked('Meeting.get_previous_meeting')
     def get_previous_meeting(self):
-        """Determines the previous meeting"""
+        """Determines the previous meeting of the group"""
 
         if not self._previous:
-            try:
-                qs = Meeting.objects.filter(event__calendar=self.event.calendar).exclude(id__exact=self.id)
-                meeting= qs.filter(start__lte=self.start).order_by('-start')[0]
-            except (Meeting.DoesNotExist, IndexError):
-                meeting = None
-            self._previous = meeting 
-
+            self._previous = self._neighbor(0)
         return self._previous
 
-class Minutes(MarkupMixin, TimeStampedModel):
+class Minutes(RenderedMarkupMixin, MarkupMixin, TimeStampedModel):
+    # See Meeting.
+    __metaclass__ = MarkupBase
+
     meeting = models.ForeignKey(Meeting)
     call_to_order = models.TimeField(_('Call to order'), blank=True, null=True)
     members_present = models.ManyToManyField(Term, related_name='members_present')
@@ -334,6 +525,7 @@ class Minutes(MarkupMixin, TimeStampedModel):
     guests_present = models.ManyToManyField(Person, related_name='meeting_guests', blank=True, null=True)
     content = models.TextField(_('Content'))
     rendered_content = models.TextField(_('Rendered content'), blank=True, null=True, editable=False)
+    content_hash = hash_field()
     adjournment = models.TimeField(_('Adjournment'), blank=True, null=True)
     signed = models.ForeignKey(Person, related_name="signed_by")
     signed_date = models.DateField(_('Signed date'), default=datetime.now())
@@ -341,7 +533,15 @@ class Minutes(MarkupMixin, TimeStampedModel):
 
     objects = models.Manager()
     approved_objects = ApprovedManager()
-    history = HistoricalRecords()
+    if MINUTES_HISTORY == 'full':
+        history = HistoricalRecords()
+
+    rendered_markup_fields = (('content', 'rendered_content', 'content_hash'),)
+
+    def __init__(self, *args, **kwargs):
+        super(Minutes, self).__init__(*args, **kwargs)
+        self._attendance = None
+        self._original_meeting_id = self.__dict__.get('meeting_id')
 
     class Meta:
         verbose_name = _('Minutes')
@@ -355,33 +555,85 @@ class Minutes(MarkupMixin, TimeStampedModel):
     def __unicode__(self):
         return u'Minutes from %s' % (self.meeting)
 
-    @proprety
+    @property
+    @tracked('Minutes.board_members')
     def board_members(self):
-        terms = []
-        for m in self.members_present_new.all().sort_by('fisrt_name'):
-            if m.term_set.all():
-                for t in m.term_set.all():
-                    if t.group == self.meeting.group and t.active:
-                        terms.append(t)
-        return terms
+        '''Terms in the meeting's group held by attendees on the day of the meeting.'''
+        if self._attendance is None:
+            resolve_attendance([self])
+        return self._attendance[0]
 
     @property
+    @tracked('Minutes.non_board_members')
     def non_board_members(self):
-        members = []
-        for m in self.members_present_new.all():
-            in_terms=False
-            for t in self.board_members:
-                if t.person == m:
-                    in_terms = True
-            if not in_terms:
-                members.append(m)
-            in_terms=False
-        return members
+        '''Attendees without a running term in the meeting's group.'''
+        if self._attendance is None:
+            resolve_attendance([self])
+        return self._attendance[1]
 
     @models.permalink
     def get_absolute_url(self):
         return ('cm-minutes-detail', (), {'slug':self.meeting.meeting.group.slug, 'year': self.meeting.meeting.start.year, 'month': self.meeting.meeting.event.start.month, })
 
+def is_board_member(user, group):
+    '''Whether ``user`` holds a running term in ``group``.
+
+    Answered with one query and cached per user until the day ends or one
+    of the user's terms changes (see ``committees.cache.bump_user_version``).'''
+    if not user.is_authenticated():
+        return False
+    group_id = getattr(group, 'pk', group)
+    key = 'committees:board-member:%s:%s:%s:%s' % (user.pk, get_user_version(user.pk), group_id,
+                                                  date.today().isoformat())
+    member = cache.get(key)
+    if member is None:
+        member = Term.objects.active_on().filter(person__user=user, group=group_id).exists()
+        cache.set(key, member, CACHE_TIMEOUT)
+    return member
+
+def resolve_attendance(minutes):
+    '''Splits the attendees of many minutes into board and non-board members.
+
+    Loads the meetings, the attendees and the attendees' terms in the
+    meetings' groups with three queries however many minutes are passed,
+    then primes ``board_members`` and ``non_board_members`` on each.'''
+    minutes = [m for m in minutes if m.pk is not None]
+    if not minutes:
+        return minutes
+    meetings = dict((pk, (group_id, start)) for pk, group_id, start in
+                    Meeting.objects.filter(pk__in=set(m.meeting_id for m in minutes))
+                    .values_list('pk', 'group', 'start'))
+
+    through = Minutes.members_present_new.through
+    attendees = {}
+    for row in (through.objects.filter(minutes__in=[m.pk for m in minutes]).select_related('person')
+                .order_by('person__first_name', 'person__last_name')):
+        attendees.setdefault(row.minutes_id, []).append(row.person)
+
+    person_ids = set(p.pk for people in attendees.values() for p in people)
+    group_ids = set(group_id for group_id, start in meetings.values())
+    terms = {}
+    if person_ids:
+        for t in Term.objects.filter(person__in=person_ids, group__in=group_ids).select_related('office'):
+            terms.setdefault((t.person_id, t.group_id), []).append(t)
+
+    for m in minutes:
+        group_id, start = meetings[m.meeting_id]
+        if timezone.is_aware(start):
+            start = timezone.localtime(start)
+        day = start.date()
+        board, others = [], []
+        for person in attendees.get(m.pk, []):
+            running = [t for t in terms.get((person.pk, group_id), []) if t.active_on(day)]
+            for t in running:
+                t.person = person
+            if running:
+                board.extend(running)
+            else:
+                others.append(person)
+        m._attendance = (board, others)
+    return minutes
+
 class Attachment(TimeStampedModel):
     upload_to = lambda inst, fn: 'attach/%s/%s/%s' % (datetime.now().year, inst.minutes.meeting.group.slug, fn)
 
@@ -389,6 +641,14 @@ class Attachment(TimeStampedModel):
     attachment = models.FileField(upload_to=upload_to)
     title = models.CharField(_('Title'), max_length=255)
     description = models.TextField(_('Description'), blank=True, null=True)
+    size = models.PositiveIntegerField(_('Size'), blank=True, null=True, editable=False)
+    mime_type = models.CharField(_('MIME type'), max_length=100, blank=True, editable=False)
+    checksum = models.CharField(_('Checksum'), max_length=40, blank=True, editable=False,
+        help_text='SHA-1 of the file, also used as its ETag.')
+
+    def __init__(self, *args, **kwargs):
+        super(Attachment, self).__init__(*args, **kwargs)
+        self._original_name = self.attachment.name
 
     class Meta:
         ordering = ('-minutes', 'id')
@@ -396,18 +656,130 @@ class Attachment(TimeStampedModel):
     def __unicode__(self):
         return u'%s: %s' % (self.minutes, self.title)
 
+    def save(self, *args, **kwargs):
+        if self.attachment and (not self.checksum or self.attachment.name != self._original_name):
+            self.update_file_metadata()
+        super(Attachment, self).save(*args, **kwargs)
+        self._original_name = self.attachment.name
+
+    def update_file_metadata(self):
+        '''Stores size, MIME type and checksum so listings and downloads never stat the file.'''
+        digest = hashlib.sha1()
+        for chunk in self.attachment.chunks():
+            digest.update(chunk)
+        self.checksum = digest.hexdigest()
+        self.size = self.attachment.size
+        self.mime_type = mimetypes.guess_type(self.attachment.name)[0] or 'application/octet-stream'
+
+    def get_absolute_url(self):
+        return reverse('cm-attachment-download', kwargs={'pk': self.pk, 'filename': self.filename})
+
     @property
     def filename(self):
         return self.attachment.name.split('/')[-1]
 
     @property
     def content_type_class(self):
-        mt = mimetypes.guess_type(self.attachment.path)[0]
-        if mt:
-            content_type = mt.replace('/', '_')
+        if self.mime_type and self.mime_type != 'application/octet-stream':
+            content_type = self.mime_type.replace('/', '_')
         else:
             # assume everything else is text/plain
             content_type = 'text_plain'
 
         return content_type
 
+class MinutesRevision(models.Model):
+    '''Minutes revision model.
+
+    One saved state of a minutes, stored by committees.history as a
+    compressed full snapshot every few revisions and as compressed diffs
+    against the previous revision in between. Rows outlive their minutes.'''
+    TYPE_CREATED = '+'
+    TYPE_CHANGED = '~'
+    TYPE_DELETED = '-'
+    TYPE_CHOICES = (
+        (TYPE_CREATED, 'Created'),
+        (TYPE_CHANGED, 'Changed'),
+        (TYPE_DELETED, 'Deleted'),
+    )
+    minutes_id=models.PositiveIntegerField(_('Minutes id'), db_index=True)
+    revision=models.PositiveIntegerField(_('Revision'))
+    date=models.DateTimeField(_('Date'), default=timezone.now)
+    type=models.CharField(_('Type'), max_length=1, choices=TYPE_CHOICES)
+    snapshot=models.BooleanField(_('Snapshot'), default=False)
+    data=models.TextField(_('Data'), editable=False)
+
+    class Meta:
+        verbose_name = _('Minutes revision')
+        verbose_name_plural = _('Minutes revisions')
+        unique_together = (('minutes_id', 'revision'),)
+        ordering = ('minutes_id', 'revision')
+
+    def __unicode__(self):
+        return u'Revision %s of minutes %s' % (self.revision, self.minutes_id)
+
+    @property
+    def instance(self):
+        '''The minutes as saved in this revision, rebuilt and unsaved.'''
+        from committees.history import rebuild_instance
+        return rebuild_instance(self.minutes_id, self.revision)
+
+class AttendanceRollup(models.Model):
+    '''Attendance rollup model.
+
+    How many of a group's minuted meetings in a year a person attended, out
+    of how many were held. Kept current by committees.attendance so reports
+    never read raw minutes. People holding a term in the group that year
+    have a row even when they attended nothing.'''
+    person=models.ForeignKey(Person, related_name='attendance_rollups')
+    group=models.ForeignKey(Group, related_name='attendance_rollups')
+    year=models.PositiveSmallIntegerField(_('Year'))
+    attended=models.PositiveIntegerField(_('Attended'), default=0)
+    meetings=models.PositiveIntegerField(_('Meetings'), default=0)
+
+    objects = AttendanceManager()
+
+    class Meta:
+        verbose_name = _('Attendance rollup')
+        verbose_name_plural = _('Attendance rollups')
+        unique_together = (('person', 'group', 'year'),)
+        index_together = (('group', 'year'),)
+
+    def __unicode__(self):
+        return u'%s at the %s in %s: %s of %s' % (self.person, self.group, self.year, self.attended, self.meetings)
+
+class SearchDocument(models.Model):
+    '''Search document model.
+
+    The searchable text of a minutes, meeting agenda or attachment, indexed
+    by committees.search with the backend's full-text engine.'''
+    KIND_MINUTES = 'minutes'
+    KIND_MEETING = 'meeting'
+    KIND_ATTACHMENT = 'attachment'
+    KIND_CHOICES = (
+        (KIND_MINUTES, 'Minutes'),
+        (KIND_MEETING, 'Meeting'),
+        (KIND_ATTACHMENT, 'Attachment'),
+    )
+    kind=models.CharField(_('Kind'), max_length=20, choices=KIND_CHOICES)
+    object_id=models.PositiveIntegerField(_('Object id'))
+    group=models.ForeignKey(Group)
+    meeting=models.ForeignKey(Meeting, blank=True, null=True)
+    title=models.CharField(_('Title'), max_length=255)
+    body=models.TextField(_('Body'), blank=True)
+    public=models.BooleanField(_('Public'), default=True, help_text='Draft minutes and their attachments are not public.')
+    modified=models.DateTimeField(_('Modified'), auto_now=True)
+
+    class Meta:
+        verbose_name = _('Search document')
+        verbose_name_plural = _('Search documents')
+        unique_together = (('kind', 'object_id'),)
+
+    def __unicode__(self):
+        return self.title
+
+    def get_absolute_url(self):
+        if self.meeting_id:
+            return self.meeting.get_absolute_url()
+
+from committees import signals
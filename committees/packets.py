@@ -0,0 +1,128 @@
+'''Meeting packets: the minutes, agenda and attachments of meetings as one ZIP.
+
+Archives are produced by a generator that writes each entry as its bytes
+arrive, with sizes and checksums in trailing data descriptors, so memory use
+stays constant and nothing is spooled to a temporary file no matter how many
+scanned PDFs a packet holds. Entries and the archive must stay under 4 GiB,
+as ZIP64 is not written.
+'''
+import struct
+import zlib
+from datetime import datetime
+
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+ZIP_LIMIT = 0xFFFFFFFF
+
+class ZipStream(object):
+    '''Writes a ZIP archive as a sequence of byte strings.'''
+
+    def __init__(self, compress_level=6):
+        self.compress_level = compress_level
+        self.offset = 0
+        self.entries = []
+
+    def _emit(self, data):
+        self.offset += len(data)
+        if self.offset > ZIP_LIMIT:
+            raise ValueError('Packet archives are limited to 4 GiB.')
+        return data
+
+    def add(self, name, chunks, date_time=None, compress=True):
+        '''Yields the bytes of one entry whose content comes from ``chunks``.'''
+        name = name.encode('utf-8')
+        date_time = date_time or datetime.now()
+        dos_time = (date_time.hour << 11) | (date_time.minute << 5) | (date_time.second // 2)
+        dos_date = ((max(date_time.year, 1980) - 1980) << 9) | (date_time.month << 5) | date_time.day
+        method = compress and 8 or 0
+        # Bit 3: sizes and CRC follow the data. Bit 11: UTF-8 names.
+        flags = 0x08 | 0x800
+        header_offset = self.offset
+        yield self._emit(struct.pack('<4s5H3L2H', b'PK\x03\x04', 20, flags, method, dos_time, dos_date,
+                                     0, 0, 0, len(name), 0) + name)
+
+        crc, size, compressed_size = 0, 0, 0
+        compressor = compress and zlib.compressobj(self.compress_level, zlib.DEFLATED, -15) or None
+        for chunk in chunks:
+            if not chunk:
+                continue
+            crc = zlib.crc32(chunk, crc)
+            size += len(chunk)
+            if compressor:
+                chunk = compressor.compress(chunk)
+            if chunk:
+                compressed_size += len(chunk)
+                yield self._emit(chunk)
+        if compressor:
+            chunk = compressor.flush()
+            compressed_size += len(chunk)
+            yield self._emit(chunk)
+        crc &= 0xFFFFFFFF
+        yield self._emit(struct.pack('<4s3L', b'PK\x07\x08', crc, compressed_size, size))
+        self.entries.append((name, flags, method, dos_time, dos_date, crc, compressed_size, size, header_offset))
+
+    def close(self):
+        '''Yields the central directory that ends the archive.'''
+        start = self.offset
+        for name, flags, method, dos_time, dos_date, crc, compressed_size, size, header_offset in self.entries:
+            yield self._emit(struct.pack('<4s6H3L5H2L', b'PK\x01\x02', 20, 20, flags, method, dos_time, dos_date,
+                                         crc, compressed_size, size, len(name), 0, 0, 0, 0, 0,
+                                         header_offset) + name)
+        yield self._emit(struct.pack('<4s4H2LH', b'PK\x05\x06', 0, 0, len(self.entries), len(self.entries),
+                                     self.offset - start, start, 0))
+
+def stream_zip(files, compress_level=6):
+    '''Yields a ZIP archive of ``files``, an iterable of ``(name, date_time, chunks, compress)``.'''
+    archive = ZipStream(compress_level)
+    for name, date_time, chunks, compress in files:
+        for data in archive.add(name, chunks, date_time, compress):
+            yield data
+    for data in archive.close():
+        yield data
+
+def _local(value):
+    if timezone.is_aware(value):
+        value = timezone.localtime(value)
+    return value
+
+def _document(title, html):
+    yield render_to_string('committees/packet_document.html', {'title': title, 'body': html}).encode('utf-8')
+
+def _file_chunks(fieldfile):
+    fieldfile.open('rb')
+    try:
+        for chunk in fieldfile.chunks():
+            yield chunk
+    finally:
+        fieldfile.close()
+
+# Already compressed formats are stored rather than deflated again.
+STORED_TYPES = ('application/pdf', 'application/zip', 'image/jpeg', 'image/png', 'image/gif')
+
+def meeting_files(meeting, include_drafts=False, prefix=u''):
+    '''The packet entries of one meeting, loading each file only as it is written.'''
+    from committees.models import Minutes
+    start = _local(meeting.start)
+    folder = u'%s%s-%s/' % (prefix, meeting.group.slug, start.strftime('%Y-%m-%d'))
+    if meeting.agenda:
+        yield (folder + u'agenda.html', start, _document(u'Agenda: %s' % meeting, meeting.rendered_agenda), True)
+    minutes = Minutes.objects.filter(meeting=meeting).prefetch_related('attachments')
+    if not include_drafts:
+        minutes = minutes.filter(draft=False)
+    for i, m in enumerate(minutes):
+        suffix = i and u'-%s' % (i + 1) or u''
+        yield (folder + u'minutes%s.html' % suffix, _local(m.modified),
+               _document(u'Minutes: %s' % meeting, m.rendered_content), True)
+        for attachment in m.attachments.all():
+            yield (folder + u'attachments/%s-%s' % (attachment.pk, attachment.filename), _local(attachment.modified),
+                   _file_chunks(attachment.attachment), attachment.mime_type not in STORED_TYPES)
+
+def group_year_files(group, year, include_drafts=False):
+    '''The packet entries of every meeting of ``group`` in ``year``.'''
+    from committees.models import Meeting
+    meetings = (Meeting.objects.filter(group=group, start__gte=datetime(year, 1, 1), start__lt=datetime(year + 1, 1, 1))
+                .select_related('group').order_by('start'))
+    for meeting in meetings.iterator():
+        for entry in meeting_files(meeting, include_drafts):
+            yield entry
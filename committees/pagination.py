@@ -0,0 +1,73 @@
+'''Keyset pagination over ``(start, pk)`` for meeting lists.
+
+Pages are addressed by the last row seen instead of an offset, so every page
+is one indexed range read no matter how deep into the history it is.
+'''
+from datetime import datetime
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+PER_PAGE = getattr(settings, 'COMMITTEES_MEETINGS_PER_PAGE', 20)
+TOKEN_FORMAT = '%Y%m%dT%H%M%S'
+
+def make_token(obj):
+    start = obj.start
+    if timezone.is_aware(start):
+        start = timezone.make_naive(start, timezone.utc)
+    return '%s-%s' % (start.strftime(TOKEN_FORMAT), obj.pk)
+
+def parse_token(token):
+    '''Returns ``(start, pk)`` for a page token, or None when it is invalid.'''
+    try:
+        start, pk = token.split('-', 1)
+        start, pk = datetime.strptime(start, TOKEN_FORMAT), int(pk)
+    except (AttributeError, ValueError):
+        return None
+    if settings.USE_TZ:
+        start = timezone.make_aware(start, timezone.utc)
+    return start, pk
+
+class KeysetPage(object):
+    def __init__(self, object_list, has_next, has_previous):
+        self.object_list = object_list
+        self.has_next = has_next
+        self.has_previous = has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    @property
+    def next_token(self):
+        if self.has_next and self.object_list:
+            return make_token(self.object_list[-1])
+
+    @property
+    def previous_token(self):
+        if self.has_previous and self.object_list:
+            return make_token(self.object_list[0])
+
+def keyset_page(queryset, after=None, before=None, per_page=PER_PAGE):
+    '''Returns a page of ``queryset``, newest first.
+
+    ``after`` continues to older rows past the given token and ``before``
+    goes back to newer rows; with neither, the newest page is returned.'''
+    after, before = after and parse_token(after), before and parse_token(before)
+    if before:
+        start, pk = before
+        rows = list(queryset.filter(Q(start__gt=start) | Q(start=start, pk__gt=pk))
+                    .order_by('start', 'pk')[:per_page + 1])
+        has_previous = len(rows) > per_page
+        rows = rows[:per_page]
+        rows.reverse()
+        return KeysetPage(rows, has_next=True, has_previous=has_previous)
+
+    if after:
+        start, pk = after
+        queryset = queryset.filter(Q(start__lt=start) | Q(start=start, pk__lt=pk))
+    rows = list(queryset.order_by('-start', '-pk')[:per_page + 1])
+    return KeysetPage(rows[:per_page], has_next=len(rows) > per_page, has_previous=bool(after))
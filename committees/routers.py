@@ -0,0 +1,156 @@
+'''Routing committees reads to a read replica.
+
+Add the router and middleware and name the replica alias::
+
+    DATABASE_ROUTERS = ['committees.routers.ReplicaRouter']
+    MIDDLEWARE_CLASSES += ('committees.routers.ReplicaMiddleware',)
+    COMMITTEES_REPLICA_DB = 'replica'
+
+Reads go to the replica only inside ``use_replica()``, which the public
+read-only views and template tags enter through ``replica_reads``. Every
+other read, and every write, of the ``COMMITTEES_REPLICA_APPS`` models goes
+to ``COMMITTEES_PRIMARY_DB``.
+
+Reads stick to the primary for ``COMMITTEES_REPLICA_PIN_SECONDS`` after a
+write, so nobody reads their own change from a lagging replica, nor caches
+a stale page under the generation the write just bumped (see
+``committees.cache``). The window is kept three ways: in the writing
+thread, in a cookie the middleware sets on the writer's response, and in
+the cache, which pins every process sharing it.
+
+For local testing, two SQLite files will do. Have the test runner mirror
+the primary so tests see one set of tables, and give the primary a
+file-backed TEST_NAME: an in-memory SQLite database belongs to the one
+connection that opened it, so the mirror would see an empty database::
+
+    DATABASES = {
+        'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': 'primary.db',
+                    'TEST_NAME': 'test_primary.db'},
+        'replica': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': 'replica.db',
+                    'TEST_MIRROR': 'default'},
+    }
+
+Copy ``primary.db`` over ``replica.db`` to refresh the replica. The mirror
+is a second connection, so it does not see rows written inside a
+``TestCase`` transaction; ``ReplicaDatabaseTest`` is a
+``TransactionTestCase`` for that reason, and is skipped without a
+``replica`` alias.
+'''
+import threading
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+
+PRIMARY_DB = getattr(settings, 'COMMITTEES_PRIMARY_DB', DEFAULT_DB_ALIAS)
+REPLICA_DB = getattr(settings, 'COMMITTEES_REPLICA_DB', None)
+PIN_SECONDS = getattr(settings, 'COMMITTEES_REPLICA_PIN_SECONDS', 15)
+# eventy holds the EventTime half of every meeting.
+REPLICA_APPS = getattr(settings, 'COMMITTEES_REPLICA_APPS', ('committees', 'eventy'))
+
+PIN_COOKIE = 'committees_primary'
+WRITE_KEY = 'committees:last-write'
+
+_local = threading.local()
+
+def pinned_until():
+    return getattr(_local, 'pinned_until', 0)
+
+def pin(until=None):
+    '''Sends this thread's reads to the primary until ``until``, by default
+    for ``PIN_SECONDS`` from now. Records the write for other processes.'''
+    now = time.time()
+    until = until or now + PIN_SECONDS
+    if until > pinned_until():
+        _local.pinned_until = until
+    _local.wrote = True
+    # At most one cache write a second, for bulk imports.
+    if getattr(_local, 'recorded', 0) < now - 1:
+        _local.recorded = now
+        cache.set(WRITE_KEY, now, PIN_SECONDS)
+
+def reading_replica():
+    '''Whether reads in this thread go to the replica right now.'''
+    return bool(REPLICA_DB and getattr(_local, 'depth', 0) and not getattr(_local, 'primary', False)
+                and pinned_until() < time.time())
+
+class use_replica(object):
+    '''Routes reads in the enclosed code to the replica, unless pinned::
+
+        with use_replica():
+            ...
+
+    Whether the primary is pinned is decided once on entering the outermost
+    block, so one view does not mix the two databases.'''
+
+    def __enter__(self):
+        depth = getattr(_local, 'depth', 0)
+        if not depth and REPLICA_DB:
+            now = time.time()
+            last_write = cache.get(WRITE_KEY) or 0
+            _local.primary = pinned_until() > now or last_write > now - PIN_SECONDS
+        _local.depth = depth + 1
+        return self
+
+    def __exit__(self, *exc_info):
+        _local.depth -= 1
+
+def replica_reads(func):
+    '''Runs the decorated view or function inside ``use_replica()``.'''
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        with use_replica():
+            return func(*args, **kwargs)
+    return wrapper
+
+def _routed(model):
+    return REPLICA_DB is not None and model._meta.app_label in REPLICA_APPS
+
+class ReplicaRouter(object):
+    def db_for_read(self, model, **hints):
+        if not _routed(model):
+            return None
+        # Named explicitly, or objects read from the replica would send
+        # their related lookups back to it.
+        return reading_replica() and REPLICA_DB or PRIMARY_DB
+
+    def db_for_write(self, model, **hints):
+        if not _routed(model):
+            return None
+        pin()
+        return PRIMARY_DB
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both hold the same rows.
+        databases = (PRIMARY_DB, REPLICA_DB)
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_syncdb(self, db, model):
+        if REPLICA_DB is not None and db == REPLICA_DB and model._meta.app_label in REPLICA_APPS:
+            return False
+        return None
+
+class ReplicaMiddleware(object):
+    '''Carries the primary pin between requests in a cookie.'''
+    SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS', 'TRACE')
+
+    def process_request(self, request):
+        _local.wrote = False
+        _local.depth = 0
+        try:
+            _local.pinned_until = float(request.COOKIES.get(PIN_COOKIE, 0))
+        except ValueError:
+            _local.pinned_until = 0
+        if request.method not in self.SAFE_METHODS:
+            _local.pinned_until = time.time() + PIN_SECONDS
+
+    def process_response(self, request, response):
+        if getattr(_local, 'wrote', False):
+            response.set_cookie(PIN_COOKIE, '%.3f' % pinned_until(), max_age=PIN_SECONDS)
+        _local.wrote = False
+        _local.pinned_until = 0
+        return response
@@ -0,0 +1,213 @@
+'''Full-text search over minutes, agendas and attachments.
+
+Searchable text is copied into ``SearchDocument`` rows by save signals and
+indexed with the database's own engine: an FTS5 table on SQLite and a GIN
+expression index over ``to_tsvector`` on PostgreSQL. Other backends fall
+back to unindexed ``icontains`` matching.
+'''
+import logging
+
+from django.conf import settings
+from django.db import DatabaseError, connections, router, transaction
+from django.db.models import Q
+
+from committees.models import Attachment, Meeting, Minutes, SearchDocument
+
+logger = logging.getLogger('committees.search')
+
+SEARCH_CONFIG = getattr(settings, 'COMMITTEES_SEARCH_CONFIG', 'english')
+RESULTS = getattr(settings, 'COMMITTEES_SEARCH_RESULTS', 50)
+
+class BasicBackend(object):
+    '''Unindexed matching, for backends without a full-text engine.'''
+
+    def __init__(self, using):
+        self.using = using
+        self.connection = connections[using]
+        self.table = self.connection.ops.quote_name(SearchDocument._meta.db_table)
+
+    def ensure_index(self):
+        pass
+
+    def check_index(self):
+        pass
+
+    def indexed(self, document):
+        pass
+
+    def removed(self, document):
+        pass
+
+    def rebuild(self):
+        pass
+
+    def search(self, queryset, query, limit):
+        for word in query.split():
+            queryset = queryset.filter(Q(title__icontains=word) | Q(body__icontains=word))
+        return list(queryset.order_by('-modified')[:limit])
+
+class SQLiteBackend(BasicBackend):
+    '''An FTS5 table keyed by document id, ranked with bm25().'''
+
+    def __init__(self, using):
+        super(SQLiteBackend, self).__init__(using)
+        self.fts = self.connection.ops.quote_name(SearchDocument._meta.db_table + '_fts')
+
+    def ensure_index(self):
+        self.connection.cursor().execute('CREATE VIRTUAL TABLE IF NOT EXISTS %s USING fts5(title, body)' % self.fts)
+
+    def check_index(self):
+        self.connection.cursor().execute('SELECT rowid FROM %s LIMIT 0' % self.fts)
+
+    def indexed(self, document):
+        cursor = self.connection.cursor()
+        cursor.execute('DELETE FROM %s WHERE rowid = %%s' % self.fts, [document.pk])
+        cursor.execute('INSERT INTO %s (rowid, title, body) VALUES (%%s, %%s, %%s)' % self.fts,
+                       [document.pk, document.title, document.body])
+
+    def removed(self, document):
+        self.connection.cursor().execute('DELETE FROM %s WHERE rowid = %%s' % self.fts, [document.pk])
+
+    def rebuild(self):
+        cursor = self.connection.cursor()
+        cursor.execute('DELETE FROM %s' % self.fts)
+        cursor.execute('INSERT INTO %s (rowid, title, body) SELECT id, title, body FROM %s' % (self.fts, self.table))
+
+    def search(self, queryset, query, limit):
+        # Quote every word so user input is never parsed as FTS5 syntax.
+        match = ' '.join('"%s"' % word.replace('"', '""') for word in query.split())
+        candidates, params = queryset.values('pk').query.sql_with_params()
+        cursor = self.connection.cursor()
+        cursor.execute('SELECT rowid FROM %s WHERE %s MATCH %%s AND rowid IN (%s) ORDER BY bm25(%s) LIMIT %%s'
+                       % (self.fts, self.fts, candidates, self.fts), [match] + list(params) + [limit])
+        ranked = [row[0] for row in cursor.fetchall()]
+        found = queryset.in_bulk(ranked)
+        return [found[pk] for pk in ranked if pk in found]
+
+class PostgreSQLBackend(BasicBackend):
+    '''A GIN expression index over to_tsvector(), ranked with ts_rank().'''
+
+    def vector(self):
+        # Qualified, as searches join committees_group, which has a title too.
+        return "to_tsvector('%s', %s.title || ' ' || %s.body)" % (SEARCH_CONFIG, self.table, self.table)
+
+    def ensure_index(self):
+        self.connection.cursor().execute('CREATE INDEX IF NOT EXISTS %s ON %s USING gin(%s)' % (
+            self.connection.ops.quote_name(SearchDocument._meta.db_table + '_tsv'), self.table, self.vector()))
+
+    def search(self, queryset, query, limit):
+        tsquery = "plainto_tsquery('%s', %%s)" % SEARCH_CONFIG
+        return list(queryset.extra(
+            select={'rank': 'ts_rank(%s, %s)' % (self.vector(), tsquery)}, select_params=[query],
+            where=['%s @@ %s' % (self.vector(), tsquery)], params=[query]).order_by('-rank')[:limit])
+
+_backends = {}
+
+def get_backend(using=None, create=True):
+    '''The backend of ``using``, by default the database SearchDocuments are
+    written to. With ``create`` False, as for searches that may run on a
+    read replica, a missing index is not created and basic matching is used.'''
+    using = using or router.db_for_write(SearchDocument)
+    if not create and (using, True) in _backends:
+        return _backends[using, True]
+    if (using, create) not in _backends:
+        vendor = connections[using].vendor
+        if vendor == 'sqlite':
+            backend = SQLiteBackend(using)
+        elif vendor == 'postgresql':
+            backend = PostgreSQLBackend(using)
+        else:
+            backend = BasicBackend(using)
+        try:
+            if create:
+                backend.ensure_index()
+            else:
+                backend.check_index()
+        except DatabaseError:
+            # e.g. SQLite built without FTS5.
+            logger.warning('Full-text search is not available on %s, using basic matching.', using)
+            transaction.rollback_unless_managed(using=using)
+            backend = BasicBackend(using)
+        _backends[using, create] = backend
+    return _backends[using, create]
+
+def document_kind(obj):
+    for model, kind in ((Minutes, SearchDocument.KIND_MINUTES), (Meeting, SearchDocument.KIND_MEETING),
+                        (Attachment, SearchDocument.KIND_ATTACHMENT)):
+        if isinstance(obj, model):
+            return kind
+    raise TypeError('%r is not searchable.' % obj)
+
+def document_fields(obj):
+    '''The SearchDocument kind and fields for a minutes, meeting or attachment.'''
+    if isinstance(obj, Minutes):
+        meeting = obj.meeting
+        return SearchDocument.KIND_MINUTES, {
+            'group_id': meeting.group_id, 'meeting': meeting, 'public': not obj.draft,
+            'title': u'Minutes of the %s' % meeting, 'body': obj.content or u''}
+    if isinstance(obj, Meeting):
+        return SearchDocument.KIND_MEETING, {
+            'group_id': obj.group_id, 'meeting': obj, 'public': True, 'title': u'%s' % obj,
+            'body': u'\n\n'.join(filter(None, [obj.agenda, obj.business_arising]))}
+    if isinstance(obj, Attachment):
+        minutes = obj.minutes
+        return SearchDocument.KIND_ATTACHMENT, {
+            'group_id': minutes.meeting.group_id, 'meeting_id': minutes.meeting_id, 'public': not minutes.draft,
+            'title': obj.title, 'body': obj.description or u''}
+    raise TypeError('%r is not searchable.' % obj)
+
+def index_object(obj):
+    kind, fields = document_fields(obj)
+    try:
+        document = SearchDocument.objects.get(kind=kind, object_id=obj.pk)
+    except SearchDocument.DoesNotExist:
+        document = SearchDocument(kind=kind, object_id=obj.pk)
+    for name, value in fields.items():
+        setattr(document, name, value)
+    document.save()
+    get_backend().indexed(document)
+    return document
+
+def remove_object(obj):
+    # Index entries are dropped by the SearchDocument post_delete receiver,
+    # which also covers documents removed by cascading deletes.
+    SearchDocument.objects.filter(kind=document_kind(obj), object_id=obj.pk).delete()
+
+def document_removed(sender, instance, **kwargs):
+    get_backend().removed(instance)
+
+def rebuild_index():
+    '''Re-indexes every minutes, meeting and attachment.'''
+    count = 0
+    for model in (Meeting, Minutes, Attachment):
+        for obj in model.objects.all().iterator():
+            kind, fields = document_fields(obj)
+            SearchDocument.objects.filter(kind=kind, object_id=obj.pk).delete()
+            SearchDocument.objects.create(kind=kind, object_id=obj.pk, **fields)
+            count += 1
+    get_backend().rebuild()
+    return count
+
+def search(query, group=None, kinds=None, public_only=True, minutes_groups=None, limit=RESULTS):
+    '''Returns SearchDocuments matching ``query``, best match first.
+
+    When ``minutes_groups`` is given, minutes and attachments are only
+    searched in those groups; meetings and their agendas are searched in all.'''
+    query = (query or u'').strip()
+    if not query:
+        return []
+    queryset = SearchDocument.objects.select_related('meeting__group')
+    if group is not None:
+        queryset = queryset.filter(group=group)
+    if kinds:
+        queryset = queryset.filter(kind__in=kinds)
+    if public_only:
+        queryset = queryset.filter(public=True)
+    if minutes_groups is not None:
+        queryset = queryset.filter(Q(kind=SearchDocument.KIND_MEETING) | Q(group__in=minutes_groups))
+    # Picked for reading, so searches on a replica never pin the primary.
+    return get_backend(queryset.db, create=False).search(queryset, query, limit)
+
+def search_ids(query, kind, public_only=False):
+    '''Object ids of one kind matching ``query``, for admin changelists.'''
+    return [d.object_id for d in search(query, kinds=[kind], public_only=public_only, limit=RESULTS * 20)]
@@ -0,0 +1,150 @@
+'''Signal receivers that keep committees caches and derived tables current.'''
+import sys
+
+from django.db.models.signals import post_save, post_delete, post_syncdb, pre_delete, m2m_changed
+
+# Each of these imports committees.models, which imports this module, so
+# whichever was imported first is only half imported here. Their functions
+# are looked up when called; see _receiver.
+import committees.attendance
+import committees.history
+import committees.search
+from committees.cache import bump_generation, bump_user_version
+from committees.models import MINUTES_HISTORY, Attachment, Group, GroupPhoto, Meeting, Minutes, Office, \
+    OfficeHolding, Person, RosterEntry, SearchDocument, Term
+
+def _receiver(path):
+    '''A receiver calling the function at ``path``, such as
+    ``'search.document_removed'``, in its committees module when sent.'''
+    module, name = path.split('.')
+    def receiver(sender, **kwargs):
+        return getattr(sys.modules['committees.%s' % module], name)(sender, **kwargs)
+    return receiver
+
+for model in (Group, Office, Term, Person, Meeting, Minutes, GroupPhoto):
+    post_save.connect(bump_generation, sender=model, dispatch_uid='committees-generation-save-%s' % model.__name__)
+    post_delete.connect(bump_generation, sender=model, dispatch_uid='committees-generation-delete-%s' % model.__name__)
+
+def rebuild_rosters(groups):
+    for group in groups:
+        RosterEntry.objects.rebuild(group)
+
+def rebuild_exofficio_rosters():
+    rebuild_rosters(Group.objects.filter(ex_officio=True))
+
+def rebuild_office_timelines(term):
+    offices = set([term.office_id, term._original_office_id])
+    offices.discard(None)
+    for office_id in offices:
+        OfficeHolding.objects.rebuild(office_id)
+
+def rebuild_term_rosters(term):
+    group_ids = set([term.group_id, term._original_group_id])
+    group_ids.discard(None)
+    offices = set([term.office_id, term._original_office_id])
+    offices.discard(None)
+    if offices and Office.objects.filter(pk__in=offices, ex_officio=True).exists():
+        rebuild_exofficio_rosters()
+        group_ids = group_ids.difference(Group.objects.filter(ex_officio=True).values_list('pk', flat=True))
+    rebuild_rosters(Group.objects.filter(pk__in=group_ids))
+
+def bump_term_users(term):
+    people = set([term.person_id, term._original_person_id])
+    people.discard(None)
+    if people:
+        for user_id in Person.objects.filter(pk__in=people, user__isnull=False).values_list('user', flat=True):
+            bump_user_version(user_id)
+
+def term_changed(sender, instance, **kwargs):
+    rebuild_office_timelines(instance)
+    rebuild_term_rosters(instance)
+    bump_term_users(instance)
+    committees.attendance.term_changed(sender, instance, **kwargs)
+    instance._original_office_id = instance.office_id
+    instance._original_person_id = instance.person_id
+    instance._original_group_id = instance.group_id
+
+post_save.connect(term_changed, sender=Term, dispatch_uid='committees-term-save')
+post_delete.connect(term_changed, sender=Term, dispatch_uid='committees-term-delete')
+
+def person_user_changed(sender, instance, **kwargs):
+    for user_id in set([instance.user_id, instance._original_user_id]):
+        if user_id:
+            bump_user_version(user_id)
+    instance._original_user_id = instance.user_id
+
+post_save.connect(person_user_changed, sender=Person, dispatch_uid='committees-person-user-save')
+post_delete.connect(person_user_changed, sender=Person, dispatch_uid='committees-person-user-delete')
+
+def office_roster_changed(sender, instance, **kwargs):
+    rebuild_exofficio_rosters()
+
+post_save.connect(office_roster_changed, sender=Office, dispatch_uid='committees-roster-office-save')
+post_delete.connect(office_roster_changed, sender=Office, dispatch_uid='committees-roster-office-delete')
+
+def group_roster_changed(sender, instance, created=False, **kwargs):
+    if created or instance.ex_officio != instance._original_ex_officio:
+        RosterEntry.objects.rebuild(instance)
+        instance._original_ex_officio = instance.ex_officio
+
+post_save.connect(group_roster_changed, sender=Group, dispatch_uid='committees-roster-group-save')
+
+def members_roster_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        # Rosters are rendered in generation-versioned pages and fragments.
+        bump_generation()
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            RosterEntry.objects.rebuild(instance)
+    elif action == 'pre_clear':
+        instance._cleared_group_ids = list(instance.members.values_list('pk', flat=True))
+    elif action == 'post_clear':
+        rebuild_rosters(Group.objects.filter(pk__in=getattr(instance, '_cleared_group_ids', [])))
+    elif action in ('post_add', 'post_remove'):
+        rebuild_rosters(Group.objects.filter(pk__in=pk_set))
+
+m2m_changed.connect(members_roster_changed, sender=Group.members.through, dispatch_uid='committees-roster-members')
+
+def index_searchable(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    committees.search.index_object(instance)
+    if sender is Minutes:
+        # Attachments follow the draft status of their minutes.
+        for attachment in instance.attachments.all():
+            committees.search.index_object(attachment)
+
+def remove_searchable(sender, instance, **kwargs):
+    committees.search.remove_object(instance)
+
+for model in (Meeting, Minutes, Attachment):
+    post_save.connect(index_searchable, sender=model, dispatch_uid='committees-search-save-%s' % model.__name__)
+    post_delete.connect(remove_searchable, sender=model, dispatch_uid='committees-search-delete-%s' % model.__name__)
+post_delete.connect(_receiver('search.document_removed'), sender=SearchDocument, weak=False,
+                    dispatch_uid='committees-search-document-delete')
+
+def create_search_index(sender, db='default', **kwargs):
+    committees.search.get_backend(db).ensure_index()
+
+# Imported from the bottom of committees.models, which is not yet bound on
+# the package, so the sender is looked up in sys.modules.
+post_syncdb.connect(create_search_index, sender=sys.modules['committees.models'],
+                    dispatch_uid='committees-search-syncdb')
+
+if MINUTES_HISTORY == 'delta':
+    post_save.connect(_receiver('history.minutes_saved'), sender=Minutes, weak=False,
+                      dispatch_uid='committees-history-save')
+    post_delete.connect(_receiver('history.minutes_deleted'), sender=Minutes, weak=False,
+                        dispatch_uid='committees-history-delete')
+
+for through in (Minutes.members_present.through, Minutes.members_present_new.through):
+    m2m_changed.connect(_receiver('attendance.attendance_changed'), sender=through, weak=False,
+                        dispatch_uid='committees-attendance-%s' % through.__name__)
+post_save.connect(_receiver('attendance.minutes_saved'), sender=Minutes, weak=False,
+                  dispatch_uid='committees-attendance-minutes-save')
+post_save.connect(_receiver('attendance.meeting_saved'), sender=Meeting, weak=False,
+                  dispatch_uid='committees-attendance-meeting-save')
+pre_delete.connect(_receiver('attendance.minutes_deleting'), sender=Minutes, weak=False,
+                   dispatch_uid='committees-attendance-minutes-predelete')
+post_delete.connect(_receiver('attendance.minutes_deleted'), sender=Minutes, weak=False,
+                    dispatch_uid='committees-attendance-minutes-delete')
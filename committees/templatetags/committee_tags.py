@@ -4,10 +4,22 @@ import logging
 from django import template
 from django.conf import settings
 from django.db import models
-from committees.models import Group, Office
+from committees.cache import cached
+from committees.instrumentation import tracked
+from committees.models import Group, Minutes, Office, partition_terms
+from committees.routers import replica_reads
 
 register = template.Library()
 
+# Whether tag lookups are shared between processes through the cache backend.
+# They are always memoized for the current request and generation.
+SHARED_CACHE = getattr(settings, 'COMMITTEES_SHARED_TAG_CACHE', True)
+
+def _unquote(value):
+    if value and value[0] == value[-1] and value[0] in ('"', "'"):
+        return value[1:-1]
+    return value
+
 @register.tag
 def get_office(parser, token):
     """
@@ -33,42 +45,51 @@ def get_office(parser, token):
     slug = var_name = None
     if argc == 4:
         t, slug, a, var_name = args
-    return GetOfficeNode(slug=slug, var_name=var_name)
+    return GetOfficeNode(slug=_unquote(slug), var_name=var_name)
 
 class GetOfficeNode(template.Node):
     def __init__(self, slug, var_name):
         self.slug = slug
         self.var_name = var_name
 
+    @tracked('tag:get_office')
+    @replica_reads
     def render(self, context):
-        try:
-            self.office = Office.objects.get(slug=self.slug)
-        except:
-            self.office = None
-        context[self.var_name] = self.office
+        context[self.var_name] = cached('tag:office:%s' % self.slug, self.get_office, shared=SHARED_CACHE)
         return ''
 
+    def get_office(self):
+        try:
+            return Office.objects.get(slug=self.slug)
+        except Office.DoesNotExist:
+            return None
+
 class GetGroupsNode(template.Node):
     def __init__(self, status, order, var_name):
         self.var_name = var_name
-        self.status = status
+        self.status = status or 'all'
         self.order = order
 
+    @tracked('tag:get_committee_groups')
+    @replica_reads
     def render(self, context):
-        groups = '' 
+        if self.status not in ('active', 'inactive', 'all'):
+            raise template.TemplateSyntaxError('Invalid get_committee_groups syntax where order = %s, status = %s and var_name = %s' % (self.order, self.status, self.var_name))
+        groups = cached('tag:groups:%s:%s' % (self.status, self.order), self.get_groups, shared=SHARED_CACHE)
+        if len(groups) == 1:
+            context[self.var_name] = groups[0]
+        else:
+            context[self.var_name] = groups
+        return ''
+
+    def get_groups(self):
         if self.order: q = models.Q(order=self.order)
         else: q = models.Q()
 
         if self.status == 'active': groups = Group.active_objects.filter(q)
         elif self.status == 'inactive': groups = Group.objects.filter(q).exclude(active=True)
-        elif self.status == 'all': groups = Group.objects.filter(q)
-        else: raise template.TemplateSyntaxError('Invalid get_committee_groups syntax where order = %s, status = %s and var_name = %s' % (self.order, self.status, self.var_name))
-
-        if groups and len(groups)==1:
-            context[self.var_name] = groups[0]
-        else:
-            context[self.var_name] = groups 
-        return ''
+        else: groups = Group.objects.filter(q)
+        return partition_terms(groups)
 
 
 @register.tag
@@ -107,14 +128,18 @@ class GetGroupNode(template.Node):
         self.slug = slug
         self.var_name = var_name
 
+    @tracked('tag:get_committee_group')
+    @replica_reads
     def render(self, context):
-        try:
-            group = Group.active_objects.get(slug__exact=self.slug)
-            context[self.var_name] = group
-        except:
-            context[self.var_name] = None
+        context[self.var_name] = cached('tag:group:%s' % self.slug, self.get_group, shared=SHARED_CACHE)
         return ''
 
+    def get_group(self):
+        try:
+            return Group.active_objects.get(slug__exact=self.slug)
+        except Group.DoesNotExist:
+            return None
+
 
 @register.tag
 def get_committee_group(parser, token):
@@ -141,24 +166,28 @@ def get_committee_group(parser, token):
     slug = var_name = None
     if argc == 4:
         t, slug, a, var_name = args
-    return GetGroupNode(slug=slug, var_name=var_name)
+    return GetGroupNode(slug=_unquote(slug), var_name=var_name)
 
 class GetMinutesNode(template.Node):
     def __init__(self, meeting, var_name):
         self.meeting=template.Variable(meeting)
         self.var_name = var_name
 
+    @tracked('tag:get_committee_minutes')
+    @replica_reads
     def render(self, context):
         try:
             meeting = self.meeting.resolve(context)
-            try:
-                context[self.var_name] = meeting.minutes_set.all()[0]
-                return ''
-            except:
-                context[self.var_name] = None
-                return ''
         except template.VariableDoesNotExist:
             return ''
+        if hasattr(meeting, '_committee_minutes'):
+            context[self.var_name] = meeting._committee_minutes
+        elif getattr(meeting, 'pk', None) is None:
+            context[self.var_name] = None
+        else:
+            context[self.var_name] = cached('tag:minutes:%s' % meeting.pk,
+                                            lambda: get_minutes([meeting])[meeting.pk], shared=SHARED_CACHE)
+        return ''
 
 
 @register.tag
@@ -183,3 +212,57 @@ def get_committee_minutes(parser, token):
     if argc == 5:
         t, f, meeting, a, var_name = args
     return GetMinutesNode(meeting=meeting, var_name=var_name)
+
+def get_minutes(meetings):
+    """Maps each meeting's pk to its first minutes, or None, in one query.
+
+    Also primes the meetings so ``get_committee_minutes`` reuses the result."""
+    meetings = [m for m in meetings if getattr(m, 'pk', None) is not None]
+    found = {}
+    for minutes in Minutes.objects.filter(meeting__in=[m.pk for m in meetings]).order_by('-pk'):
+        found[minutes.meeting_id] = minutes
+    for m in meetings:
+        m._committee_minutes = found.get(m.pk)
+    return dict((m.pk, m._committee_minutes) for m in meetings)
+
+class GetMinutesListNode(template.Node):
+    def __init__(self, meetings, var_name):
+        self.meetings = template.Variable(meetings)
+        self.var_name = var_name
+
+    @tracked('tag:get_committee_minutes_list')
+    @replica_reads
+    def render(self, context):
+        try:
+            meetings = list(self.meetings.resolve(context))
+        except template.VariableDoesNotExist:
+            return ''
+        minutes = get_minutes(meetings)
+        context[self.var_name] = [(m, minutes.get(m.pk)) for m in meetings]
+        return ''
+
+
+@register.tag
+def get_committee_minutes_list(parser, token):
+    """
+    Gets the minutes of many meetings with one query
+
+    Syntax::
+
+    {% get_committee_minutes_list for [meetings] as [var_name] %}
+
+    Example usage::
+
+    {% get_committee_minutes_list for objects as meetings %}
+    {% for meeting, minutes in meetings %}...{% endfor %}
+
+    """
+    args = token.split_contents()
+    argc = len(args)
+
+    try:
+        assert argc == 5
+    except AssertionError:
+        raise template.TemplateSyntaxError('Invalid get_committee_minutes_list syntax.')
+    t, f, meetings, a, var_name = args
+    return GetMinutesListNode(meetings=meetings, var_name=var_name)
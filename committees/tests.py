@@ -1,23 +1,752 @@
-"""
-This file demonstrates two different styles of tests (one doctest and one
-unittest). These will both pass when you run "manage.py test".
+import shutil
+import tempfile
+import zipfile
+from datetime import date, datetime, timedelta
+from io import BytesIO
 
-Replace these with more appropriate tests for your application.
-"""
+from django.conf import settings
+from django.contrib.admin.sites import AdminSite
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.db import connections, router as db_router
+from django.http import Http404, HttpResponse
+from django.template import Context, Template
+from django.test import TestCase, TransactionTestCase
+from django.test.client import RequestFactory
+from django.utils import unittest
+from eventy.models import Calendar, Event
 
-from django.test import TestCase
+from committees import admin as committees_admin, attendance, benchmark, history, importer, routers, search, validation, views
+from committees.cache import GENERATION_KEY, cache_version, cached, get_generation, get_user_version, request_finished_handler, \
+    request_started_handler
+from committees.downloads import parse_range
+from committees.feeds import feed_meetings, ics_line, serve_feed
+from committees.instrumentation import QueryBudgetMixin, profile
+from committees.managers import annotate_neighbors
+from committees.markup import render_markup
+from committees.models import Attachment, AttendanceRollup, Group, GroupType, Meeting, Minutes, MinutesRevision, Office, OfficeHolding, Person, RosterEntry, SearchDocument, Term, \
+    is_board_member, office_holders, partition_terms, resolve_attendance
+from committees.packets import meeting_files, stream_zip
+from committees.pagination import keyset_page
 
-class SimpleTest(TestCase):
-    def test_basic_addition(self):
-        """
-        Tests that 1 + 1 always equals 2.
-        """
-        self.failUnlessEqual(1 + 1, 2)
 
-__test__ = {"doctest": """
-Another way to test that 1 + 1 is equal to 2.
+class CommitteesTestCase(TestCase):
+    '''Builds a small board with a president, a member and some history.'''
 
->>> 1 + 1 == 2
-True
-"""}
+    def setUp(self):
+        self.today = date.today()
+        self.year = timedelta(days=365)
+        self.board_type = GroupType.objects.create(title='Board', slug='board', order=10)
+        self.board = Group.objects.create(title='Governing Board', slug='governing-board',
+                                          type=self.board_type, order=10)
+        self.president = Office.objects.create(title='President', slug='president',
+                                               group=self.board, order=1)
+        self.alice = Person.objects.create(first_name='Alice', last_name='Adams', slug='alice')
+        self.bob = Person.objects.create(first_name='Bob', last_name='Brown', slug='bob')
 
+    def meeting(self, start, group=None, **kwargs):
+        if not hasattr(self, 'event'):
+            calendar = Calendar.objects.create(title='Governance', slug='governance')
+            self.event = Event.objects.create(title='Meeting', slug='meeting', calendar=calendar)
+        return Meeting.objects.create(event=self.event, start=start, group=group or self.board, **kwargs)
+
+    def term(self, person, start, end=None, office=None, group=None, **kwargs):
+        return Term.objects.create(person=person, start=start, end=end, office=office,
+                                   group=group or self.board, **kwargs)
+
+
+class TermPartitionTest(CommitteesTestCase):
+    def setUp(self):
+        super(TermPartitionTest, self).setUp()
+        self.current = self.term(self.alice, self.today - self.year, office=self.president)
+        self.past = self.term(self.bob, self.today - 3 * self.year, self.today - 2 * self.year,
+                              office=self.president)
+        self.future = self.term(self.bob, self.today + self.year)
+
+    def test_past_terms(self):
+        self.assertEqual(set(self.board.past_terms), set([self.past, self.future]))
+
+    def test_partition_terms(self):
+        committee = Group.objects.create(title='Music', slug='music', type=self.board_type, order=20)
+        with self.assertNumQueries(1):
+            board, committee = partition_terms([self.board, committee])
+            self.assertEqual(board.current_terms, [self.current])
+            self.assertEqual(committee.current_terms, [])
+        self.assertEqual(set(board.past_terms), set([self.past, self.future]))
+
+
+class ExOfficioTest(CommitteesTestCase):
+    def setUp(self):
+        super(ExOfficioTest, self).setUp()
+        self.president.ex_officio = True
+        self.president.save()
+        self.term(self.alice, self.today - self.year, office=self.president)
+
+    def test_exofficio_members(self):
+        committees = [Group.objects.create(title='Committee %s' % i, slug='committee-%s' % i,
+                                           type=self.board_type, order=20, ex_officio=True)
+                      for i in range(3)]
+        committees = list(Group.objects.filter(pk__in=[c.pk for c in committees]))
+        committees[0].exofficio_members
+        with self.assertNumQueries(0):
+            for c in committees:
+                self.assertEqual([t.person for t in c.exofficio_members], [self.alice])
+        self.assertEqual(self.board.exofficio_members, [])
+
+
+class OfficeTimelineTest(CommitteesTestCase):
+    def setUp(self):
+        super(OfficeTimelineTest, self).setUp()
+        self.old = self.term(self.bob, self.today - 4 * self.year, self.today - 2 * self.year - timedelta(days=1),
+                             office=self.president)
+        self.older = self.term(self.alice, self.today - 6 * self.year, self.today - 4 * self.year,
+                               office=self.president)
+        self.first = self.term(self.alice, self.today - 2 * self.year, self.today - self.year - timedelta(days=1),
+                               office=self.president)
+        self.second = self.term(self.alice, self.today - self.year, office=self.president)
+
+    def test_current_and_previous(self):
+        self.assertEqual(self.president.current, self.second)
+        self.assertEqual(self.president.previous, self.old)
+        self.assertEqual(self.president.display_title, 'President')
+
+    def test_co_holders(self):
+        co = self.term(self.bob, self.today - self.year, office=self.president)
+        office = Office.objects.get(pk=self.president.pk)
+        self.assertEqual(set(office.current), set([self.second, co]))
+        self.assertEqual(office.display_title, 'Co-President')
+
+    def test_office_holders(self):
+        with self.assertNumQueries(1):
+            resolved = office_holders([self.president])
+        self.assertEqual(resolved[self.president.pk]['current'], [self.second])
+        self.assertEqual(resolved[self.president.pk]['previous'], self.old)
+
+    def test_rebuild_bumps_generation(self):
+        version = cache_version()
+        OfficeHolding.objects.rebuild(self.president.pk)
+        self.assertNotEqual(cache_version(), version)
+
+
+class TenureTest(CommitteesTestCase):
+    def setUp(self):
+        super(TenureTest, self).setUp()
+        self.term(self.alice, date(2001, 1, 1), date(2003, 12, 31))
+        self.term(self.alice, date(2004, 1, 1), date(2005, 12, 31))
+        self.open = self.term(self.alice, date(self.today.year - 1, 1, 1))
+
+    def test_tenure(self):
+        self.assertEqual(self.open.tenure, 2 + 1 + 1)
+        self.assertEqual(self.alice.tenure, 4)
+
+    def test_with_tenure(self):
+        with self.assertNumQueries(1):
+            terms = list(Term.objects.with_tenure().filter(person=self.alice))
+            self.assertEqual([t.tenure for t in terms], [4, 4, 4])
+        with self.assertNumQueries(1):
+            people = dict((p.slug, p.tenure) for p in Person.objects.with_tenure())
+        self.assertEqual(people, {'alice': 4, 'bob': 0})
+
+
+class TermIntervalTest(CommitteesTestCase):
+    def setUp(self):
+        super(TermIntervalTest, self).setUp()
+        self.early = self.term(self.alice, date(2000, 1, 1), date(2001, 12, 31))
+        self.late = self.term(self.bob, date(2002, 1, 1))
+
+    def test_active_on(self):
+        self.assertEqual(list(Term.objects.active_on(date(2001, 6, 1))), [self.early])
+        self.assertEqual(list(Term.objects.active_on(date(2010, 6, 1))), [self.late])
+        self.assertEqual(list(Term.active_objects.all()), [self.late])
+
+    def test_overlapping(self):
+        self.assertEqual(set(Term.objects.overlapping(date(2001, 6, 1), date(2002, 6, 1))),
+                         set([self.early, self.late]))
+        self.assertEqual(list(Term.objects.overlapping(date(1990, 1, 1), date(1999, 12, 31))), [])
+        self.assertEqual(list(Term.objects.overlapping(date(2003, 1, 1))), [self.late])
+
+    def test_started_in(self):
+        self.assertEqual(list(Term.objects.started_in(2002)), [self.late])
+
+
+class RosterTest(CommitteesTestCase):
+    def test_roster_follows_terms_and_members(self):
+        term = self.term(self.alice, self.today - self.year, office=self.president)
+        self.board.members.add(self.bob)
+        with self.assertNumQueries(1):
+            roster = [(e.person, e.office, e.source) for e in self.board.roster]
+        self.assertEqual(roster, [(self.alice, self.president, RosterEntry.SOURCE_TERM),
+                                  (self.bob, None, RosterEntry.SOURCE_MEMBER)])
+        term.end = self.today - timedelta(days=1)
+        term.save()
+        version = cache_version()
+        self.board.members.remove(self.bob)
+        self.assertNotEqual(cache_version(), version)
+        self.assertEqual(list(self.board.roster), [])
+
+    def test_exofficio_entries(self):
+        committee = Group.objects.create(title='Music', slug='music', type=self.board_type, order=20,
+                                         ex_officio=True)
+        self.president.ex_officio = True
+        self.president.save()
+        self.term(self.alice, self.today - self.year, office=self.president)
+        self.assertEqual([(e.person, e.source) for e in committee.roster],
+                         [(self.alice, RosterEntry.SOURCE_EX_OFFICIO)])
+
+    def test_rebuild_bumps_generation(self):
+        version = cache_version()
+        RosterEntry.objects.rebuild(self.board)
+        self.assertNotEqual(cache_version(), version)
+
+
+class MeetingNeighborTest(CommitteesTestCase):
+    def setUp(self):
+        super(MeetingNeighborTest, self).setUp()
+        self.meetings = [self.meeting(datetime(2010, month, 1, 19)) for month in (1, 2, 3)]
+
+    def test_with_neighbors(self):
+        with self.assertNumQueries(2):
+            meetings = list(Meeting.objects.with_neighbors().filter(start__gte=datetime(2010, 2, 1)))
+            first, second = meetings
+            self.assertEqual(first.get_previous_meeting().pk, self.meetings[0].pk)
+            self.assertEqual(first.get_next_meeting().pk, self.meetings[2].pk)
+            self.assertEqual(first.get_next_meeting().start, self.meetings[2].start)
+            self.assertEqual(second.get_next_meeting(), None)
+
+    def test_python_fallback(self):
+        from committees import managers
+        supports = managers.supports_window_functions
+        managers.supports_window_functions = lambda using: False
+        try:
+            first = annotate_neighbors([Meeting.objects.get(pk=self.meetings[0].pk)])[0]
+        finally:
+            managers.supports_window_functions = supports
+        self.assertEqual(first.get_previous_meeting(), None)
+        self.assertEqual(first.get_next_meeting().pk, self.meetings[1].pk)
+
+
+class AttendanceTest(CommitteesTestCase):
+    def test_resolve_attendance(self):
+        carol = Person.objects.create(first_name='Carol', last_name='Clark', slug='carol')
+        term = self.term(self.alice, date(2009, 1, 1), date(2011, 12, 31), office=self.president)
+        self.term(self.bob, date(2012, 1, 1))
+        minutes = []
+        for year in (2010, 2013):
+            m = Minutes.objects.create(meeting=self.meeting(datetime(year, 1, 1, 19)), content='Met.',
+                                       signed=self.alice)
+            m.members_present_new.add(self.alice, self.bob, carol)
+            minutes.append(m)
+        minutes = list(Minutes.objects.filter(pk__in=[m.pk for m in minutes]).order_by('pk'))
+        with self.assertNumQueries(3):
+            resolve_attendance(minutes)
+            first, second = minutes
+            self.assertEqual(first.board_members, [term])
+            self.assertEqual(first.non_board_members, [self.bob, carol])
+            self.assertEqual([t.person for t in second.board_members], [self.bob])
+            self.assertEqual(second.non_board_members, [self.alice, carol])
+
+
+class GenerationCacheTest(CommitteesTestCase):
+    def test_saves_bump_generation(self):
+        version = cache_version()
+        self.assertEqual(cached('answer', lambda: 42), 42)
+        self.assertEqual(cached('answer', lambda: 0), 42)
+        self.term(self.alice, self.today)
+        self.assertNotEqual(cache_version(), version)
+        self.assertEqual(cached('answer', lambda: 0), 0)
+
+    def test_generation_read_once_per_request(self):
+        # Sending request_finished itself would close the test connection.
+        request_started_handler()
+        try:
+            generation = get_generation()
+            cache.set(GENERATION_KEY, generation + 100)
+            self.assertEqual(get_generation(), generation)
+        finally:
+            request_finished_handler()
+        self.assertEqual(get_generation(), generation + 100)
+
+
+class MeetingArchiveTest(CommitteesTestCase):
+    def setUp(self):
+        super(MeetingArchiveTest, self).setUp()
+        self.meetings = [self.meeting(datetime(year, month, 1, 19)) for year in (2010, 2011) for month in (1, 2, 3)]
+
+    def test_keyset_page(self):
+        qs = Meeting.objects.filter(group=self.board)
+        first = keyset_page(qs, per_page=4)
+        self.assertEqual([m.pk for m in first], [m.pk for m in reversed(self.meetings[2:])])
+        self.assertTrue(first.has_next)
+        second = keyset_page(qs, after=first.next_token, per_page=4)
+        self.assertEqual([m.pk for m in second], [m.pk for m in reversed(self.meetings[:2])])
+        self.assertFalse(second.has_next)
+        back = keyset_page(qs, before=second.previous_token, per_page=4)
+        self.assertEqual([m.pk for m in back], [m.pk for m in first])
+
+    def test_archive_counts(self):
+        self.meeting(datetime(2011, 3, 15, 19))
+        with self.assertNumQueries(1):
+            counts = [(a['year'], a['month'], a['count']) for a in Meeting.objects.archive_counts()]
+        self.assertEqual(counts, [(2011, 3, 2), (2011, 2, 1), (2011, 1, 1),
+                                  (2010, 3, 1), (2010, 2, 1), (2010, 1, 1)])
+
+
+class TemplateTagTest(CommitteesTestCase):
+    def render(self, source, **context):
+        return Template('{% load committee_tags %}' + source).render(Context(context))
+
+    def test_lookups_are_memoized(self):
+        source = "{% get_office 'president' as p %}{{p.title}} {% get_committee_groups active order 10 as b %}{{b.slug}}"
+        self.assertEqual(self.render(source), 'President governing-board')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.render(source), 'President governing-board')
+
+    def test_minutes_list(self):
+        meetings = [self.meeting(datetime(2010, month, 1, 19)) for month in (1, 2)]
+        minutes = Minutes.objects.create(meeting=meetings[0], content='Met.', signed=self.alice)
+        source = ('{% get_committee_minutes_list for meetings as pairs %}'
+                  '{% for m, minutes in pairs %}{% get_committee_minutes for m as found %}{{found.pk}},{% endfor %}')
+        with self.assertNumQueries(1):
+            self.assertEqual(self.render(source, meetings=meetings), '%s,,' % minutes.pk)
+
+
+class RenderedMarkupTest(CommitteesTestCase):
+    def test_rendered_on_save_only_when_changed(self):
+        self.board.description = 'The *governing* board.'
+        self.board.save()
+        self.assertTrue('<em>governing</em>' in self.board.rendered_description)
+        self.assertEqual(self.board.render_markup(), [])
+        self.board.description = 'Changed.'
+        self.assertEqual(self.board.render_markup(), ['rendered_description', 'description_hash'])
+
+    def test_unrendered_rows_and_unknown_markup(self):
+        Group.objects.filter(pk=self.board.pk).update(description='The *governing* board.', rendered_description='')
+        self.assertTrue('<em>governing</em>' in Group.objects.get(pk=self.board.pk).rendered_description)
+        self.assertFalse('<script>' in render_markup('<script>alert(1)</script>', 'x'))
+        self.assertTrue('<b>bold</b>' in render_markup('<b>bold</b>', 'h'))
+
+
+class SearchTest(CommitteesTestCase):
+    def test_search_minutes_and_agendas(self):
+        meeting = self.meeting(datetime(2010, 1, 1, 19), agenda='Discuss the roof repairs.')
+        minutes = Minutes.objects.create(meeting=meeting, content='The board approved the budget.',
+                                         signed=self.alice, draft=False)
+        self.assertEqual([(d.kind, d.object_id) for d in search.search('budget')],
+                         [(SearchDocument.KIND_MINUTES, minutes.pk)])
+        self.assertEqual([d.kind for d in search.search('roof')], [SearchDocument.KIND_MEETING])
+        self.assertEqual(search.search('budget', minutes_groups=[]), [])
+        self.assertEqual(len(search.search('budget', minutes_groups=[self.board.pk])), 1)
+        self.assertEqual(len(search.search('roof', minutes_groups=[])), 1)
+        minutes.draft = True
+        minutes.save()
+        self.assertEqual(search.search('budget'), [])
+        self.assertEqual(len(search.search('budget', public_only=False)), 1)
+        minutes.delete()
+        self.assertEqual(search.search('budget', public_only=False), [])
+
+
+class DownloadTest(TestCase):
+    def test_parse_range(self):
+        self.assertEqual(parse_range('bytes=0-99', 1000), (0, 99))
+        self.assertEqual(parse_range('bytes=900-', 1000), (900, 999))
+        self.assertEqual(parse_range('bytes=-100', 1000), (900, 999))
+        self.assertEqual(parse_range('bytes=500-5000', 1000), (500, 999))
+        self.assertEqual(parse_range('bytes=0-1,5-9', 1000), None)
+        self.assertEqual(parse_range('bytes=1000-', 1000), False)
+
+
+class AttachmentDownloadTest(CommitteesTestCase):
+    def setUp(self):
+        super(AttachmentDownloadTest, self).setUp()
+        self.field = Attachment._meta.get_field('attachment')
+        self.storage, self.field.storage = self.field.storage, FileSystemStorage(location=tempfile.mkdtemp())
+        minutes = Minutes.objects.create(meeting=self.meeting(datetime(2010, 1, 1, 19)), content='Met.',
+                                         signed=self.alice, draft=False)
+        self.attachment = Attachment(minutes=minutes, title='Budget')
+        self.attachment.attachment.save('budget.txt', ContentFile(b'0123456789'), save=False)
+        self.attachment.save()
+        self.user = User.objects.create(username='alice')
+        self.alice.user = self.user
+        self.alice.save()
+
+    def tearDown(self):
+        shutil.rmtree(self.field.storage.location)
+        self.field.storage = self.storage
+        super(AttachmentDownloadTest, self).tearDown()
+
+    def get(self, user, **headers):
+        request = RequestFactory().get('/', **headers)
+        request.user = user
+        return views.attachment_download(request, self.attachment.pk)
+
+    def test_board_members_only(self):
+        self.assertRaises(Http404, self.get, AnonymousUser())
+        self.assertRaises(Http404, self.get, self.user)
+        self.term(self.alice, date(2009, 1, 1))
+        response = self.get(self.user)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'0123456789')
+
+    def test_conditional_and_range(self):
+        self.term(self.alice, date(2009, 1, 1))
+        etag = self.get(self.user)['ETag']
+        self.assertEqual(self.get(self.user, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        response = self.get(self.user, HTTP_RANGE='bytes=2-4')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 2-4/10')
+        self.assertEqual(b''.join(response.streaming_content), b'234')
+
+
+class PacketTest(CommitteesTestCase):
+    def test_meeting_packet(self):
+        meeting = self.meeting(datetime(2010, 1, 1, 19), agenda='Roof repairs.')
+        Minutes.objects.create(meeting=meeting, content='Approved the budget.', signed=self.alice, draft=False)
+        Minutes.objects.create(meeting=meeting, content='Draft notes.', signed=self.alice)
+        archive = zipfile.ZipFile(BytesIO(b''.join(stream_zip(meeting_files(meeting)))))
+        self.assertEqual(archive.testzip(), None)
+        self.assertEqual(archive.namelist(), ['governing-board-2010-01-01/agenda.html',
+                                              'governing-board-2010-01-01/minutes.html'])
+        # Typogrify, when installed, joins the last two words with &nbsp;.
+        self.assertTrue(b'Approved the' in archive.read('governing-board-2010-01-01/minutes.html'))
+        self.assertEqual(len(list(meeting_files(meeting, include_drafts=True))), 3)
+
+    def test_packet_access(self):
+        self.meeting(datetime(2010, 1, 1, 19), agenda='Roof repairs.')
+        request = RequestFactory().get('/')
+        request.user = AnonymousUser()
+        self.assertRaises(Http404, views.meeting_packet, request, 'governing-board', '2010', '1')
+        self.assertRaises(Http404, views.group_year_packet, request, 'governing-board', '2010')
+        request.user = User.objects.create(username='alice')
+        self.alice.user = request.user
+        self.alice.save()
+        self.term(self.alice, date(2009, 1, 1))
+        self.assertEqual(views.meeting_packet(request, 'governing-board', '2010', '1')['Content-Type'], 'application/zip')
+
+
+class MinutesHistoryTest(CommitteesTestCase):
+    def test_rebuild_revisions(self):
+        interval, history.SNAPSHOT_INTERVAL = history.SNAPSHOT_INTERVAL, 3
+        try:
+            minutes = Minutes.objects.create(meeting=self.meeting(datetime(2010, 1, 1, 19)), signed=self.alice,
+                                             content='Call to order.\nBudget.\n')
+            history.record(minutes, MinutesRevision.TYPE_CREATED)
+            contents = [minutes.content]
+            for i in range(5):
+                minutes.content = minutes.content.replace('Budget.', 'Budget %s.' % i) + 'Item %s.\n' % i
+                minutes.save()
+                history.record(minutes)
+                contents.append(minutes.content)
+            self.assertEqual(history.record(minutes), None)
+        finally:
+            history.SNAPSHOT_INTERVAL = interval
+        revisions = MinutesRevision.objects.filter(minutes_id=minutes.pk)
+        self.assertEqual([r.snapshot for r in revisions], [True, False, False, True, False, False])
+        for revision, content in enumerate(contents):
+            self.assertEqual(history.rebuild_instance(minutes.pk, revision + 1).content, content)
+        self.assertEqual(revisions[4].instance.signed_id, self.alice.pk)
+
+
+class ImportTest(CommitteesTestCase):
+    def test_import_people_and_terms(self):
+        result = importer.import_rows('people', enumerate([
+            {'slug': 'alice', 'first_name': 'Alicia', 'last_name': 'Adams'},
+            {'slug': 'carol', 'first_name': 'Carol', 'member': 'no'},
+            {'first_name': 'Nobody'},
+        ], 2))
+        self.assertEqual((result.created, result.updated), (1, 1))
+        self.assertEqual(result.errors, [(4, '"slug" is required.')])
+        self.assertEqual(Person.objects.get(slug='alice').first_name, 'Alicia')
+        self.assertFalse(Person.objects.get(slug='carol').member)
+
+        rows = [
+            {'group': 'governing-board', 'office': 'president', 'person': 'carol', 'start': '2010-01-01'},
+            {'group': 'governing-board', 'person': 'bob', 'start': '2011-01-01', 'end': '2011-12-31'},
+            {'group': 'governing-board', 'person': 'dave', 'start': '2011-01-01'},
+            {'group': 'governing-board', 'person': 'bob', 'start': 'next year'},
+        ]
+        result = importer.import_rows('terms', enumerate(rows, 2), batch_size=2)
+        self.assertEqual((result.created, result.updated), (2, 0))
+        self.assertEqual([line for line, message in result.errors], [4, 5])
+        self.assertEqual([e.person.slug for e in self.board.roster], ['carol'])
+        self.assertEqual(self.president.current.person.slug, 'carol')
+        result = importer.import_rows('terms', enumerate(rows[:1], 2))
+        self.assertEqual((result.created, result.updated), (0, 1))
+
+    def test_import_rebuilds_attendance(self):
+        user = User.objects.create(username='alice')
+        self.alice.user = user
+        self.alice.save()
+        version = get_user_version(user.pk)
+        self.meeting(datetime(2010, 3, 1, 19))
+        importer.import_rows('terms', enumerate([
+            {'group': 'governing-board', 'person': 'alice', 'start': '2010-01-01', 'end': '2010-12-31'},
+            {'group': 'governing-board', 'person': 'bob', 'start': '2010-01-01', 'end': '2010-12-31'},
+        ], 2))
+        self.assertNotEqual(get_user_version(user.pk), version)
+        importer.import_rows('minutes', enumerate([
+            {'group': 'governing-board', 'meeting': '2010-03-01 19:00', 'signed': 'alice',
+             'content': 'Met.', 'members_present': 'alice'},
+        ], 2))
+        self.assertEqual(sorted((r.person.slug, r.attended, r.meetings) for r in AttendanceRollup.objects.all()),
+                         [('alice', 1, 1), ('bob', 0, 1)])
+
+
+class FeedTest(CommitteesTestCase):
+    urls = 'committees.urls'
+
+    def test_ics_feed_and_conditional_get(self):
+        self.meeting(datetime.now() + timedelta(days=7), agenda='Budget; roof, windows.')
+        factory = RequestFactory()
+        response = serve_feed(factory.get('/meetings.ics'), feed_meetings('governing-board'), 'ics', u'Board')
+        body = b''.join(response.streaming_content)
+        self.assertTrue(b'BEGIN:VEVENT' in body)
+        self.assertTrue(br'DESCRIPTION:Budget\; roof\, windows.' in body)
+        with self.assertNumQueries(1):
+            response = serve_feed(factory.get('/meetings.ics', HTTP_IF_NONE_MATCH=response['ETag']),
+                                  feed_meetings('governing-board'), 'ics', u'Board')
+        self.assertEqual(response.status_code, 304)
+
+    def test_ics_line_folding(self):
+        folded = ics_line(u'DESCRIPTION:' + u'\xe9' * 60)
+        self.assertTrue(all(len(line) <= 75 for line in folded.rstrip().split(b'\r\n ')))
+        self.assertEqual(folded.replace(b'\r\n ', b'').decode('utf-8'), u'DESCRIPTION:' + u'\xe9' * 60 + u'\r\n')
+
+
+class BenchmarkTest(TestCase):
+    def test_generate(self):
+        board = benchmark.generate(groups=3, people=30, terms=60, meetings=30)
+        self.assertEqual(board.slug, 'governing-board')
+        self.assertEqual(Office.objects.values('slug').distinct().count(), Office.objects.count())
+        self.assertEqual(Term.objects.count(), 60)
+        self.assertEqual(Meeting.objects.count(), 30)
+        self.assertEqual(Minutes.objects.count(), 30)
+        self.assertEqual(len(board.roster), RosterEntry.objects.filter(group=board).count())
+        self.assertTrue(RosterEntry.objects.filter(group=board).exists())
+
+    def test_compare(self):
+        baseline = {'index': {'queries': 4, 'warm_queries': 0, 'time': 0.1, 'warm_time': 0.01}}
+        results = {'index': {'queries': 5, 'warm_queries': 0, 'time': 0.12, 'warm_time': 0.05}}
+        self.assertEqual(benchmark.compare(results, baseline),
+                         ['index: 5 queries, baseline 4', 'index: warm time 0.0500s, baseline 0.0100s'])
+
+
+class InstrumentationTest(QueryBudgetMixin, CommitteesTestCase):
+    def test_profile_records_hotspots(self):
+        self.term(self.alice, self.today, office=self.president)
+        with profile('terms') as p:
+            list(self.board.current_terms)
+            list(self.board.current_terms)
+        self.assertEqual(len(p.queries), 2)
+        self.assertEqual(p.duplicates, 1)
+        self.assertEqual(p.hotspots['Group.current_terms'][0], 2)
+        self.assertEqual(p.headers()['X-Committees-Queries'], '2')
+        self.assertFalse(getattr(Template.render, 'committees_instrumented', False))
+
+    def test_query_budget(self):
+        self.assertQueryBudget('roster', lambda: list(self.board.roster), budget=1)
+        self.assertRaises(AssertionError, self.assertQueryBudget, 'tenure',
+                          lambda: [self.alice.tenure, self.alice.tenure], budget=1)
+
+
+class BoardMemberTest(CommitteesTestCase):
+    def test_cached_until_terms_change(self):
+        user = User.objects.create(username='alice')
+        self.alice.user = user
+        self.alice.save()
+        self.assertFalse(is_board_member(AnonymousUser(), self.board))
+        with self.assertNumQueries(1):
+            self.assertFalse(is_board_member(user, self.board))
+        with self.assertNumQueries(0):
+            self.assertFalse(is_board_member(user, self.board))
+        term = self.term(self.alice, self.today - self.year)
+        self.assertTrue(is_board_member(user, self.board))
+        term.end = self.today - timedelta(days=1)
+        term.save()
+        self.assertFalse(is_board_member(user, self.board))
+
+
+class AttendanceRollupTest(CommitteesTestCase):
+    def rollups(self):
+        return sorted((r.person.slug, r.year, r.attended, r.meetings) for r in AttendanceRollup.objects.all())
+
+    def test_incremental_and_rebuilt(self):
+        carol = Person.objects.create(first_name='Carol', last_name='Clark', slug='carol')
+        alice_term = self.term(self.alice, date(2010, 1, 1), date(2011, 12, 31))
+        self.term(carol, date(2010, 1, 1), date(2010, 12, 31))
+        minutes = [Minutes.objects.create(meeting=self.meeting(datetime(year, month, 1, 19)), content='Met.',
+                                          signed=self.alice) for year, month in ((2010, 1), (2010, 2), (2011, 1))]
+        for m in minutes:
+            m.members_present_new.add(self.alice)
+        # Recorded through both relations, still counted once.
+        minutes[0].members_present.add(alice_term)
+        self.bob.meeting_members.add(minutes[1])
+        expected = [('alice', 2010, 2, 2), ('alice', 2011, 1, 1), ('bob', 2010, 1, 2), ('carol', 2010, 0, 2)]
+        self.assertEqual(self.rollups(), expected)
+        AttendanceRollup.objects.all().delete()
+        attendance.rebuild()
+        self.assertEqual(self.rollups(), expected)
+
+        self.assertEqual(AttendanceRollup.objects.streaks(100)[(self.alice.pk, self.board.pk)], (2, 2))
+        self.assertEqual(sorted(r.person_id for r in AttendanceRollup.objects.filter(year=2010).below(75)),
+                         sorted([self.bob.pk, carol.pk]))
+        self.assertEqual(AttendanceRollup.objects.filter(year=2010, person=self.bob).with_rate()[0].rate, 50)
+
+    def test_moved_meeting(self):
+        self.term(self.alice, date(2010, 1, 1))
+        minutes = Minutes.objects.create(meeting=self.meeting(datetime(2010, 1, 1, 19)), content='Met.',
+                                         signed=self.alice)
+        minutes.members_present_new.add(self.alice)
+        meeting = minutes.meeting
+        meeting.start = datetime(2011, 1, 1, 19)
+        meeting.save()
+        self.assertEqual(self.rollups(), [('alice', 2011, 1, 1)])
+
+
+class TermValidationTest(CommitteesTestCase):
+    def test_audit(self):
+        first = self.term(self.alice, date(2004, 1, 1), date(2005, 12, 31), office=self.president)
+        second = self.term(self.alice, date(2006, 1, 1), date(2007, 12, 31), office=self.president)
+        third = self.term(self.alice, date(2008, 1, 1), date(2009, 12, 31))
+        shared = self.term(self.bob, date(2007, 1, 1), date(2007, 12, 31), office=self.president)
+        violations = dict((v.kind, v) for v in validation.audit())
+        self.assertEqual(sorted(violations), ['office-overlap', 'term-limit'])
+        self.assertEqual(violations['term-limit'].terms, [first.pk, second.pk, third.pk])
+        self.assertEqual(violations['office-overlap'].terms, [second.pk, shared.pk])
+        self.assertEqual(violations['office-overlap'].severity, validation.WARNING)
+        self.assertEqual(validation.report(violations.values())['errors'], 1)
+
+    def test_clean(self):
+        self.term(self.alice, date(2004, 1, 1), date(2005, 12, 31))
+        overlapping = Term(person=self.alice, group=self.board, start=date(2005, 6, 1))
+        self.assertRaises(ValidationError, overlapping.clean)
+        Term(person=self.alice, group=self.board, start=date(2006, 1, 1)).clean()
+
+
+class TermAdminTest(CommitteesTestCase):
+    def setUp(self):
+        super(TermAdminTest, self).setUp()
+        self.current = self.term(self.alice, date(2008, 1, 1), office=self.president)
+        self.past = self.term(self.bob, date(2004, 1, 1), date(2005, 12, 31))
+        self.admin = committees_admin.TermAdmin(Term, AdminSite())
+        self.request = RequestFactory().get('/')
+
+    def test_queryset(self):
+        with self.assertNumQueries(1):
+            terms = dict((t.pk, t) for t in self.admin.queryset(self.request))
+            self.assertEqual(self.admin.is_active(terms[self.current.pk]), True)
+            self.assertEqual(self.admin.is_active(terms[self.past.pk]), False)
+            self.assertEqual(terms[self.current.pk].person.first_name, 'Alice')
+
+    def test_filters(self):
+        running = committees_admin.TermRunningFilter(self.request, {'running': '2005'}, Term, self.admin)
+        years = [y for y, label in running.lookup_choices]
+        self.assertEqual((years[0], years[-1]), (str(self.today.year), '2004'))
+        self.assertEqual(list(running.queryset(self.request, Term.objects.all())), [self.past])
+        status = committees_admin.TermStatusFilter(self.request, {'status': 'active'}, Term, self.admin)
+        self.assertEqual(list(status.queryset(self.request, Term.objects.all())), [self.current])
+
+
+class ReplicaRouterTest(CommitteesTestCase):
+    def setUp(self):
+        super(ReplicaRouterTest, self).setUp()
+        self.replica_db, routers.REPLICA_DB = routers.REPLICA_DB, 'replica'
+        self.router = routers.ReplicaRouter()
+        self.middleware = routers.ReplicaMiddleware()
+        self.factory = RequestFactory()
+        self.reset()
+
+    def tearDown(self):
+        routers.REPLICA_DB = self.replica_db
+        self.reset()
+        super(ReplicaRouterTest, self).tearDown()
+
+    def reset(self):
+        # Setting up the fixtures wrote through the router.
+        cache.delete(routers.WRITE_KEY)
+        routers._local.__dict__.clear()
+
+    def test_reads_in_replica_block(self):
+        self.assertEqual(self.router.db_for_read(Meeting), routers.PRIMARY_DB)
+        with routers.use_replica():
+            self.assertEqual(self.router.db_for_read(Meeting), 'replica')
+            self.assertEqual(self.router.db_for_read(User), None)
+            self.assertEqual(self.router.db_for_write(Meeting), routers.PRIMARY_DB)
+            self.assertEqual(self.router.db_for_read(Meeting), routers.PRIMARY_DB)
+
+    def test_search_does_not_pin(self):
+        # The primary stands in for the replica, so the search can run.
+        routers.REPLICA_DB = routers.PRIMARY_DB
+        db_router.routers.insert(0, self.router)
+        try:
+            with routers.use_replica():
+                search.search('budget')
+        finally:
+            db_router.routers.remove(self.router)
+        self.assertEqual(cache.get(routers.WRITE_KEY), None)
+        self.assertEqual(routers.pinned_until(), 0)
+
+    def test_pinned_after_write(self):
+        self.middleware.process_request(self.factory.post('/'))
+        self.router.db_for_write(Term)
+        response = self.middleware.process_response(None, HttpResponse())
+        self.assertTrue(response.cookies[routers.PIN_COOKIE].value)
+
+        # Another process sees the write through the cache.
+        routers._local.__dict__.clear()
+        with routers.use_replica():
+            self.assertEqual(self.router.db_for_read(Term), routers.PRIMARY_DB)
+
+        # The writer's cookie pins it after the cache entry is gone.
+        cache.delete(routers.WRITE_KEY)
+        request = self.factory.get('/')
+        request.COOKIES[routers.PIN_COOKIE] = response.cookies[routers.PIN_COOKIE].value
+        self.middleware.process_request(request)
+        with routers.use_replica():
+            self.assertEqual(self.router.db_for_read(Term), routers.PRIMARY_DB)
+        self.middleware.process_response(request, HttpResponse())
+
+        self.middleware.process_request(self.factory.get('/'))
+        with routers.use_replica():
+            self.assertEqual(self.router.db_for_read(Term), 'replica')
+
+
+@unittest.skipUnless('replica' in settings.DATABASES, 'Needs a replica database alias, see committees.routers.')
+class ReplicaDatabaseTest(TransactionTestCase):
+    multi_db = True
+
+    def setUp(self):
+        self.replica_db, routers.REPLICA_DB = routers.REPLICA_DB, 'replica'
+        self.router = routers.ReplicaRouter()
+        db_router.routers.insert(0, self.router)
+        board_type = GroupType.objects.create(title='Board', slug='board', order=10)
+        self.board = Group.objects.create(title='Governing Board', slug='governing-board', type=board_type, order=10)
+        calendar = Calendar.objects.create(title='Governance', slug='governance')
+        event = Event.objects.create(title='Meeting', slug='meeting', calendar=calendar)
+        Meeting.objects.create(event=event, start=datetime(2010, 1, 1, 19), group=self.board)
+        # The writes above pinned the primary.
+        cache.delete(routers.WRITE_KEY)
+        routers._local.__dict__.clear()
+
+    def tearDown(self):
+        db_router.routers.remove(self.router)
+        routers.REPLICA_DB = self.replica_db
+        cache.delete(routers.WRITE_KEY)
+        routers._local.__dict__.clear()
+
+    def test_view_reads_replica(self):
+        request = RequestFactory().get('/')
+        request.user = AnonymousUser()
+        replica = connections['replica']
+        debug, replica.use_debug_cursor = replica.use_debug_cursor, True
+        first = len(replica.queries)
+        try:
+            response = views.group_meeting_list(request, 'governing-board')
+        finally:
+            replica.use_debug_cursor = debug
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue('2010' in response.content.decode('utf-8'))
+        self.assertTrue(any(Meeting._meta.db_table in q['sql'] for q in replica.queries[first:]))
+        self.assertEqual(cache.get(routers.WRITE_KEY), None)
@@ -5,12 +5,20 @@ from committees import views
 
 urlpatterns = patterns('committees.views',
     url (r'^$', view=views.index, name='cm-index', ),
+    url (r'^search/$', view=views.search, name='cm-search', ),
+    url (r'^attachments/(?P<pk>\d+)/(?P<filename>[^/]+)$', view=views.attachment_download, name='cm-attachment-download', ),
+    url (r'^meetings\.(?P<format>ics|json)$', view=views.meetings_feed, name='cm-meetings-feed', ),
     url (r'^(?P<slug>[-\w]+)/officer/(?P<office_slug>[-\w]+)/$', view=views.term_detail, name='cm-term-detail', ),
     url (r'^(?P<slug>[-\w]+)/officer/(?P<office_slug>[-\w]+)/(?P<start_year>[\d]+)/$', view=views.term_detail, name='cm-term-archive-year', ),
     url (r'^(?P<slug>[-\w]+)/$', view=views.group_detail, name='cm-group-detail', ),
+    url (r'^(?P<slug>[-\w]+)/attendance/$', view=views.attendance_report, name='cm-attendance-report', ),
+    url (r'^(?P<slug>[-\w]+)/attendance/(?P<year>[\d]+)/$', view=views.attendance_report, name='cm-attendance-report-year', ),
     url (r'^(?P<slug>[-\w]+)/meetings/$', view=views.group_meeting_list, name='cm-group-meeting-list', ),
+    url (r'^(?P<slug>[-\w]+)/meetings\.(?P<format>ics|json)$', view=views.meetings_feed, name='cm-group-meetings-feed', ),
     url (r'^(?P<slug>[-\w]+)/meetings/(?P<year>[\d]+)/$', view=views.group_meeting_archive_year, name='cm-group-meeting-archive-year', ),
+    url (r'^(?P<slug>[-\w]+)/meetings/(?P<year>[\d]+)/packet\.zip$', view=views.group_year_packet, name='cm-group-year-packet', ),
     url (r'^(?P<slug>[-\w]+)/meetings/(?P<year>[\d]+)/(?P<month>[\w]+)/$', view=views.group_meeting_detail, name='cm-meeting-detail', ),
     url (r'^(?P<slug>[-\w]+)/meetings/(?P<year>[\d]+)/(?P<month>[\w]+)/print/$', view=views.group_meeting_detail, name='cm-meeting-print', ),
+    url (r'^(?P<slug>[-\w]+)/meetings/(?P<year>[\d]+)/(?P<month>[\w]+)/packet\.zip$', view=views.meeting_packet, name='cm-meeting-packet', ),
     
 )
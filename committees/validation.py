@@ -0,0 +1,149 @@
+'''Term limit and overlap checks.
+
+Terms are sorted per office and per person and group, then swept once:
+each term is compared only with the latest-ending term before it, so a
+full audit costs one query and a sort. Three rules are checked:
+
+* ``office-overlap``: two terms of one office running at once. Offices can
+  be shared (see ``Office.display_title``), so this is a warning unless
+  ``COMMITTEES_ALLOW_SHARED_OFFICES`` is False.
+* ``person-overlap``: one person holding two terms in a group at once.
+* ``term-limit``: more than ``COMMITTEES_TERM_LIMIT`` consecutive terms of a
+  person in a group. Terms are consecutive when one starts within
+  ``COMMITTEES_TERM_GAP_DAYS`` of the previous one ending. A limit of None
+  disables the rule.
+
+``validate_term()`` runs the same sweep over the terms sharing an office or
+person and group with one term, for ``Term.clean()``.
+'''
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+
+from committees.models import Term
+
+TERM_LIMIT = getattr(settings, 'COMMITTEES_TERM_LIMIT', 2)
+TERM_GAP_DAYS = getattr(settings, 'COMMITTEES_TERM_GAP_DAYS', 31)
+ALLOW_SHARED_OFFICES = getattr(settings, 'COMMITTEES_ALLOW_SHARED_OFFICES', True)
+
+ERROR = 'error'
+WARNING = 'warning'
+
+FIELDS = ('pk', 'group', 'office', 'person', 'start', 'end')
+
+class Violation(object):
+    def __init__(self, kind, severity, terms, message, **keys):
+        self.kind = kind
+        self.severity = severity
+        self.terms = terms
+        self.message = message
+        self.keys = keys
+
+    def as_dict(self):
+        data = {'kind': self.kind, 'severity': self.severity, 'terms': self.terms, 'message': self.message}
+        data.update(self.keys)
+        return data
+
+    def __repr__(self):
+        return '<Violation: %s %s>' % (self.kind, self.terms)
+
+def _end(row):
+    return row['end'] or date.max
+
+def _sweep_overlaps(rows):
+    '''Yields ``(earlier, later)`` pairs of overlapping rows, ``rows`` sorted by start.'''
+    latest = None
+    for row in rows:
+        if latest is not None and row['start'] <= _end(latest):
+            yield latest, row
+        if latest is None or _end(row) > _end(latest):
+            latest = row
+
+def _sweep_runs(rows, gap):
+    '''Yields runs of consecutive or overlapping rows, ``rows`` sorted by start.'''
+    run, run_end = [], None
+    for row in rows:
+        if run and run_end != date.max and row['start'] > run_end + gap:
+            yield run
+            run = []
+        if not run:
+            run_end = _end(row)
+        run.append(row)
+        run_end = max(run_end, _end(row))
+    if run:
+        yield run
+
+def _grouped(rows, key):
+    groups = {}
+    for row in rows:
+        if key(row) is not None:
+            groups.setdefault(key(row), []).append(row)
+    for k, group in groups.items():
+        group.sort(key=lambda row: (row['start'], _end(row), row['pk']))
+        yield k, group
+
+def check(rows, term_limit=TERM_LIMIT, gap_days=TERM_GAP_DAYS, allow_shared_offices=ALLOW_SHARED_OFFICES):
+    '''Violations among ``rows``, dicts with the keys of ``FIELDS``.'''
+    violations = []
+    for row in rows:
+        if row['end'] is not None and row['end'] < row['start']:
+            violations.append(Violation('invalid-range', ERROR, [row['pk']], 'The term ends before it starts.',
+                                        group=row['group'], person=row['person'], office=row['office']))
+
+    severity = allow_shared_offices and WARNING or ERROR
+    for office_id, terms in _grouped(rows, lambda row: row['office']):
+        for earlier, later in _sweep_overlaps(terms):
+            violations.append(Violation('office-overlap', severity, [earlier['pk'], later['pk']],
+                'The office is already held from %s to %s.' % (earlier['start'], earlier['end'] or 'now'),
+                office=office_id, group=later['group']))
+
+    gap = timedelta(days=gap_days)
+    for (person_id, group_id), terms in _grouped(rows, lambda row: row['person'] and (row['person'], row['group'])):
+        for earlier, later in _sweep_overlaps(terms):
+            violations.append(Violation('person-overlap', ERROR, [earlier['pk'], later['pk']],
+                'The person already holds a term in the group from %s to %s.' % (earlier['start'], earlier['end'] or 'now'),
+                person=person_id, group=group_id))
+        if term_limit is None:
+            continue
+        for run in _sweep_runs(terms, gap):
+            if len(run) > term_limit:
+                violations.append(Violation('term-limit', ERROR, [row['pk'] for row in run],
+                    '%s consecutive terms from %s, over the limit of %s.' % (len(run), run[0]['start'], term_limit),
+                    person=person_id, group=group_id))
+    return violations
+
+def audit(queryset=None, **options):
+    '''Checks every term, or those of ``queryset``, with one query.'''
+    queryset = queryset if queryset is not None else Term.objects.all()
+    return check(list(queryset.order_by().values(*FIELDS)), **options)
+
+def report(violations):
+    '''A JSON-serializable report of an audit.'''
+    counts = {}
+    for v in violations:
+        counts[v.kind] = counts.get(v.kind, 0) + 1
+    return {
+        'errors': len([v for v in violations if v.severity == ERROR]),
+        'warnings': len([v for v in violations if v.severity == WARNING]),
+        'counts': counts,
+        'violations': [v.as_dict() for v in violations],
+    }
+
+def validate_term(term):
+    '''Raises ValidationError when saving ``term`` would break a rule.'''
+    if term.start is None or term.group_id is None:
+        return
+    others = Term.objects.none()
+    if term.office_id:
+        others = others | Term.objects.filter(office=term.office_id)
+    if term.person_id:
+        others = others | Term.objects.filter(person=term.person_id, group=term.group_id)
+    if term.pk:
+        others = others.exclude(pk=term.pk)
+    rows = list(others.order_by().values(*FIELDS))
+    rows.append({'pk': term.pk, 'group': term.group_id, 'office': term.office_id, 'person': term.person_id,
+                 'start': term.start, 'end': term.end})
+    errors = [v.message for v in check(rows) if v.severity == ERROR and term.pk in v.terms]
+    if errors:
+        raise ValidationError(errors)
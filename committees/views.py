@@ -1,58 +1,179 @@
-from datetime import datetime
+from datetime import date, datetime
 
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import Http404, StreamingHttpResponse
 from django.template.context import RequestContext
-from django.views.generic import list_detail
 from django.shortcuts import render_to_response, get_object_or_404
 
-from committees.models import Group, Meeting, Minutes, Term
+from committees.cache import CACHE_TIMEOUT, cache_page_by_generation, cache_version
+from committees import search as committees_search
+from committees.downloads import serve_attachment
+from committees.feeds import feed_meetings, serve_feed
+from committees.instrumentation import instrumented_view
+from committees.models import Attachment, AttendanceRollup, Group, Meeting, Minutes, Term, is_board_member
+from committees.packets import group_year_files, meeting_files, stream_zip
+from committees.pagination import keyset_page
+from committees.routers import replica_reads
 
+INDEX_MEETINGS = getattr(settings, 'COMMITTEES_INDEX_MEETINGS', 10)
+# Attendance below this percentage is flagged, and breaks attendance streaks.
+ATTENDANCE_RATE = getattr(settings, 'COMMITTEES_ATTENDANCE_RATE', 75)
+
+@instrumented_view
+@replica_reads
+@cache_page_by_generation
 def index(request):
     objects = Group.active_objects.all().order_by('order')
-    past_meetings = Meeting.objects.filter(start__lte=datetime.now())
+    past_meetings = Meeting.objects.filter(start__lte=datetime.now()).select_related('group').order_by('-start')[:INDEX_MEETINGS]
+    committees_cache_version = cache_version()
+    committees_cache_timeout = CACHE_TIMEOUT
     return render_to_response('committees/index.html', locals(),
                               context_instance=RequestContext(request))
 
+@instrumented_view
+@replica_reads
+@cache_page_by_generation
 def group_detail(request, slug):
     object=Group.objects.get(slug=slug)
-    members=object.term_set.filter(start__lte=datetime.now(), end__gte=datetime.now())
+    roster=object.roster
+    committees_cache_version = cache_version()
+    committees_cache_timeout = CACHE_TIMEOUT
     meetings=object.meeting_set.filter(start__gte=datetime.now())
+    recent_meetings=keyset_page(object.meeting_set.all(), per_page=INDEX_MEETINGS)
 
     return render_to_response('committees/group_detail.html', locals(),
                               context_instance=RequestContext(request))
 
+@instrumented_view
+@replica_reads
 def group_meeting_list(request, slug):
     group = Group.objects.get(slug=slug)
-    objects = Meeting.objects.filter(group=group)
+    page = keyset_page(Meeting.objects.filter(group=group),
+                       after=request.GET.get('after'), before=request.GET.get('before'))
+    objects = page.object_list
+    # Their URLs need the group's slug.
+    for m in objects:
+        m.group = group
+    archive = Meeting.objects.filter(group=group).archive_counts()
     return render_to_response('committees/meeting_list.html', locals(),
                   context_instance=RequestContext(request))
 
+@instrumented_view
+@replica_reads
 def group_meeting_archive_year(request, slug, year):
     group = Group.objects.get(slug=slug)
-    objects = Meeting.objects.filter(group=group, start__year=year)
+    year = int(year)
+    page = keyset_page(Meeting.objects.filter(group=group, start__gte=datetime(year, 1, 1), start__lt=datetime(year + 1, 1, 1)),
+                       after=request.GET.get('after'), before=request.GET.get('before'))
+    objects = page.object_list
+    # Their URLs need the group's slug.
+    for m in objects:
+        m.group = group
+    archive = Meeting.objects.filter(group=group).archive_counts()
     return render_to_response('committees/meeting_list.html', locals(),
                   context_instance=RequestContext(request))
 
+@instrumented_view
+@replica_reads
 def group_meeting_detail(request, slug, year, month):
     object = Meeting.objects.get(group__slug=slug, start__year=year, start__month=month)
-    if request.user.is_authenticated():
-        if request.user.person_set.all()[0].on_board:
-            board_member=True
+    board_member = is_board_member(request.user, object.group_id)
     return render_to_response('committees/meeting_detail.html', locals(),
                   context_instance=RequestContext(request))
 
  
+@instrumented_view
+@replica_reads
 def minutes_detail(request, slug, year, month):
     meeting = Meeting.objects.get(meeting__group__slug=slug, start__year=year, start__month=month)
     object = Minutes.objects.get(meeting=meeting)
     return render_to_response('committees/minutes_detail.html', locals(),
                   context_instance=RequestContext(request))
 
+@instrumented_view
+@replica_reads
 def term_detail(request, slug, office_slug, start_year=None):
     if start_year:
-        term = Term.objects.get(office__slug=office_slug, group__slug=slug,  start__year=start_year)
+        term = Term.objects.started_in(start_year).get(office__slug=office_slug, group__slug=slug)
     else:
         terms = Term.objects.filter(office__slug=office_slug, group__slug=slug )
         if len(terms) == 1:
             term = terms[0]
     return render_to_response('committees/term_detail.html', locals(),
                   context_instance=RequestContext(request))
+
+@instrumented_view
+@replica_reads
+def search(request):
+    query = request.GET.get('q', '').strip()
+    group = None
+    if request.GET.get('group'):
+        group = get_object_or_404(Group, slug=request.GET['group'])
+    # Minutes are for board members, as on the meeting pages.
+    minutes_groups = None
+    if not request.user.is_staff:
+        minutes_groups = []
+        if request.user.is_authenticated():
+            minutes_groups = Term.objects.active_on().filter(person__user=request.user).values_list('group', flat=True)
+    objects = committees_search.search(query, group=group, public_only=not request.user.is_staff,
+                                       minutes_groups=minutes_groups)
+    return render_to_response('committees/search.html', locals(),
+                  context_instance=RequestContext(request))
+
+@instrumented_view
+def attachment_download(request, pk, filename=None):
+    attachment = get_object_or_404(Attachment.objects.select_related('minutes__meeting'), pk=pk)
+    if not request.user.is_staff:
+        # Attachments belong to the minutes, which only board members see.
+        if attachment.minutes.draft or not is_board_member(request.user, attachment.minutes.meeting.group_id):
+            raise Http404
+    return serve_attachment(request, attachment)
+
+def _check_packet_access(request, group_id):
+    # Packets carry the minutes, which only board members and staff see.
+    if not (request.user.is_staff or is_board_member(request.user, group_id)):
+        raise Http404
+
+def _packet_response(files, filename):
+    response = StreamingHttpResponse(stream_zip(files), content_type='application/zip')
+    response['Content-Disposition'] = 'attachment; filename="%s"' % filename
+    return response
+
+@instrumented_view
+def meeting_packet(request, slug, year, month):
+    meeting = get_object_or_404(Meeting.objects.select_related('group'), group__slug=slug, start__year=year, start__month=month)
+    _check_packet_access(request, meeting.group_id)
+    return _packet_response(meeting_files(meeting, include_drafts=request.user.is_staff),
+                            '%s-%s-%s-packet.zip' % (slug, year, month))
+
+@instrumented_view
+def group_year_packet(request, slug, year):
+    group = get_object_or_404(Group, slug=slug)
+    _check_packet_access(request, group.pk)
+    return _packet_response(group_year_files(group, int(year), include_drafts=request.user.is_staff),
+                            '%s-%s-packets.zip' % (slug, year))
+
+@instrumented_view
+@replica_reads
+def meetings_feed(request, format, slug=None):
+    meetings = feed_meetings(slug)
+    if slug is None:
+        title = u'Meetings'
+    else:
+        title = u'%s meetings' % get_object_or_404(Group, slug=slug)
+    return serve_feed(request, meetings, format, title)
+
+@instrumented_view
+@staff_member_required
+def attendance_report(request, slug, year=None):
+    group = get_object_or_404(Group, slug=slug)
+    year = year and int(year) or date.today().year
+    minimum_rate = ATTENDANCE_RATE
+    rollups = AttendanceRollup.objects.filter(group=group)
+    streaks = rollups.filter(year__lte=year).streaks(ATTENDANCE_RATE)
+    rows = [(r,) + streaks.get((r.person_id, r.group_id), (0, 0)) for r in
+            rollups.filter(year=year).with_rate().select_related('person').order_by('person__last_name', 'person__first_name')]
+    years = rollups.order_by('-year').values_list('year', flat=True).distinct()
+    return render_to_response('committees/attendance_report.html', locals(),
+                  context_instance=RequestContext(request))
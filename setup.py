@@ -23,7 +23,7 @@ setup(
 
     include_package_data=True,
 
-    packages=['committees'],
+    packages=find_packages(),
 
     zip_safe=True,
     classifiers=[